@@ -0,0 +1,217 @@
+import os
+import mmap
+import numpy as np
+from typing import *
+from datetime import datetime
+from qr_code.encoder import MessageTypes, OperationTypes, PayloadHeaderEncoder, BinaryEncoder
+
+# device log record, as the ACCESS message it was read from: header (1 byte) + user_id (4 bytes) + time (4 bytes)
+DUMP_RECORD_DTYPE = np.dtype([
+    ('header', 'u1'),
+    ('user_id', '>u4'),
+    ('time', '>u4'),
+])
+DUMP_RECORD_LENGTH = DUMP_RECORD_DTYPE.itemsize # 9 bytes
+
+# stored record: the dump record prefixed by the id of the device it came from
+STORE_RECORD_DTYPE = np.dtype([
+    ('device_id', '>u4'),
+    ('header', 'u1'),
+    ('user_id', '>u4'),
+    ('time', '>u4'),
+])
+
+# index entries: the sort key and the position of the record in the store
+USER_INDEX_DTYPE = np.dtype([('key', '<u8'), ('record', '<u4')]) # key = user_id << 32 | time
+TIME_INDEX_DTYPE = np.dtype([('key', '<u4'), ('record', '<u4')]) # key = time
+
+# only the recorded ACCESS operations are logged by the locks
+LOGGED_HEADERS = tuple(
+    (MessageTypes.ACCESS << 4) | operation
+    for operation in (OperationTypes.CHECK_IN, OperationTypes.CHECK_OUT)
+)
+
+RECORDS_FILE = 'records.bin'
+USER_INDEX_FILE = 'by_user.idx'
+TIME_INDEX_FILE = 'by_time.idx'
+
+
+class LogRecord(NamedTuple):
+    device_id: int
+    operation: int
+    user_id: int
+    time: int # POSIX seconds
+
+
+class LogRecordEncoder:
+    def get_record(operation: int, user_id: int, time: datetime) -> bytes:
+        """Encodes a device log record, with the layout of the ACCESS message that was read.
+
+        Args:
+            operation (int): the operation, CHECK_IN or CHECK_OUT
+            user_id (int): the user id
+            time (datetime): the time of the access
+
+        Returns:
+            bytes: the 9 bytes record
+        """
+        header = PayloadHeaderEncoder.get_header(message_type=MessageTypes.ACCESS, operation=operation)
+        return header + BinaryEncoder.encode_id(user_id) + BinaryEncoder.encode_time(time)
+
+
+class LogStore:
+    def __init__(self, directory: str, chunk_records: int = 1 << 20):
+        """Store of the CHECK_IN and CHECK_OUT records dumped from the locks, with on-disk indexes by
+        user and by time. Dumps are streamed through mmap, `chunk_records` records at a time, and
+        appended to a single file of fixed records; the indexes are sorted arrays of (key, record
+        position) mapped from disk, so a query is a binary search that reads O(log n) index pages plus
+        the matching records, never the whole store.
+
+        Args:
+            directory (str): the store directory, created if needed
+            chunk_records (int, optional): the number of records parsed at a time. Defaults to 2**20.
+        """
+        self.directory = directory
+        self.chunk_records = chunk_records
+        os.makedirs(directory, exist_ok=True)
+        self.records_path = os.path.join(directory, RECORDS_FILE)
+        self.user_index_path = os.path.join(directory, USER_INDEX_FILE)
+        self.time_index_path = os.path.join(directory, TIME_INDEX_FILE)
+        if not os.path.exists(self.records_path):
+            open(self.records_path, 'wb').close()
+
+
+    def ingest(self, dump_path: str, device_id: int, build_indexes: bool = True) -> int:
+        """Appends the records of a device log dump to the store. Records of other operations, such as
+        erased flash (0xff bytes), and a trailing partial record are skipped.
+
+        Args:
+            dump_path (str): the dump file, of 9 bytes records
+            device_id (int): the id of the device the dump came from
+            build_indexes (bool, optional): if the indexes are rebuilt after the ingestion; set it to
+            False to ingest many dumps and then call `build_indexes` once. Defaults to True.
+
+        Returns:
+            int: the number of ingested records
+        """
+        records = LogStore.map_array(dump_path, DUMP_RECORD_DTYPE)
+        ingested = 0
+        with open(self.records_path, 'ab') as store_file:
+            for start in range(0, len(records), self.chunk_records):
+                chunk = records[start:start + self.chunk_records]
+                chunk = chunk[np.isin(chunk['header'], LOGGED_HEADERS)]
+                stored = np.empty(len(chunk), dtype=STORE_RECORD_DTYPE)
+                stored['device_id'] = device_id
+                stored['header'] = chunk['header']
+                stored['user_id'] = chunk['user_id']
+                stored['time'] = chunk['time']
+                store_file.write(stored.tobytes())
+                ingested += len(chunk)
+
+        if build_indexes:
+            self.build_indexes()
+        return ingested
+
+
+    def build_indexes(self):
+        """Rebuilds the indexes by (user_id, time) and by time. Sorting keeps the keys and positions
+        in memory, 12 bytes per record, but not the records themselves.
+        """
+        records = self.map_records()
+        user_keys = (records['user_id'].astype('<u8') << 32) | records['time'].astype('<u8')
+        order = np.argsort(user_keys, kind='stable')
+        LogStore.write_index(self.user_index_path, USER_INDEX_DTYPE, user_keys[order], order)
+        del user_keys, order
+
+        time_keys = records['time'].astype('<u4')
+        order = np.argsort(time_keys, kind='stable')
+        LogStore.write_index(self.time_index_path, TIME_INDEX_DTYPE, time_keys[order], order)
+
+
+    def write_index(path: str, dtype: np.dtype, keys: np.ndarray, positions: np.ndarray):
+        index = np.empty(len(keys), dtype=dtype)
+        index['key'] = keys
+        index['record'] = positions
+        temporary_path = path + '.tmp'
+        index.tofile(temporary_path)
+        os.replace(temporary_path, path)
+
+
+    def map_records(self) -> np.ndarray:
+        return LogStore.map_array(self.records_path, STORE_RECORD_DTYPE)
+
+
+    def map_array(path: str, dtype: np.dtype) -> np.ndarray:
+        """Maps a file of fixed records as a read-only NumPy array. The mapping is released along
+        with the last view of the array.
+
+        Args:
+            path (str): the file
+            dtype (np.dtype): the record type
+
+        Returns:
+            np.ndarray: the records
+        """
+        with open(path, 'rb') as file:
+            count = os.fstat(file.fileno()).st_size // dtype.itemsize
+            if count == 0:
+                return np.empty(0, dtype=dtype)
+            return np.frombuffer(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ), dtype=dtype, count=count)
+
+
+    def get_user_records(
+        self,
+        user_id: int,
+        start: Optional[Union[int, datetime]] = None,
+        end: Optional[Union[int, datetime]] = None
+    ) -> List[LogRecord]:
+        """Gets the records of a user, by time, optionally within [start, end).
+
+        Args:
+            user_id (int): the user id
+            start (Optional[Union[int, datetime]], optional): the first time. Defaults to None.
+            end (Optional[Union[int, datetime]], optional): the end time. Defaults to None.
+
+        Returns:
+            List[LogRecord]: the records
+        """
+        if not 0 <= user_id <= 0xffffffff:
+            return []
+        start = 0 if start is None else max(0, LogStore.get_posix_time(start))
+        end = 1 << 32 if end is None else min(1 << 32, LogStore.get_posix_time(end))
+        return self.search(self.user_index_path, USER_INDEX_DTYPE, (user_id << 32) + start, (user_id << 32) + end)
+
+
+    def get_time_range_records(self, start: Union[int, datetime], end: Union[int, datetime]) -> List[LogRecord]:
+        """Gets the records of all users within [start, end), by time.
+
+        Args:
+            start (Union[int, datetime]): the first time
+            end (Union[int, datetime]): the end time
+
+        Returns:
+            List[LogRecord]: the records
+        """
+        start, end = LogStore.get_posix_time(start), LogStore.get_posix_time(end)
+        return self.search(self.time_index_path, TIME_INDEX_DTYPE, max(0, start), min(end, 1 << 32))
+
+
+    def search(self, index_path: str, dtype: np.dtype, first_key: int, end_key: int) -> List[LogRecord]:
+        if not os.path.exists(index_path) or first_key >= end_key:
+            return []
+        index = LogStore.map_array(index_path, dtype)
+        first = int(np.searchsorted(index['key'], first_key, side='left'))
+        end = int(np.searchsorted(index['key'], end_key, side='left'))
+        matches = self.map_records()[index['record'][first:end]]
+        return [
+            LogRecord(device_id, header & 0x0f, user_id, time)
+            for device_id, header, user_id, time in matches.tolist()
+        ]
+
+
+    def get_posix_time(time: Union[int, datetime]) -> int:
+        return int(time.timestamp()) if type(time) == datetime else int(time)
+
+
+    def __len__(self) -> int:
+        return os.path.getsize(self.records_path) // STORE_RECORD_DTYPE.itemsize
@@ -0,0 +1,228 @@
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import *
+from datetime import datetime, timedelta
+from qr_code.encoder import OperationTypes
+from access_log.log_store import LogRecord
+
+# children of each node of the occupancy max tree
+MAX_TREE_FANOUT = 64
+
+
+class Session(NamedTuple):
+    user_id: int
+    check_in: int # POSIX seconds
+    check_out: int # POSIX seconds
+    timed_out: bool
+
+
+class OccupancyMaxTree:
+    def __init__(self):
+        """Append-only sequence of occupancy values with range maximum queries. Level 0 holds the
+        values and each upper level the maximum of `MAX_TREE_FANOUT` entries of the level below, so an
+        append updates one entry per level, about 4 for a semester of events, and a query scans at
+        most two partial blocks per level.
+        """
+        self.levels: List[List[int]] = [[]]
+
+
+    def append(self, value: int):
+        index = len(self.levels[0])
+        for level in self.levels:
+            if index == len(level):
+                level.append(value)
+            elif value > level[index]:
+                level[index] = value
+            index //= MAX_TREE_FANOUT
+        if len(self.levels[-1]) > 1:
+            self.levels.append([max(self.levels[-1])])
+
+
+    def get_max(self, first: int, end: int) -> int:
+        """Gets the maximum of the values in [first, end).
+
+        Args:
+            first (int): the first index
+            end (int): the end index
+
+        Returns:
+            int: the maximum, or 0 for an empty range
+        """
+        peak = 0
+        for level in self.levels:
+            if first >= end:
+                break
+            first_block = -(-first // MAX_TREE_FANOUT)
+            end_block = end // MAX_TREE_FANOUT
+            if first_block >= end_block:
+                return max(peak, max(level[first:end]))
+            peak = max(peak, max(level[first:first_block * MAX_TREE_FANOUT], default=0), max(level[end_block * MAX_TREE_FANOUT:end], default=0))
+            first, end = first_block, end_block
+        return peak
+
+
+    def __len__(self) -> int:
+        return len(self.levels[0])
+
+
+class OccupancyTracker:
+    def __init__(self, timeout: timedelta = timedelta(hours=4), capacity: Optional[int] = None):
+        """Incremental occupancy of the room from the stream of CHECK_IN and CHECK_OUT events, which
+        must come in time order. Each event updates the open sessions and the occupancy in O(1): the
+        sessions are kept in check-in order, so the ones open for longer than `timeout` (missing
+        check-outs) are always at the front and expire at check-in + timeout as the clock advances.
+        Every occupancy change is appended to a max tree, so the peak occupancy of any time window is
+        answered without replaying the history.
+
+        Args:
+            timeout (timedelta, optional): the time after which a session with no check-out is closed.
+            Defaults to 4 hours.
+            capacity (Optional[int], optional): the capacity of the room. Defaults to None.
+        """
+        self.timeout = int(timeout.total_seconds())
+        self.capacity = capacity
+        self.sessions: OrderedDict[int, int] = OrderedDict() # user id -> check-in time, in check-in order
+        self.now = 0
+        self.change_times: List[int] = []
+        self.occupancies = OccupancyMaxTree()
+        self.timed_out_sessions = 0
+        self.unmatched_check_outs = 0
+
+
+    def get_posix_time(time: Union[int, datetime]) -> int:
+        return int(time.timestamp()) if type(time) == datetime else int(time)
+
+
+    def advance(self, time: Union[int, datetime]) -> List[Session]:
+        """Advances the clock, closing the sessions that timed out until then.
+
+        Args:
+            time (Union[int, datetime]): the current time
+
+        Raises:
+            ValueError: if the time is before the last event
+
+        Returns:
+            List[Session]: the timed out sessions
+        """
+        time = OccupancyTracker.get_posix_time(time)
+        if time < self.now:
+            raise ValueError(f'event at {time} is before the last event, at {self.now}')
+        self.now = time
+
+        timed_out = []
+        while self.sessions:
+            user_id, check_in = next(iter(self.sessions.items()))
+            expiration = check_in + self.timeout
+            if expiration > time:
+                break
+            del self.sessions[user_id]
+            self.record_change(expiration)
+            timed_out.append(Session(user_id, check_in, expiration, True))
+        self.timed_out_sessions += len(timed_out)
+        return timed_out
+
+
+    def record_change(self, time: int):
+        self.change_times.append(max(time, self.change_times[-1]) if self.change_times else time)
+        self.occupancies.append(len(self.sessions))
+
+
+    def check_in(self, user_id: int, time: Union[int, datetime]):
+        """Opens the session of a user. A check-in of a user already inside restarts the session.
+
+        Args:
+            user_id (int): the user id
+            time (Union[int, datetime]): the event time
+        """
+        self.advance(time)
+        if user_id in self.sessions:
+            del self.sessions[user_id]
+            self.sessions[user_id] = self.now
+            return
+        self.sessions[user_id] = self.now
+        self.record_change(self.now)
+
+
+    def check_out(self, user_id: int, time: Union[int, datetime]) -> Optional[Session]:
+        """Closes the session of a user. Check-outs with no open session (such as after a timeout) are
+        counted and ignored.
+
+        Args:
+            user_id (int): the user id
+            time (Union[int, datetime]): the event time
+
+        Returns:
+            Optional[Session]: the closed session, if there was one
+        """
+        self.advance(time)
+        check_in = self.sessions.pop(user_id, None)
+        if check_in is None:
+            self.unmatched_check_outs += 1
+            return None
+        self.record_change(self.now)
+        return Session(user_id, check_in, self.now, False)
+
+
+    def process(self, record: LogRecord) -> Optional[Session]:
+        """Processes a log record. Operations other than CHECK_IN and CHECK_OUT are ignored.
+
+        Args:
+            record (LogRecord): the record
+
+        Returns:
+            Optional[Session]: the session closed by a check-out, if any
+        """
+        if record.operation == OperationTypes.CHECK_IN:
+            self.check_in(record.user_id, record.time)
+        elif record.operation == OperationTypes.CHECK_OUT:
+            return self.check_out(record.user_id, record.time)
+        return None
+
+
+    def process_records(self, records: Iterable[LogRecord]) -> List[Session]:
+        return [session for session in map(self.process, records) if session is not None]
+
+
+    def get_occupancy(self, now: Optional[Union[int, datetime]] = None) -> int:
+        if now is not None:
+            self.advance(now)
+        return len(self.sessions)
+
+
+    def get_users_inside(self, now: Optional[Union[int, datetime]] = None) -> List[int]:
+        """Gets who is inside the room, in check-in order.
+
+        Args:
+            now (Optional[Union[int, datetime]], optional): the current time, to close the timed out
+            sessions first. Defaults to the last event time.
+
+        Returns:
+            List[int]: the user ids
+        """
+        if now is not None:
+            self.advance(now)
+        return list(self.sessions)
+
+
+    def is_full(self, now: Optional[Union[int, datetime]] = None) -> bool:
+        return self.capacity is not None and self.get_occupancy(now) >= self.capacity
+
+
+    def get_peak_occupancy(self, start: Union[int, datetime], end: Union[int, datetime]) -> int:
+        """Gets the peak occupancy within [start, end), in O(log n) of the number of changes. Sessions
+        still open past their timeout only count as closed once the clock advances past it.
+
+        Args:
+            start (Union[int, datetime]): the window start
+            end (Union[int, datetime]): the window end
+
+        Returns:
+            int: the peak occupancy
+        """
+        start = OccupancyTracker.get_posix_time(start)
+        end = OccupancyTracker.get_posix_time(end)
+        if start >= end:
+            return 0
+        first = max(bisect_right(self.change_times, start) - 1, 0) # the occupancy in effect at start
+        return self.occupancies.get_max(first, bisect_left(self.change_times, end))
@@ -0,0 +1,256 @@
+import os
+import mmap
+import struct
+from typing import *
+from auth.secret_key import SecretKey
+from auth.signer import KeyedSigner
+
+# file header: magic, version, reserved, capacity (slots), used slots
+HEADER_STRUCT = struct.Struct('<4sHHII')
+MAGIC = b'CKRG'
+VERSION = 1
+
+# slot: device id, flags (used bit + one bit per present key type), padding, the 4 keys of 20 bytes
+SLOT_STRUCT = struct.Struct('<IB3x')
+KEY_LENGTH = 20
+KEY_TYPES_COUNT = 4 # PrivateKeyTypes: MASTER_KEY, ACCESS_KEY, SYNC_KEY, CONFIG_KEY
+SLOT_LENGTH = SLOT_STRUCT.size + KEY_TYPES_COUNT * KEY_LENGTH # 88 bytes
+USED_FLAG = 0x80
+
+HASH_MULTIPLIER = 0x9e3779b1 # Fibonacci hashing of the 32 bits device ids
+
+
+class KeyRing:
+    def __init__(self, path: str, writable: bool = False):
+        """Secret keys of many devices (one ESP32-CAM per room), in a memory-mapped file of fixed
+        records. The file is an open addressing hash table of device slots, each holding the four
+        `PrivateKeyTypes` keys of a device, so a lookup hashes the device id and reads one or a few
+        88 bytes slots: it takes O(1) and only touches the pages of those slots, whatever the file size.
+        The keys are stored as raw bytes, and the signers of the looked up keys are cached, so no hex
+        strings are parsed and no HMAC key states are recomputed per request. Create the file with
+        `KeyRing.create`.
+
+        Args:
+            path (str): the key ring file
+            writable (bool, optional): if the keys can be changed. Defaults to False.
+
+        Raises:
+            ValueError: if the file is not a key ring, or is truncated
+        """
+        self.path = path
+        self.writable = writable
+        self.file = open(path, 'r+b' if writable else 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        if size < HEADER_STRUCT.size:
+            self.file.close()
+            raise ValueError(f'{path} is not a key ring file')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        magic, version, _, self.capacity, _ = HEADER_STRUCT.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f'{path} is not a key ring file')
+        if self.capacity & (self.capacity - 1) or size < HEADER_STRUCT.size + self.capacity * SLOT_LENGTH:
+            self.close()
+            raise ValueError(f'{path} is truncated or has a corrupted header')
+        self.shift = 32 - (self.capacity.bit_length() - 1)
+        self.signers: Dict[Tuple[int, int], KeyedSigner] = {}
+
+
+    def create(path: str, capacity: int = 1024) -> 'KeyRing':
+        """Creates an empty key ring file, with room for at least `capacity` devices, and opens it
+        for writing. The number of slots is the power of two above twice the capacity, which keeps
+        the probe sequences short.
+
+        Args:
+            path (str): the key ring file
+            capacity (int, optional): the number of devices. Defaults to 1024.
+
+        Returns:
+            KeyRing: the writable key ring
+        """
+        slots = 1 << max(3, (2 * capacity - 1).bit_length())
+        with open(path, 'wb') as file:
+            file.write(HEADER_STRUCT.pack(MAGIC, VERSION, 0, slots, 0))
+            file.truncate(HEADER_STRUCT.size + slots * SLOT_LENGTH)
+        return KeyRing(path, writable=True)
+
+
+    def find_slot(self, device_id: int) -> Tuple[int, bool]:
+        """Finds the slot of a device, by linear probing from its hash.
+
+        Args:
+            device_id (int): the device id
+
+        Raises:
+            ValueError: if the device is not in the key ring and it has no free slot
+
+        Returns:
+            Tuple[int, bool]: the slot offset in the file and if it is used by the device
+        """
+        if not 0 <= device_id <= 0xffffffff:
+            raise ValueError(f'device id {device_id} is not an unsigned 32 bits integer')
+        mask = self.capacity - 1
+        index = ((device_id * HASH_MULTIPLIER) & 0xffffffff) >> self.shift
+        for _ in range(self.capacity):
+            offset = HEADER_STRUCT.size + index * SLOT_LENGTH
+            slot_device_id, flags = SLOT_STRUCT.unpack_from(self.map, offset)
+            if not flags & USED_FLAG:
+                return offset, False
+            if slot_device_id == device_id:
+                return offset, True
+            index = (index + 1) & mask
+        raise ValueError(f'the key ring {self.path} is full')
+
+
+    def get_key_bytes(self, device_id: int, key_type: int) -> bytes:
+        """Gets a key of a device.
+
+        Args:
+            device_id (int): the device id
+            key_type (int): the key type, from `PrivateKeyTypes`
+
+        Raises:
+            KeyError: if the device has no key of the given type
+
+        Returns:
+            bytes: the 20 bytes key
+        """
+        if not 0 <= key_type < KEY_TYPES_COUNT:
+            raise KeyError((device_id, key_type))
+        try:
+            offset, used = self.find_slot(device_id)
+        except ValueError:
+            raise KeyError((device_id, key_type)) from None
+        if not used or not self.map[offset + 4] & (1 << key_type):
+            raise KeyError((device_id, key_type))
+        key_offset = offset + SLOT_STRUCT.size + key_type * KEY_LENGTH
+        return self.map[key_offset:key_offset + KEY_LENGTH]
+
+
+    def get_key(self, device_id: int, key_type: int) -> SecretKey:
+        return SecretKey(self.get_key_bytes(device_id, key_type))
+
+
+    def get_signer(self, device_id: int, key_type: int) -> KeyedSigner:
+        """Gets the signer of a key of a device, cached after the first lookup. Keys changed by other
+        processes are only seen after `clear_cache`.
+
+        Args:
+            device_id (int): the device id
+            key_type (int): the key type, from `PrivateKeyTypes`
+
+        Raises:
+            KeyError: if the device has no key of the given type
+
+        Returns:
+            KeyedSigner: the signer
+        """
+        signer = self.signers.get((device_id, key_type))
+        if signer is None:
+            signer = self.signers[(device_id, key_type)] = KeyedSigner(self.get_key_bytes(device_id, key_type))
+        return signer
+
+
+    def clear_cache(self):
+        self.signers.clear()
+
+
+    def get_keys(self, device_id: int) -> Dict[int, KeyedSigner]:
+        """Gets the signers of all the keys of a device, as accepted by `PayloadDecoder.verify`.
+
+        Args:
+            device_id (int): the device id
+
+        Returns:
+            Dict[int, KeyedSigner]: the signers, by `PrivateKeyTypes`
+        """
+        keys = {}
+        for key_type in range(KEY_TYPES_COUNT):
+            try:
+                keys[key_type] = self.get_signer(device_id, key_type)
+            except KeyError:
+                pass
+        return keys
+
+
+    def set_key(self, device_id: int, key_type: int, key: Union[SecretKey, bytes, memoryview, str]):
+        """Sets a key of a device, adding the device if it is new.
+
+        Args:
+            device_id (int): the device id
+            key_type (int): the key type, from `PrivateKeyTypes`
+            key (Union[SecretKey, bytes, memoryview, str]): the key, as a `SecretKey`, bytes or a hex str
+
+        Raises:
+            ValueError: if the key ring is read only or full, or the key type is unknown
+        """
+        if not self.writable:
+            raise ValueError(f'the key ring {self.path} is read only')
+        if not 0 <= key_type < KEY_TYPES_COUNT:
+            raise ValueError(f'unknown key type {key_type}')
+        if type(key) == SecretKey:
+            key_bytes = key.value
+        elif type(key) == memoryview:
+            key_bytes = key
+        else:
+            key_bytes = SecretKey.cast_key_to_bytes(key)
+        if len(key_bytes) != KEY_LENGTH:
+            raise ValueError(f'the key has {len(key_bytes)} bytes, instead of {KEY_LENGTH}')
+
+        offset, used = self.find_slot(device_id)
+        flags = self.map[offset + 4] if used else USED_FLAG
+        key_offset = offset + SLOT_STRUCT.size + key_type * KEY_LENGTH
+        self.map[key_offset:key_offset + KEY_LENGTH] = key_bytes
+        SLOT_STRUCT.pack_into(self.map, offset, device_id, flags | (1 << key_type))
+        if not used:
+            _, _, _, _, used_slots = HEADER_STRUCT.unpack_from(self.map, 0)
+            HEADER_STRUCT.pack_into(self.map, 0, MAGIC, VERSION, 0, self.capacity, used_slots + 1)
+        self.signers.pop((device_id, key_type), None)
+
+
+    def set_keys(self, device_id: int, keys: Dict[int, Union[SecretKey, bytes, memoryview, str]]):
+        """Sets many keys of a device.
+
+        Args:
+            device_id (int): the device id
+            keys (Dict[int, Union[SecretKey, bytes, memoryview, str]]): the keys, by `PrivateKeyTypes`
+        """
+        for key_type, key in keys.items():
+            self.set_key(device_id, key_type, key)
+
+
+    def get_device_ids(self) -> Iterator[int]:
+        """Iterates over the ids of the devices in the key ring, in slot order.
+        """
+        for index in range(self.capacity):
+            device_id, flags = SLOT_STRUCT.unpack_from(self.map, HEADER_STRUCT.size + index * SLOT_LENGTH)
+            if flags & USED_FLAG:
+                yield device_id
+
+
+    def __len__(self) -> int:
+        return HEADER_STRUCT.unpack_from(self.map, 0)[4]
+
+
+    def __contains__(self, device_id: int) -> bool:
+        try:
+            return self.find_slot(device_id)[1]
+        except ValueError:
+            return False
+
+
+    def flush(self):
+        self.map.flush()
+
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+    def __enter__(self) -> 'KeyRing':
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -3,6 +3,9 @@ import hashlib
 from typing import *
 
 class SecretKey:
+    __slots__ = ('value',)
+    
+    
     def __init__(self, key: bytes = None):
         self.value = SecretKey.cast_key_to_bytes(key) if key else SecretKey.generate_key()
     
@@ -53,19 +56,13 @@ class SecretKey:
 
         Args:
             length (int, optional): the length, in bytes, of the secret key. Defaults to 20.
-            byte_order (Literal['little', 'big'], optional): the endianness of the bytes. Defaults to 'big'.
+            byte_order (Literal['little', 'big'], optional): ignored, as random bytes have no endianness;
+            kept for compatibility. Defaults to 'big'.
 
         Returns:
             bytes: the new pseudo-random secret key
         """
-        bits_length = 8 * length
-        random_int = secrets.randbits(bits_length)
-        encoded_int = random_int.to_bytes(
-            length=length,
-            byteorder=byte_order,
-            signed=False
-        )
-        return encoded_int
+        return secrets.token_bytes(length)
     
     
     def get_hex_str(key: bytes) -> str:
@@ -84,7 +81,7 @@ class SecretKey:
             >>> print(hex_str)
             9c d0 df bf f5 50 6e 73 09 b7 25 e1 2b 38 e9 02 1f 9b c6 8d
         """
-        hex_str = ''.join(f'{byte:02x} ' for byte in key)
+        hex_str = key.hex(' ') + ' ' if key else ''
         return hex_str
     
     
@@ -1,5 +1,7 @@
 import hmac
 import hashlib
+from typing import *
+from auth.secret_key import SecretKey
 
 class Signer:
     def sign(message: bytes, key: bytes) -> bytes:
@@ -31,4 +33,56 @@ class Signer:
         hmac_obj = hmac.new(key, message, hashlib.sha1)
         expected_signature = hmac_obj.digest()
         validity = hmac.compare_digest(expected_signature, received_signature)
-        return validity
\ No newline at end of file
+        return validity
+
+class KeyedSigner:
+    BLOCK_SIZE = 64 # SHA1 block size, in bytes
+    IPAD_TABLE = bytes(byte ^ 0x36 for byte in range(256))
+    OPAD_TABLE = bytes(byte ^ 0x5C for byte in range(256))
+
+
+    def __init__(self, key: Union[bytes, SecretKey]):
+        """Signer bound to a single secret key. The key is absorbed once, precomputing the inner
+        (key XOR ipad) and outer (key XOR opad) SHA1 states of the HMAC, so each signature only
+        copies the saved states instead of padding the key and compressing both blocks again.
+
+        Args:
+            key (Union[bytes, SecretKey]): the secret key
+        """
+        key = key.value if type(key) == SecretKey else key
+        if len(key) > KeyedSigner.BLOCK_SIZE:
+            key = hashlib.sha1(key).digest()
+        padded_key = key.ljust(KeyedSigner.BLOCK_SIZE, b'\x00')
+        self.inner = hashlib.sha1(padded_key.translate(KeyedSigner.IPAD_TABLE))
+        self.outer = hashlib.sha1(padded_key.translate(KeyedSigner.OPAD_TABLE))
+
+
+    def sign(self, message: bytes) -> bytes:
+        """Signs the message with HMAC-SHA1, using the precomputed key states
+
+        Args:
+            message (bytes): the bytes of the message
+
+        Returns:
+            bytes: the signature, as bytes
+        """
+        inner = self.inner.copy()
+        inner.update(message)
+        outer = self.outer.copy()
+        outer.update(inner.digest())
+        return outer.digest()
+
+
+    def verify_signature(self, message: bytes, received_signature: bytes) -> bool:
+        """Verifies if the signature of the message is valid, with HMAC-SHA1
+
+        Args:
+            message (bytes): the received message
+            received_signature (bytes): the received signature
+
+        Returns:
+            bool: True if the signature is valid, False otherwise
+        """
+        expected_signature = self.sign(message)
+        validity = hmac.compare_digest(expected_signature, received_signature)
+        return validity
@@ -0,0 +1,110 @@
+"""Measures how fast the generation server issues codes for a fleet of emulated locks and how fast the
+locks verify them. Every device gets its own keys in a temporary key ring; the server signs each
+code with the keys of its `device_id`, in process (no sockets), and the code is scanned by the lock of
+that device, then scanned again to check it is rejected as reused. Reports codes/sec of issuing and
+scanning and the memory of a lock:
+
+    python src/benchmarks/fleet_benchmark.py --devices 5000 --codes-per-device 4
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+from typing import *
+from concurrent.futures import ThreadPoolExecutor
+from auth.key_ring import KeyRing, KEY_LENGTH, KEY_TYPES_COUNT
+from server.http_server import GenerationServer
+from emulator.lock_emulator import LockFleet
+
+OPERATIONS = ('check_in', 'check_out', 'bi_access')
+
+
+async def issue_codes(server: GenerationServer, targets: List[Tuple[int, str]]) -> List[Tuple[int, bytes]]:
+    codes = []
+    for device_id, target in targets:
+        status, _, body = await server.handle_request('GET', target)
+        if status != 200:
+            raise RuntimeError(f'{target}: {status} {body.decode()}')
+        codes.append((device_id, bytes.fromhex(json.loads(body)['payload'])))
+    return codes
+
+
+def run(devices: int, codes_per_device: int, seed: int = 0) -> Dict[str, Any]:
+    """Issues `codes_per_device` ACCESS codes for each of `devices` locks and scans them twice.
+
+    Args:
+        devices (int): the number of emulated locks
+        codes_per_device (int): the codes issued for each lock
+        seed (int, optional): the seed of the users and operations. Defaults to 0.
+
+    Returns:
+        Dict[str, Any]: the issue and scan rates, the scan outcomes and the memory of a lock
+    """
+    generator = random.Random(seed)
+    now = int(time.time())
+    with tempfile.TemporaryDirectory() as directory:
+        key_ring = KeyRing.create(os.path.join(directory, 'keys.ring'), capacity=2 * devices)
+        for device_id in range(devices):
+            key_ring.set_keys(device_id, {key_type: os.urandom(KEY_LENGTH) for key_type in range(KEY_TYPES_COUNT)})
+
+        tracemalloc.start()
+        fleet = LockFleet.from_key_ring(key_ring)
+        fleet_memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        targets = [
+            (device_id, f'/{generator.choice(OPERATIONS)}?device_id={device_id}'
+                        f'&user_id={generator.getrandbits(32)}&generated_at={now - generator.randrange(60)}')
+            for _ in range(codes_per_device)
+            for device_id in range(devices)
+        ]
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            server = GenerationServer(keys={}, executor=executor, key_ring=key_ring)
+            start = time.perf_counter()
+            codes = asyncio.run(issue_codes(server, targets))
+            issue_seconds = time.perf_counter() - start
+        key_ring.close()
+
+    start = time.perf_counter()
+    for device_id, payload in codes:
+        fleet.scan(device_id, payload, now)
+    scan_seconds = time.perf_counter() - start
+    accepted = fleet.accepted
+
+    for device_id, payload in codes:
+        fleet.scan(device_id, payload, now)
+
+    return {
+        'devices': devices,
+        'codes': len(codes),
+        'issue_per_sec': len(codes) / issue_seconds,
+        'scan_per_sec': len(codes) / scan_seconds,
+        'accepted': accepted,
+        'rejections': dict(fleet.rejections),
+        'idle_lock_bytes': fleet_memory / devices,
+        'log_bytes': sum(len(lock.log) for lock in fleet.locks.values()),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='CAUSP-LOCK code issuing and verification against an emulated fleet')
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--codes-per-device', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='path of the JSON results')
+    args = parser.parse_args()
+
+    results = run(args.devices, args.codes_per_device, args.seed)
+    print(f'{results["devices"]:,} locks, {results["codes"]:,} codes: issued {results["issue_per_sec"]:,.0f}/s, '
+          f'scanned {results["scan_per_sec"]:,.0f}/s, {results["accepted"]:,} accepted, '
+          f'{results["idle_lock_bytes"]:,.0f} B per idle lock, {results["log_bytes"]:,} B of logs', file=sys.stderr)
+    print(f'second scans: {results["rejections"]}', file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
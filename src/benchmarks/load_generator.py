@@ -0,0 +1,266 @@
+"""Load test of the QR Code generation: a population of users requests CHECK_IN, CHECK_OUT and
+BI_ACCESS codes at an open-loop rate, with bursts at the reservation slot boundaries, against the
+in-process pipeline (`encode`: the payload; `render`: the payload and its PNG) or a running generation
+server (`http`). Requests are sent when they are due whether or not the previous ones have completed,
+and latencies are measured from that due time, so a stalled generator shows up in the percentiles
+instead of silently lowering the offered load (coordinated omission). The service times, measured
+from the actual send, are reported along with them:
+
+    python src/benchmarks/load_generator.py --target render --rate 200 --duration 30
+    python src/benchmarks/load_generator.py --target http --url http://127.0.0.1:8080 --rate 500 --connections 16
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from typing import *
+from datetime import datetime
+from urllib.parse import urlsplit
+from qr_code.generator import QRCODE_CHECK_IN, QRCODE_CHECK_OUT, QRCODE_BI_ACCESS
+from qr_code.png_writer import INTERACTIVE_COMPRESS_LEVEL
+
+# share of each operation in the requests
+OPERATION_WEIGHTS = {
+    'check_in': 0.45,
+    'check_out': 0.45,
+    'bi_access': 0.10,
+}
+QRCODE_CLASSES = {
+    'check_in': QRCODE_CHECK_IN,
+    'check_out': QRCODE_CHECK_OUT,
+    'bi_access': QRCODE_BI_ACCESS,
+}
+PERCENTILES = {'p50': 0.50, 'p95': 0.95, 'p99': 0.99, 'p999': 0.999}
+
+
+class Arrival(NamedTuple):
+    time: float # seconds from the start of the run at which the request is due
+    user_id: int
+    operation: str
+
+
+class LoadResult(NamedTuple):
+    response_times: List[float] # seconds from the due time to the response, corrected for coordinated omission
+    service_times: List[float] # seconds from the send to the response
+    errors: int
+    elapsed: float # seconds from the start of the run to the last response
+
+
+def get_arrivals(
+    rate: float,
+    duration: float,
+    users: int,
+    slot_period: float = 60.0,
+    burst_width: float = 5.0,
+    burst_factor: float = 10.0,
+    seed: int = 0
+) -> List[Arrival]:
+    """Draws the requests of a run: a Poisson process whose rate is `burst_factor` times higher during
+    the first `burst_width` seconds of each slot, when the users of the ending reservation check out and
+    those of the next one check in. The rates are scaled so the mean rate is `rate`.
+
+    Args:
+        rate (float): the mean requests per second
+        duration (float): the seconds of the run
+        users (int): the size of the user population
+        slot_period (float, optional): the seconds between slot boundaries, the first at 0. Defaults to 60.
+        burst_width (float, optional): the seconds of the burst after each boundary. Defaults to 5.
+        burst_factor (float, optional): the rate during the bursts over the rate between them. Defaults to 10.
+        seed (int, optional): the random seed. Defaults to 0.
+
+    Returns:
+        List[Arrival]: the requests, by due time
+    """
+    generator = random.Random(seed)
+    user_ids = [generator.getrandbits(32) for _ in range(users)]
+    operations, weights = list(OPERATION_WEIGHTS), list(OPERATION_WEIGHTS.values())
+    burst_share = min(burst_width, slot_period) / slot_period
+    base_rate = rate / (1 + burst_share * (burst_factor - 1))
+    peak_rate = base_rate * max(burst_factor, 1)
+
+    # thinning: candidates at the peak rate, each kept with the probability of the rate at its time
+    arrivals = []
+    arrival_time = generator.expovariate(peak_rate)
+    while arrival_time < duration:
+        in_burst = arrival_time % slot_period < burst_width
+        if generator.random() * peak_rate < (base_rate * burst_factor if in_burst else base_rate):
+            operation = generator.choices(operations, weights)[0]
+            arrivals.append(Arrival(arrival_time, generator.choice(user_ids), operation))
+        arrival_time += generator.expovariate(peak_rate)
+    return arrivals
+
+
+def run_in_process(arrivals: List[Arrival], render: bool, access_key: bytes) -> LoadResult:
+    """Generates the codes in this thread, each when due or as soon as the previous one completes.
+
+    Args:
+        arrivals (List[Arrival]): the requests
+        render (bool): if the PNG is rendered after the payload
+        access_key (bytes): the signing key
+
+    Returns:
+        LoadResult: the latencies
+    """
+    perf_counter = time.perf_counter
+    wall_start = time.time()
+    response_times, service_times = [], []
+    errors = 0
+    start = perf_counter()
+    for arrival in arrivals:
+        due = start + arrival.time
+        delay = due - perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        sent = perf_counter()
+        try:
+            qrcode = QRCODE_CLASSES[arrival.operation](
+                arrival.user_id, datetime.fromtimestamp(int(wall_start + arrival.time)), access_key
+            )
+            if render:
+                qrcode.get_qrcode_bytes(compress_level=INTERACTIVE_COMPRESS_LEVEL)
+        except (ValueError, TypeError):
+            errors += 1
+            continue
+        done = perf_counter()
+        response_times.append(done - due)
+        service_times.append(done - sent)
+    return LoadResult(response_times, service_times, errors, perf_counter() - start)
+
+
+async def run_http(arrivals: List[Arrival], url: str, connections: int, kind: str = 'png') -> LoadResult:
+    """Requests the codes from a generation server over `connections` keep-alive connections. A
+    scheduler queues each request when due and the connections take them in order, so a slow server
+    builds a backlog whose wait counts in the response times.
+
+    Args:
+        arrivals (List[Arrival]): the requests
+        url (str): the server URL, such as http://127.0.0.1:8080
+        connections (int): the concurrent connections
+        kind (str, optional): the requested format, 'hex' or an image format. Defaults to 'png'.
+
+    Returns:
+        LoadResult: the latencies
+    """
+    address = urlsplit(url)
+    host, port = address.hostname, address.port or 80
+    loop = asyncio.get_running_loop()
+    wall_start = time.time()
+    queue: asyncio.Queue = asyncio.Queue()
+    response_times, service_times = [], []
+    errors = 0
+    start = loop.time()
+
+    async def schedule():
+        for arrival in arrivals:
+            delay = start + arrival.time - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            queue.put_nowait(arrival)
+        for _ in range(connections):
+            queue.put_nowait(None)
+
+    async def connect():
+        nonlocal errors
+        reader = writer = None
+        while True:
+            arrival = await queue.get()
+            if arrival is None:
+                break
+            target = (f'/{arrival.operation}?user_id={arrival.user_id}'
+                      f'&generated_at={int(wall_start + arrival.time)}&format={kind}')
+            sent = loop.time()
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(host, port)
+                writer.write(f'GET {target} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode('latin-1'))
+                head = await reader.readuntil(b'\r\n\r\n')
+                status_line, *header_lines = head.decode('latin-1').split('\r\n')
+                headers = dict(line.split(': ', 1) for line in header_lines if line)
+                await reader.readexactly(int(headers.get('Content-Length', 0)))
+                if headers.get('Connection') == 'close':
+                    writer.close()
+                    writer = None
+                if status_line.split(' ')[1] != '200':
+                    errors += 1
+                    continue
+            except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, IndexError):
+                errors += 1
+                if writer is not None:
+                    writer.close()
+                writer = None
+                continue
+            done = loop.time()
+            response_times.append(done - (start + arrival.time))
+            service_times.append(done - sent)
+        if writer is not None:
+            writer.close()
+
+    await asyncio.gather(schedule(), *(connect() for _ in range(connections)))
+    return LoadResult(response_times, service_times, errors, loop.time() - start)
+
+
+def get_latency_report(latencies: List[float]) -> Dict[str, float]:
+    """Gets the percentiles and the maximum of the latencies, in milliseconds.
+    """
+    if not latencies:
+        return {}
+    latencies = sorted(latencies)
+    count = len(latencies)
+    report = {name: 1000 * latencies[min(int(fraction * count), count - 1)] for name, fraction in PERCENTILES.items()}
+    report['max'] = 1000 * latencies[-1]
+    return report
+
+
+def get_report(arrivals: List[Arrival], duration: float, result: LoadResult) -> Dict[str, Any]:
+    completed = len(result.response_times)
+    return {
+        'requests': len(arrivals),
+        'offered_rate': len(arrivals) / duration,
+        'completed': completed,
+        'errors': result.errors,
+        'throughput': completed / result.elapsed if result.elapsed else 0.0,
+        'response_ms': get_latency_report(result.response_times),
+        'service_ms': get_latency_report(result.service_times),
+    }
+
+
+def print_report(report: Dict[str, Any], file: TextIO = sys.stdout):
+    print(f'{report["requests"]:,} requests offered at {report["offered_rate"]:,.1f}/s, {report["completed"]:,} completed '
+          f'at {report["throughput"]:,.1f}/s, {report["errors"]:,} errors', file=file)
+    print(f'{"ms":>9} ' + ' '.join(f'{name:>9}' for name in (*PERCENTILES, 'max')), file=file)
+    for name in ('response', 'service'):
+        latencies = report[f'{name}_ms']
+        print(f'{name:>9} ' + ' '.join(f'{latencies.get(key, float("nan")):>9.2f}' for key in (*PERCENTILES, 'max')), file=file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='CAUSP-LOCK QR Code generation load test')
+    parser.add_argument('--target', choices=('encode', 'render', 'http'), default='render')
+    parser.add_argument('--url', default='http://127.0.0.1:8080', help='server URL of the http target')
+    parser.add_argument('--connections', type=int, default=8, help='concurrent connections of the http target')
+    parser.add_argument('--format', default='png', help='format requested by the http target')
+    parser.add_argument('--rate', type=float, default=100.0, help='mean requests per second')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds of the run')
+    parser.add_argument('--users', type=int, default=10000, help='size of the user population')
+    parser.add_argument('--slot-period', type=float, default=60.0, help='seconds between slot boundaries')
+    parser.add_argument('--burst-width', type=float, default=5.0, help='seconds of the burst after each boundary')
+    parser.add_argument('--burst-factor', type=float, default=10.0, help='rate during the bursts over the rate between them')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='path of the JSON report')
+    args = parser.parse_args()
+
+    arrivals = get_arrivals(args.rate, args.duration, args.users, args.slot_period, args.burst_width, args.burst_factor, args.seed)
+    if args.target == 'http':
+        result = asyncio.run(run_http(arrivals, args.url, args.connections, args.format))
+    else:
+        result = run_in_process(arrivals, args.target == 'render', os.urandom(20))
+
+    report = get_report(arrivals, args.duration, result)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
@@ -0,0 +1,181 @@
+"""Benchmarks every stage of the QR Code generation pipeline, for each of the ten QRCODE_* types:
+payload encoding through its `PayloadSchema`, HMAC signing, matrix building (segno and the template
+fast path) and PNG writing (segno and the NumPy writer, at the archival and interactive zlib levels).
+Each stage reports ops/sec, per-call latency percentiles and the peak memory traced by tracemalloc. The results can be saved as a JSON baseline, and later runs compared against it:
+
+    python src/benchmarks/pipeline_benchmark.py --output baseline.json
+    python src/benchmarks/pipeline_benchmark.py --compare baseline.json --threshold 0.1
+"""
+
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+import segno
+from typing import *
+from datetime import datetime
+from qr_code.encoder import *
+from qr_code.matrix_builder import MatrixBuilders
+from qr_code.png_writer import PngWriter, INTERACTIVE_COMPRESS_LEVEL
+from auth.secret_key import SecretKey
+
+access_key = SecretKey('85 f1 e2 04 ba 63 fe 41 a0 f0 da 37 74 3e 8d 1c 6a f5 33 fc')
+sync_key = SecretKey('bf 42 9e 35 29 c5 f1 4e bb 81 8c 15 a3 cd 98 04 f6 1d 4b 98')
+master_key = SecretKey('9f 96 5e 25 bb ba 22 eb 9e 3f a1 32 98 11 92 1e e0 d9 b2 2e')
+config_key = SecretKey('79 31 8f 33 5e 6b f5 37 b9 b6 2e 56 ac 54 f8 36 f4 58 f9 db')
+new_key = SecretKey('e7 e5 00 11 c6 ff eb f0 ee a6 f9 47 e6 c5 43 bb c9 7e 42 db')
+sample_time = datetime(year=2025, month=7, day=17, hour=15, minute=14)
+
+# (message type, operation, body arguments, signing key) of each QRCODE_* type
+CASES = {
+    'CHECK_IN': (MessageTypes.ACCESS, OperationTypes.CHECK_IN, {'user_id': 2305947582, 'generated_at': sample_time}, access_key),
+    'CHECK_OUT': (MessageTypes.ACCESS, OperationTypes.CHECK_OUT, {'user_id': 2305947582, 'generated_at': sample_time}, access_key),
+    'BI_ACCESS': (MessageTypes.ACCESS, OperationTypes.BI_ACCESS, {'user_id': 2305947582, 'generated_at': sample_time}, access_key),
+    'SET_TIME': (MessageTypes.SYNC, OperationTypes.SET_TIME, {'sync_time': sample_time}, sync_key),
+    'SET_MASTER_KEY': (MessageTypes.CONFIG, OperationTypes.SET_MASTER_KEY, {'new_key': new_key}, master_key),
+    'SET_CONFIG_KEY': (MessageTypes.CONFIG, OperationTypes.SET_CONFIG_KEY, {'new_key': new_key}, master_key),
+    'SET_SYNC_KEY': (MessageTypes.CONFIG, OperationTypes.SET_SYNC_KEY, {'new_key': new_key}, config_key),
+    'SET_ACCESS_KEY': (MessageTypes.CONFIG, OperationTypes.SET_ACCESS_KEY, {'new_key': new_key}, config_key),
+    'BLINK_N_TIMES': (MessageTypes.DEBUG, OperationTypes.BLINK_N_TIMES, {'debug_data': 4}, None),
+    'BLINK_IF_SYNC': (MessageTypes.DEBUG, OperationTypes.BLINK_IF_SYNC, {'debug_data': sample_time}, None),
+}
+
+# stages timed with --heavy-iterations calls instead of --iterations
+HEAVY_STAGES = ('matrix_segno', 'matrix_template', 'png', 'png_numpy', 'png_interactive')
+
+
+def get_stages(message_type: int, operation: int, body_args: dict, key: Optional[SecretKey]) -> Dict[str, Callable[[], Any]]:
+    """Builds the callables of each pipeline stage of a QR Code type, with the inputs of a stage
+    computed in advance from the previous ones.
+    """
+    schema = PayloadSchema.get_schema(message_type, operation)
+    values = [body_args[field.name] for field in schema.fields]
+    payload = schema.encode(*values, key=key)
+    # the encoding stage includes the signing of signed payloads, also timed alone on their message
+    stages = {'encode': lambda: schema.encode(*values, key=key)}
+    if key is not None:
+        message = memoryview(payload[:-schema.mac_length])
+        stages['sign'] = lambda: schema.sign(message, key)
+
+    qrcode = segno.make_qr(payload)
+    stages['matrix_segno'] = lambda: segno.make_qr(payload)
+    stages['matrix_template'] = lambda: MatrixBuilders.make_qr(payload)
+    stages['png'] = lambda: qrcode.save(io.BytesIO(), kind='png', scale=25, border=5)
+    stages['png_numpy'] = lambda: PngWriter.get_png_bytes(qrcode, scale=25, border=5)
+    stages['png_interactive'] = lambda: PngWriter.get_png_bytes(qrcode, scale=25, border=5, compress_level=INTERACTIVE_COMPRESS_LEVEL)
+    return stages
+
+
+def measure(function: Callable[[], Any], iterations: int, memory_iterations: int) -> Dict[str, float]:
+    """Measures the throughput, per-call latency percentiles and peak memory of the function.
+
+    Args:
+        function (Callable[[], Any]): the measured function
+        iterations (int): the number of timed calls
+        memory_iterations (int): the number of calls traced by tracemalloc
+
+    Returns:
+        Dict[str, float]: the ops/sec, latency percentiles (in microseconds) and peak memory (in bytes)
+    """
+    for _ in range(min(iterations, 10)):
+        function()
+
+    perf_counter_ns = time.perf_counter_ns
+    latencies = [0] * iterations
+    start = perf_counter_ns()
+    for index in range(iterations):
+        call_start = perf_counter_ns()
+        function()
+        latencies[index] = perf_counter_ns() - call_start
+    total = perf_counter_ns() - start
+    latencies.sort()
+
+    tracemalloc.start()
+    for _ in range(memory_iterations):
+        function()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    def percentile(fraction: float) -> float:
+        return latencies[min(int(fraction * iterations), iterations - 1)] / 1000
+
+    return {
+        'ops_per_sec': iterations / (total / 1e9),
+        'p50_us': percentile(0.50),
+        'p90_us': percentile(0.90),
+        'p99_us': percentile(0.99),
+        'max_us': latencies[-1] / 1000,
+        'peak_memory_bytes': peak_memory,
+    }
+
+
+def run(iterations: int, heavy_iterations: int, cases: Iterable[str]) -> Dict[str, Any]:
+    results = {}
+    for name in cases:
+        results[name] = {}
+        for stage, function in get_stages(*CASES[name]).items():
+            stage_iterations = heavy_iterations if stage in HEAVY_STAGES else iterations
+            results[name][stage] = measure(function, stage_iterations, max(1, stage_iterations // 10))
+            print(f'{name:>15} {stage:>16} {results[name][stage]["ops_per_sec"]:>12,.0f} ops/s '
+                  f'p50 {results[name][stage]["p50_us"]:>9.1f} us p99 {results[name][stage]["p99_us"]:>9.1f} us '
+                  f'peak {results[name][stage]["peak_memory_bytes"]:>9,} B', file=sys.stderr)
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'results': results,
+    }
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[str]:
+    """Compares two benchmark runs, flagging the stages whose throughput dropped or whose p99 latency
+    or peak memory grew by more than the threshold.
+
+    Args:
+        baseline (Dict[str, Any]): the baseline run
+        current (Dict[str, Any]): the current run
+        threshold (float): the tolerated relative change, such as 0.1 for 10%
+
+    Returns:
+        List[str]: the regressions found
+    """
+    regressions = []
+    for name, stages in current['results'].items():
+        for stage, metrics in stages.items():
+            base_metrics = baseline['results'].get(name, {}).get(stage)
+            if base_metrics is None:
+                continue
+            if metrics['ops_per_sec'] < base_metrics['ops_per_sec'] * (1 - threshold):
+                regressions.append(f'{name} {stage}: ops/sec {base_metrics["ops_per_sec"]:,.0f} -> {metrics["ops_per_sec"]:,.0f}')
+            if metrics['p99_us'] > base_metrics['p99_us'] * (1 + threshold):
+                regressions.append(f'{name} {stage}: p99 {base_metrics["p99_us"]:.1f} us -> {metrics["p99_us"]:.1f} us')
+            if metrics['peak_memory_bytes'] > base_metrics['peak_memory_bytes'] * (1 + threshold):
+                regressions.append(f'{name} {stage}: peak memory {base_metrics["peak_memory_bytes"]:,} B -> {metrics["peak_memory_bytes"]:,} B')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='CAUSP-LOCK QR Code pipeline benchmark')
+    parser.add_argument('--iterations', type=int, default=20000, help='calls of the encoding and signing stages')
+    parser.add_argument('--heavy-iterations', type=int, default=200, help='calls of the matrix and PNG stages')
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--output', help='path of the JSON results')
+    parser.add_argument('--compare', help='path of a JSON baseline to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='tolerated relative regression')
+    args = parser.parse_args()
+
+    current = run(args.iterations, args.heavy_iterations, args.cases)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(current, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(baseline, current, args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        sys.exit(1 if regressions else 0)
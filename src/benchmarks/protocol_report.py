@@ -0,0 +1,83 @@
+"""Reports the QR Code size of each of the ten QRCODE_* types in the standard protocol and in the
+compact protocol at several truncated MAC lengths: payload bytes, QR version, error correction level,
+modules per side and total modules. Smaller symbols have larger modules at the same print size, which
+the OV2640 camera of the locks reads faster and from further away, at the cost of the forgery margin
+of the shorter MAC (2**-bits per scan):
+
+    python src/benchmarks/protocol_report.py --mac-lengths 4 6 8 10 12
+"""
+
+import sys
+import json
+import argparse
+from typing import *
+from qr_code.encoder import PayloadSchema, HASH_LENGTH, MIN_MAC_LENGTH, COMPACT_MAC_LENGTH
+from qr_code.matrix_builder import MatrixBuilders
+from benchmarks.pipeline_benchmark import CASES
+
+
+def get_code_size(payload: bytes) -> Dict[str, Any]:
+    """Gets the size of the QR Code of a payload, as built by the generation pipeline.
+
+    Args:
+        payload (bytes): the payload
+
+    Returns:
+        Dict[str, Any]: the payload bytes, QR version, error level, modules per side and total modules
+    """
+    qrcode = MatrixBuilders.make_qr(payload)
+    width = qrcode.symbol_size(border=0)[0]
+    return {
+        'payload_bytes': len(payload),
+        'version': qrcode.version,
+        'error': qrcode.error,
+        'width_modules': width,
+        'modules': width * width,
+    }
+
+
+def get_report(mac_lengths: Iterable[int], cases: Iterable[str]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """Measures the codes of each type, in the standard protocol and in the compact protocol with each
+    of the MAC lengths.
+
+    Args:
+        mac_lengths (Iterable[int]): the compact MAC lengths, in bytes
+        cases (Iterable[str]): the QRCODE_* types
+
+    Returns:
+        Dict[str, Dict[str, Dict[str, Any]]]: the code sizes, by type and protocol ('standard' or 'compact/<MAC length>')
+    """
+    protocols = [('standard', False, HASH_LENGTH)] + [(f'compact/{mac_length}', True, mac_length) for mac_length in mac_lengths]
+    report = {}
+    for name in cases:
+        message_type, operation, body_args, key = CASES[name]
+        report[name] = {}
+        for protocol, compact, mac_length in protocols:
+            schema = PayloadSchema.get_schema(message_type, operation, compact, mac_length)
+            payload = schema.encode(*body_args.values(), key=key)
+            report[name][protocol] = get_code_size(payload)
+            report[name][protocol]['mac_bits'] = 8 * mac_length if schema.signed else 0
+    return report
+
+
+def print_report(report: Dict[str, Dict[str, Dict[str, Any]]], file: TextIO = sys.stdout):
+    print(f'{"type":>15} {"protocol":>11} {"bytes":>5} {"MAC bits":>8} {"version":>7} {"error":>5} {"width":>5} {"modules":>7}', file=file)
+    for name, protocols in report.items():
+        for protocol, size in protocols.items():
+            print(f'{name:>15} {protocol:>11} {size["payload_bytes"]:>5} {size["mac_bits"]:>8} {size["version"]:>7} '
+                  f'{size["error"]:>5} {size["width_modules"]:>5} {size["modules"]:>7}', file=file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='CAUSP-LOCK QR Code size per protocol')
+    parser.add_argument('--mac-lengths', type=int, nargs='+', default=[COMPACT_MAC_LENGTH],
+                        help=f'compact MAC lengths, in bytes, from {MIN_MAC_LENGTH} to {HASH_LENGTH}')
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--output', help='path of the JSON report')
+    args = parser.parse_args()
+
+    report = get_report(args.mac_lengths, args.cases)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
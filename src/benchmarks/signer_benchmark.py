@@ -0,0 +1,41 @@
+import os
+import time
+from auth.signer import Signer, KeyedSigner
+from auth.secret_key import SecretKey
+
+# signed messages (header + body) of SYNC (5), ACCESS (9) and CONFIG (21), plus the 13 to 33 bytes range
+MESSAGE_LENGTHS = [5, 9, 13, 21, 29, 33]
+MESSAGES_PER_LENGTH = 10_000
+ROUNDS = 5
+
+
+def messages_per_second(sign, messages: list) -> float:
+    """Measures the best throughput of `sign` over the given messages, in messages per second.
+
+    Args:
+        sign (Callable[[bytes], bytes]): the signing function
+        messages (list): the messages to sign
+
+    Returns:
+        float: the best throughput among the rounds
+    """
+    best_time = float('inf')
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        for message in messages:
+            sign(message)
+        best_time = min(best_time, time.perf_counter() - start)
+    return len(messages) / best_time
+
+
+key = SecretKey().value
+keyed_signer = KeyedSigner(key)
+
+print(f'{"length":>6} {"Signer.sign":>16} {"KeyedSigner.sign":>18} {"speedup":>8}')
+for length in MESSAGE_LENGTHS:
+    messages = [os.urandom(length) for _ in range(MESSAGES_PER_LENGTH)]
+    assert all(keyed_signer.sign(message) == Signer.sign(message, key) for message in messages[:100])
+    
+    current_rate = messages_per_second(lambda message: Signer.sign(message, key), messages)
+    keyed_rate = messages_per_second(keyed_signer.sign, messages)
+    print(f'{length:>6} {current_rate:>12,.0f} m/s {keyed_rate:>14,.0f} m/s {keyed_rate / current_rate:>7.2f}x')
@@ -0,0 +1,254 @@
+"""Command line of the QR Code payloads, for the backend scripts that issue codes one call at a time:
+
+    python src/cli.py encode check_in --user-id 2305947582 --generated-at 2025-07-17T15:14
+    python src/cli.py render check_in --user-id 2305947582 -o check_in.png
+    python src/cli.py render --payload 0089711a9e... -o code.svg
+    python src/cli.py verify 0089711a9e... --image check_in.png
+
+The operations are the ones of the generation server (`check_in`, `set_time`, `blink_n_times`, ...),
+with the same arguments: times are POSIX seconds or ISO 8601 datetimes, a missing time meaning now, and
+new keys are hex strings. The secret keys are read from the CAUSP_MASTER_KEY, CAUSP_ACCESS_KEY,
+CAUSP_SYNC_KEY and CAUSP_CONFIG_KEY environment variables, or given as hex strings with `--key` or the
+`--*-key` options of `verify`.
+
+Each command only imports what it needs: `encode` and the verification of payloads stop at the
+encoder and decoder and run in about 55 ms, 40 ms over the bare interpreter, against 180 ms through
+the generator classes, while segno and numpy, which take over 100 ms to import, are only loaded to
+render or read images. `verify` exits with 1 if any code is invalid, and every command with 2 on bad
+arguments.
+"""
+
+import os
+import sys
+import zlib
+import struct
+import argparse
+from typing import *
+from datetime import datetime
+from qr_code.encoder import MessageTypes, OperationTypes, PrivateKeyTypes, PayloadSchema, COMPACT_MAC_LENGTH
+from qr_code.encoder import KEY_ENVIRONMENT_VARIABLES, get_keys_from_environment
+from qr_code.render_options import ARCHIVAL_COMPRESS_LEVEL
+
+# (message type, operation, arguments) of each operation, the arguments in the payload field order
+OPERATIONS = {
+    'check_in': (MessageTypes.ACCESS, OperationTypes.CHECK_IN, ('user_id', 'generated_at')),
+    'check_out': (MessageTypes.ACCESS, OperationTypes.CHECK_OUT, ('user_id', 'generated_at')),
+    'bi_access': (MessageTypes.ACCESS, OperationTypes.BI_ACCESS, ('user_id', 'generated_at')),
+    'set_time': (MessageTypes.SYNC, OperationTypes.SET_TIME, ('sync_time',)),
+    'set_master_key': (MessageTypes.CONFIG, OperationTypes.SET_MASTER_KEY, ('new_key',)),
+    'set_config_key': (MessageTypes.CONFIG, OperationTypes.SET_CONFIG_KEY, ('new_key',)),
+    'set_sync_key': (MessageTypes.CONFIG, OperationTypes.SET_SYNC_KEY, ('new_key',)),
+    'set_access_key': (MessageTypes.CONFIG, OperationTypes.SET_ACCESS_KEY, ('new_key',)),
+    'blink_n_times': (MessageTypes.DEBUG, OperationTypes.BLINK_N_TIMES, ('blink_num',)),
+    'blink_if_sync': (MessageTypes.DEBUG, OperationTypes.BLINK_IF_SYNC, ('current_time',)),
+}
+IMAGE_KINDS = ('png', 'svg', 'svgz', 'pdf', 'pam', 'pbm', 'ppm') # the segno formats written as bytes
+TIME_ARGUMENTS = ('generated_at', 'sync_time', 'current_time')
+VERIFY_KEY_OPTIONS = {
+    PrivateKeyTypes.MASTER_KEY: 'master_key',
+    PrivateKeyTypes.ACCESS_KEY: 'access_key',
+    PrivateKeyTypes.SYNC_KEY: 'sync_key',
+    PrivateKeyTypes.CONFIG_KEY: 'config_key',
+}
+
+
+class CommandError(Exception):
+    pass
+
+
+def parse_time(value: Optional[str], name: str) -> datetime:
+    """Parses a time argument, as POSIX seconds or an ISO 8601 datetime. A missing value means now.
+    """
+    if value is None:
+        return datetime.now().replace(microsecond=0)
+    if value.isdigit():
+        return datetime.fromtimestamp(int(value))
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f'--{name.replace("_", "-")} must be POSIX seconds or an ISO 8601 datetime')
+
+
+def parse_argument(args: argparse.Namespace, name: str) -> Union[int, str, datetime]:
+    value = getattr(args, name)
+    if name in TIME_ARGUMENTS:
+        return parse_time(value, name)
+    if value is None:
+        raise CommandError(f'missing --{name.replace("_", "-")}')
+    if name in ('user_id', 'blink_num'):
+        try:
+            return int(value)
+        except ValueError:
+            raise CommandError(f'--{name.replace("_", "-")} must be an integer')
+    return value
+
+
+def get_signing_key(args: argparse.Namespace, message_type: int, operation: int) -> Optional[str]:
+    """Gets the key that signs an operation, as a hex string: the `--key` option, or else the
+    environment variable of its key type. None for the unsigned DEBUG payloads.
+    """
+    from qr_code.decoder import PayloadDecoder
+    key_type = PayloadDecoder.get_signing_key_type(message_type, operation)
+    if key_type is None:
+        return None
+    key = args.key or os.environ.get(KEY_ENVIRONMENT_VARIABLES[key_type])
+    if not key:
+        raise CommandError(f'missing --key or {KEY_ENVIRONMENT_VARIABLES[key_type]}')
+    return key
+
+
+def get_payload(args: argparse.Namespace) -> bytes:
+    """Encodes the payload of the command arguments, through the schema of its operation.
+    """
+    message_type, operation, names = OPERATIONS[args.operation]
+    values = [parse_argument(args, name) for name in names]
+    key = get_signing_key(args, message_type, operation)
+    try:
+        schema = PayloadSchema.get_schema(message_type, operation, args.compact, args.mac_length)
+        return schema.encode(*values, key=None if key is None else bytes.fromhex(key))
+    except (ValueError, OverflowError, TypeError) as error:
+        raise CommandError(str(error))
+
+
+def encode(args: argparse.Namespace) -> int:
+    payload = get_payload(args)
+    if args.format == 'raw':
+        sys.stdout.buffer.write(payload)
+    elif args.format == 'base64':
+        import base64
+        print(base64.b64encode(payload).decode('ascii'))
+    else:
+        print(payload.hex())
+    return 0
+
+
+def render(args: argparse.Namespace) -> int:
+    if args.payload is not None:
+        try:
+            payload = bytes.fromhex(args.payload)
+        except ValueError:
+            raise CommandError('--payload must be a hex string')
+    elif args.operation is not None:
+        payload = get_payload(args)
+    else:
+        raise CommandError('give an operation or --payload')
+
+    kind = args.kind or ('png' if args.output == '-' else args.output.rsplit('.', 1)[-1].lower())
+    if kind not in IMAGE_KINDS:
+        raise CommandError(f'unsupported image format {kind!r}, use one of {", ".join(IMAGE_KINDS)} or --kind')
+    if args.scale < 1:
+        raise CommandError('--scale must be at least 1')
+    if args.border < 0:
+        raise CommandError('--border must not be negative')
+    if not 0 <= args.compress_level <= 9:
+        raise CommandError('--compress-level must be between 0 and 9')
+    from qr_code.generator import QRCode
+    # rendered before the output is opened, so an unsupported format leaves no empty file behind
+    try:
+        image = QRCode(payload).get_qrcode_bytes(kind, args.scale, args.border, args.compress_level)
+    except (ValueError, zlib.error) as error:
+        raise CommandError(str(error))
+    if args.output == '-':
+        sys.stdout.buffer.write(image)
+    else:
+        try:
+            with open(args.output, 'wb') as file:
+                file.write(image)
+        except OSError as error:
+            raise CommandError(str(error))
+    return 0
+
+
+def verify(args: argparse.Namespace) -> int:
+    from qr_code.decoder import PayloadDecoder
+    keys = get_keys_from_environment()
+    for key_type, name in VERIFY_KEY_OPTIONS.items():
+        if getattr(args, name):
+            try:
+                keys[key_type] = bytes.fromhex(getattr(args, name))
+            except ValueError:
+                raise CommandError(f'--{name.replace("_", "-")} must be a hex string')
+    if not args.payloads and not args.image:
+        raise CommandError('give payloads or --image')
+
+    codes = []
+    for payload in args.payloads:
+        try:
+            codes.append((payload, bytes.fromhex(payload), None))
+        except ValueError:
+            codes.append((payload, None, 'not a hex string'))
+    if args.image:
+        from qr_code.image_verifier import ImageVerifier
+        for path in args.image:
+            try:
+                codes.append((path, ImageVerifier.decode(path)[0], None))
+            except (ValueError, OSError, zlib.error, struct.error) as error:
+                codes.append((path, None, str(error)))
+
+    all_valid = True
+    for name, payload, error in codes:
+        if payload is not None:
+            result = PayloadDecoder.verify(payload, keys, args.mac_length)
+            error = result.error
+            if result.valid:
+                operation = PayloadDecoder.decode(payload).get_operation_name()
+                print(f'{name}: valid {operation}')
+                continue
+        all_valid = False
+        print(f'{name}: invalid, {error}')
+    return 0 if all_valid else 1
+
+
+def add_payload_arguments(parser: argparse.ArgumentParser, required: bool = True):
+    parser.add_argument('operation', choices=OPERATIONS, nargs=None if required else '?')
+    parser.add_argument('--user-id', help='user id of the ACCESS operations')
+    parser.add_argument('--generated-at', help='generation time of the ACCESS operations, now by default')
+    parser.add_argument('--sync-time', help='time of set_time, now by default')
+    parser.add_argument('--current-time', help='time of blink_if_sync, now by default')
+    parser.add_argument('--new-key', help='new key of the CONFIG operations, as a hex string')
+    parser.add_argument('--blink-num', help='blinks of blink_n_times')
+    parser.add_argument('--key', help='signing key, as a hex string, instead of its environment variable')
+    parser.add_argument('--compact', action='store_true', help='encode in the compact protocol')
+    parser.add_argument('--mac-length', type=int, default=COMPACT_MAC_LENGTH, help='MAC bytes of compact payloads')
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='CAUSP-LOCK QR Code payloads')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    encode_parser = commands.add_parser('encode', help='print the payload of an operation')
+    add_payload_arguments(encode_parser)
+    encode_parser.add_argument('--format', choices=('hex', 'base64', 'raw'), default='hex')
+    encode_parser.set_defaults(handler=encode)
+
+    render_parser = commands.add_parser('render', help='write the QR Code image of an operation or payload')
+    add_payload_arguments(render_parser, required=False)
+    render_parser.add_argument('--payload', help='payload to render, as a hex string, instead of an operation')
+    render_parser.add_argument('-o', '--output', required=True, help='image path, or - for the standard output')
+    render_parser.add_argument('--kind', choices=IMAGE_KINDS, help='image format, by default the extension of the path, or png')
+    render_parser.add_argument('--scale', type=int, default=25)
+    render_parser.add_argument('--border', type=int, default=5)
+    render_parser.add_argument('--compress-level', type=int, default=ARCHIVAL_COMPRESS_LEVEL, help='zlib level of PNGs')
+    render_parser.set_defaults(handler=render)
+
+    verify_parser = commands.add_parser('verify', help='check the signature of payloads or QR Code PNGs')
+    verify_parser.add_argument('payloads', nargs='*', help='payloads, as hex strings')
+    verify_parser.add_argument('--image', action='append', help='QR Code PNG path, can be repeated')
+    for name in VERIFY_KEY_OPTIONS.values():
+        verify_parser.add_argument(f'--{name.replace("_", "-")}', dest=name, help='as a hex string, instead of its environment variable')
+    verify_parser.add_argument('--mac-length', type=int, default=COMPACT_MAC_LENGTH, help='MAC bytes of compact payloads')
+    verify_parser.set_defaults(handler=verify)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    try:
+        return args.handler(args)
+    except CommandError as error:
+        parser.error(f'{args.command}: {error}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,283 @@
+import os
+import time
+import struct
+from collections import Counter
+from typing import *
+from auth.secret_key import SecretKey
+from auth.signer import KeyedSigner
+from auth.key_ring import KeyRing
+from qr_code.encoder import MessageTypes, OperationTypes, PrivateKeyTypes, COMPACT_MAC_LENGTH
+from qr_code.decoder import PayloadDecoder, DecodedPayload
+from access_log.log_store import LogRecord, DUMP_RECORD_LENGTH
+
+# device log record, as read by `LogStore.ingest`: header, user_id and time of the access
+LOG_RECORD_STRUCT = struct.Struct('>BII')
+
+DEFAULT_LOG_CAPACITY = 4096 # records kept by the device, the oldest overwritten first
+DEFAULT_CODE_LIFETIME = 300 # seconds an ACCESS code is accepted after its generated_at
+DEFAULT_CLOCK_SKEW = 60 # seconds an ACCESS code may come from the future, for the server clock drift
+DEFAULT_SYNC_TOLERANCE = 2 # seconds of difference BLINK_IF_SYNC accepts as synchronized
+
+# key type set by each CONFIG operation
+NEW_KEY_TYPES = {
+    OperationTypes.SET_MASTER_KEY: PrivateKeyTypes.MASTER_KEY,
+    OperationTypes.SET_CONFIG_KEY: PrivateKeyTypes.CONFIG_KEY,
+    OperationTypes.SET_SYNC_KEY: PrivateKeyTypes.SYNC_KEY,
+    OperationTypes.SET_ACCESS_KEY: PrivateKeyTypes.ACCESS_KEY,
+}
+
+
+class ScanResult(NamedTuple):
+    accepted: bool
+    message_type: Optional[int] = None
+    operation: Optional[int] = None
+    error: Optional[str] = None
+    blinks: int = 0
+
+
+class LockEmulator:
+    __slots__ = (
+        'device_id', 'signers', 'clock_offset', 'log_capacity', 'code_lifetime', 'clock_skew',
+        'sync_tolerance', 'mac_length', 'log', 'log_next', 'overwritten_records', 'used_codes'
+    )
+
+
+    def __init__(
+        self,
+        device_id: int,
+        keys: Dict[int, Union[bytes, SecretKey, KeyedSigner]],
+        clock_offset: int = 0,
+        log_capacity: int = DEFAULT_LOG_CAPACITY,
+        code_lifetime: int = DEFAULT_CODE_LIFETIME,
+        clock_skew: int = DEFAULT_CLOCK_SKEW,
+        sync_tolerance: int = DEFAULT_SYNC_TOLERANCE,
+        mac_length: int = COMPACT_MAC_LENGTH
+    ):
+        """Emulation of the ESP32-CAM lock firmware. A scanned payload is decoded and its HMAC-SHA1
+        checked against the current key of its operation; then:
+
+        - ACCESS codes are accepted once, within `code_lifetime` seconds of their generation, and the
+        CHECK_IN and CHECK_OUT ones are logged (BI_ACCESS only opens the lock);
+        - SET_TIME sets the device clock;
+        - CONFIG codes replace a key, so the next codes must be signed by the new one;
+        - DEBUG codes are unsigned and only blink the led.
+
+        The log is a ring buffer of `log_capacity` 9 bytes records, the format of the device log dumps,
+        allocated as it fills, and the used codes are only remembered until they expire, so an idle lock
+        takes about 1.5 KB, mostly the hash states of its four `KeyedSigner`, and thousands of them fit
+        in a process.
+
+        Args:
+            device_id (int): the device id
+            keys (Dict[int, Union[bytes, SecretKey, KeyedSigner]]): the initial keys, by `PrivateKeyTypes`
+            clock_offset (int, optional): the seconds the device clock is ahead of the host. Defaults to 0.
+            log_capacity (int, optional): the records kept in the log. Defaults to DEFAULT_LOG_CAPACITY.
+            code_lifetime (int, optional): the seconds an ACCESS code is valid. Defaults to DEFAULT_CODE_LIFETIME.
+            clock_skew (int, optional): the seconds an ACCESS code may be ahead of the device clock.
+            Defaults to DEFAULT_CLOCK_SKEW.
+            sync_tolerance (int, optional): the seconds BLINK_IF_SYNC tolerates. Defaults to DEFAULT_SYNC_TOLERANCE.
+            mac_length (int, optional): the truncated HMAC length of compact payloads, in bytes.
+            Defaults to COMPACT_MAC_LENGTH.
+        """
+        self.device_id = device_id
+        self.signers = {
+            key_type: key if type(key) == KeyedSigner else KeyedSigner(key)
+            for key_type, key in keys.items()
+        }
+        self.clock_offset = clock_offset
+        self.log_capacity = log_capacity
+        self.code_lifetime = code_lifetime
+        self.clock_skew = clock_skew
+        self.sync_tolerance = sync_tolerance
+        self.mac_length = mac_length
+        self.log = bytearray()
+        self.log_next = 0 # the record overwritten next, once the log is full
+        self.overwritten_records = 0
+        self.used_codes: Dict[bytes, int] = {} # message -> expiration, in device time
+
+
+    def get_time(self, now: Optional[int] = None) -> int:
+        """Gets the device clock, in POSIX seconds.
+
+        Args:
+            now (Optional[int], optional): the host time, to emulate a shared simulated clock.
+            Defaults to the current time.
+        """
+        return (int(time.time()) if now is None else now) + self.clock_offset
+
+
+    def scan(self, payload: Union[bytes, bytearray, memoryview], now: Optional[int] = None) -> ScanResult:
+        """Processes a scanned payload. Never raises: unreadable, forged, expired and reused codes are
+        reported as rejected, with the reason.
+
+        Args:
+            payload (Union[bytes, bytearray, memoryview]): the payload read by the camera
+            now (Optional[int], optional): the host time. Defaults to the current time.
+
+        Returns:
+            ScanResult: the outcome of the scan
+        """
+        try:
+            decoded = PayloadDecoder.decode(payload)
+        except (ValueError, TypeError) as error:
+            return ScanResult(False, error=str(error))
+
+        message_type, operation = decoded.message_type, decoded.operation
+        verification = PayloadDecoder.verify_decoded(decoded, self.signers, self.mac_length)
+        if not verification.valid:
+            return ScanResult(False, message_type, operation, verification.error)
+
+        device_time = self.get_time(now)
+        if message_type == MessageTypes.ACCESS:
+            return self.access(decoded, device_time)
+        if message_type == MessageTypes.SYNC:
+            self.clock_offset += decoded.get_time() - device_time
+            return ScanResult(True, message_type, operation)
+        if message_type == MessageTypes.CONFIG:
+            self.signers[NEW_KEY_TYPES[operation]] = KeyedSigner(decoded.get_new_key())
+            return ScanResult(True, message_type, operation)
+        if operation == OperationTypes.BLINK_N_TIMES:
+            return ScanResult(True, message_type, operation, blinks=int.from_bytes(decoded.body[-4:], byteorder='big'))
+        synchronized = abs(decoded.get_time() - device_time) <= self.sync_tolerance
+        return ScanResult(True, message_type, operation, blinks=1 if synchronized else 0)
+
+
+    def access(self, decoded: DecodedPayload, device_time: int) -> ScanResult:
+        message_type, operation = decoded.message_type, decoded.operation
+        generated_at = decoded.get_time()
+        if generated_at > device_time + self.clock_skew:
+            return ScanResult(False, message_type, operation, 'code generated in the future')
+        if device_time - generated_at > self.code_lifetime:
+            return ScanResult(False, message_type, operation, 'expired code')
+
+        while self.used_codes:
+            message, expiration = next(iter(self.used_codes.items()))
+            if expiration >= device_time:
+                break
+            del self.used_codes[message]
+        message = bytes(decoded.message)
+        if message in self.used_codes:
+            return ScanResult(False, message_type, operation, 'code already used')
+        self.used_codes[message] = generated_at + self.code_lifetime
+
+        if operation != OperationTypes.BI_ACCESS:
+            self.append_log((MessageTypes.ACCESS << 4) | operation, decoded.get_user_id(), device_time)
+        return ScanResult(True, message_type, operation)
+
+
+    def append_log(self, header: int, user_id: int, device_time: int):
+        """Appends a record to the log, overwriting the oldest one when it is full.
+        """
+        if len(self.log) < self.log_capacity * DUMP_RECORD_LENGTH:
+            self.log += LOG_RECORD_STRUCT.pack(header, user_id, device_time)
+            return
+        LOG_RECORD_STRUCT.pack_into(self.log, self.log_next * DUMP_RECORD_LENGTH, header, user_id, device_time)
+        self.log_next = (self.log_next + 1) % self.log_capacity
+        self.overwritten_records += 1
+
+
+    def get_log_dump(self) -> bytes:
+        """Gets the log as the device dumps it: its records, oldest first, as read by `LogStore.ingest`.
+        """
+        offset = self.log_next * DUMP_RECORD_LENGTH
+        return bytes(self.log[offset:] + self.log[:offset])
+
+
+    def get_log_records(self) -> List[LogRecord]:
+        return [
+            LogRecord(self.device_id, header & 0x0f, user_id, device_time)
+            for header, user_id, device_time in LOG_RECORD_STRUCT.iter_unpack(self.get_log_dump())
+        ]
+
+
+    def clear_log(self):
+        self.log = bytearray()
+        self.log_next = 0
+
+
+class LockFleet:
+    def __init__(self, **lock_options):
+        """Many emulated locks, by device id, with the counts of the scan outcomes of the whole fleet.
+
+        Args:
+            **lock_options: the `LockEmulator` options shared by the locks, such as `code_lifetime`
+        """
+        self.lock_options = lock_options
+        self.locks: Dict[int, LockEmulator] = {}
+        self.accepted = 0
+        self.rejections: Counter = Counter()
+
+
+    def from_key_ring(key_ring: KeyRing, device_ids: Optional[Iterable[int]] = None, **lock_options) -> 'LockFleet':
+        """Creates a lock for each device of a key ring, with its keys.
+
+        Args:
+            key_ring (KeyRing): the key ring
+            device_ids (Optional[Iterable[int]], optional): the devices. Defaults to all of the key ring.
+            **lock_options: the `LockEmulator` options
+
+        Returns:
+            LockFleet: the fleet
+        """
+        fleet = LockFleet(**lock_options)
+        for device_id in key_ring.get_device_ids() if device_ids is None else device_ids:
+            fleet.add_lock(device_id, key_ring.get_keys(device_id))
+        return fleet
+
+
+    def add_lock(self, device_id: int, keys: Dict[int, Union[bytes, SecretKey, KeyedSigner]]) -> LockEmulator:
+        lock = self.locks[device_id] = LockEmulator(device_id, keys, **self.lock_options)
+        return lock
+
+
+    def scan(self, device_id: int, payload: Union[bytes, bytearray, memoryview], now: Optional[int] = None) -> ScanResult:
+        """Scans a payload on a lock.
+
+        Args:
+            device_id (int): the device id
+            payload (Union[bytes, bytearray, memoryview]): the payload
+            now (Optional[int], optional): the host time. Defaults to the current time.
+
+        Raises:
+            KeyError: if the fleet has no such lock
+
+        Returns:
+            ScanResult: the outcome of the scan
+        """
+        result = self.locks[device_id].scan(payload, now)
+        if result.accepted:
+            self.accepted += 1
+        else:
+            self.rejections[result.error] += 1
+        return result
+
+
+    def write_log_dumps(self, directory: str, clear: bool = True) -> Dict[int, str]:
+        """Writes the log dump of each lock with records, as `device_<id>.bin`, ready for `LogStore.ingest`.
+
+        Args:
+            directory (str): the directory, created if needed
+            clear (bool, optional): if the logs are cleared after the dump. Defaults to True.
+
+        Returns:
+            Dict[int, str]: the dump paths, by device id
+        """
+        os.makedirs(directory, exist_ok=True)
+        paths = {}
+        for device_id, lock in self.locks.items():
+            if not lock.log:
+                continue
+            paths[device_id] = os.path.join(directory, f'device_{device_id}.bin')
+            with open(paths[device_id], 'wb') as file:
+                file.write(lock.get_log_dump())
+            if clear:
+                lock.clear_log()
+        return paths
+
+
+    def __len__(self) -> int:
+        return len(self.locks)
+
+
+    def __getitem__(self, device_id: int) -> LockEmulator:
+        return self.locks[device_id]
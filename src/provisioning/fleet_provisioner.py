@@ -0,0 +1,193 @@
+import os
+import json
+import zipfile
+from collections import Counter
+from typing import *
+from auth.secret_key import SecretKey
+from auth.signer import KeyedSigner
+from auth.key_ring import KeyRing, KEY_LENGTH, KEY_TYPES_COUNT
+from qr_code.encoder import MessageTypes, OperationTypes, PrivateKeyTypes, PAYLOAD_SCHEMAS
+from qr_code.bulk_renderer import BulkRenderer
+
+# codes of a provisioning, in scanning order: (name, operation, new key type, signing key type). The
+# new master key is signed by the current one, and each next key by a key set just before it.
+PROVISIONING_CODES = (
+    ('SET_MASTER_KEY', OperationTypes.SET_MASTER_KEY, PrivateKeyTypes.MASTER_KEY, None),
+    ('SET_CONFIG_KEY', OperationTypes.SET_CONFIG_KEY, PrivateKeyTypes.CONFIG_KEY, PrivateKeyTypes.MASTER_KEY),
+    ('SET_SYNC_KEY', OperationTypes.SET_SYNC_KEY, PrivateKeyTypes.SYNC_KEY, PrivateKeyTypes.CONFIG_KEY),
+    ('SET_ACCESS_KEY', OperationTypes.SET_ACCESS_KEY, PrivateKeyTypes.ACCESS_KEY, PrivateKeyTypes.CONFIG_KEY),
+)
+DEVICE_KEY_MATERIAL_LENGTH = KEY_TYPES_COUNT * KEY_LENGTH # 80 bytes
+
+
+class FleetProvisioner:
+    def __init__(
+        self,
+        key_ring: KeyRing,
+        output_dir: str,
+        kind: str = 'png',
+        scale: int = 25,
+        border: int = 5,
+        processes: Optional[int] = None,
+        chunk_size: int = 32
+    ):
+        """Provisioning of the four secret keys of many devices. All the key material is drawn from
+        the OS at once and sliced per device and key type with no copies. The SET_MASTER_KEY,
+        SET_CONFIG_KEY, SET_SYNC_KEY and SET_ACCESS_KEY payloads are encoded and signed in this
+        process, and their images are rendered across a process pool. Each device gets a bundle,
+        `device_<id>.zip`, with its images numbered in scanning order and a manifest, and its new keys
+        are saved in the key ring once the bundle is written. PNG images are decoded back before they
+        are bundled, as a device that cannot read its new keys is locked out. The payloads carry the
+        new keys in the clear, so the bundles are as sensitive as the key ring.
+
+        Args:
+            key_ring (KeyRing): the writable key ring that receives the new keys
+            output_dir (str): the directory of the bundles
+            kind (str, optional): the image format. Defaults to 'png'.
+            scale (int, optional): the scale of the QR Codes. Defaults to 25.
+            border (int, optional): the border size of the QR Codes. Defaults to 5.
+            processes (Optional[int], optional): the number of worker processes. Defaults to the CPU count.
+            chunk_size (int, optional): the number of QR Codes sent to a worker at a time. Defaults to 32.
+        """
+        self.key_ring = key_ring
+        self.output_dir = output_dir
+        self.kind = kind
+        self.scale = scale
+        self.border = border
+        self.processes = processes
+        self.chunk_size = chunk_size
+
+
+    def get_key_material(device_count: int) -> List[Dict[int, memoryview]]:
+        """Draws the keys of many devices from a single `os.urandom` buffer.
+
+        Args:
+            device_count (int): the number of devices
+
+        Returns:
+            List[Dict[int, memoryview]]: the keys of each device, by `PrivateKeyTypes`, as views of the buffer
+        """
+        material = memoryview(os.urandom(device_count * DEVICE_KEY_MATERIAL_LENGTH))
+        return [
+            {
+                key_type: material[offset + key_type * KEY_LENGTH:offset + (key_type + 1) * KEY_LENGTH]
+                for key_type in range(KEY_TYPES_COUNT)
+            }
+            for offset in range(0, len(material), DEVICE_KEY_MATERIAL_LENGTH)
+        ]
+
+
+    def get_payloads(new_keys: Dict[int, memoryview], current_master_key: Union[bytes, SecretKey, KeyedSigner]) -> List[bytes]:
+        """Encodes the provisioning payloads of a device, in scanning order.
+
+        Args:
+            new_keys (Dict[int, memoryview]): the new keys, by `PrivateKeyTypes`
+            current_master_key (Union[bytes, SecretKey, KeyedSigner]): the master key the device has now
+
+        Returns:
+            List[bytes]: the payloads
+        """
+        signers = {key_type: KeyedSigner(bytes(key)) for key_type, key in new_keys.items()}
+        payloads = []
+        for _, operation, new_key_type, signing_key_type in PROVISIONING_CODES:
+            signer = current_master_key if signing_key_type is None else signers[signing_key_type]
+            schema = PAYLOAD_SCHEMAS[MessageTypes.CONFIG, operation]
+            payloads.append(schema.encode(new_keys[new_key_type], key=signer))
+        return payloads
+
+
+    def get_current_master_key(
+        self,
+        device_id: int,
+        default_master_key: Optional[Union[bytes, SecretKey]]
+    ) -> Union[bytes, SecretKey, KeyedSigner]:
+        try:
+            return self.key_ring.get_signer(device_id, PrivateKeyTypes.MASTER_KEY)
+        except KeyError:
+            if default_master_key is None:
+                raise ValueError(f'device {device_id} is not in the key ring and no default master key was given')
+            return default_master_key
+
+
+    def provision(self, device_ids: Sequence[int], default_master_key: Optional[Union[bytes, SecretKey]] = None) -> int:
+        """Provisions new keys for the given devices. The SET_MASTER_KEY code of a device is signed by
+        its master key in the key ring or, for a new device, by the default (factory) master key.
+
+        Args:
+            device_ids (Sequence[int]): the device ids
+            default_master_key (Optional[Union[bytes, SecretKey]], optional): the master key of the devices
+            that are not in the key ring yet. Defaults to None.
+
+        If the rendering fails, the devices whose bundle was not written keep their keys in the ring.
+
+        Raises:
+            ValueError: if a device id is repeated, or a device is not in the key ring and there is no
+            default master key
+
+        Returns:
+            int: the number of written bundles
+        """
+        # checked before any key is drawn, as the bundles and keys of a repeated device would collide
+        repeated = sorted(device_id for device_id, count in Counter(device_ids).items() if count > 1)
+        if repeated:
+            raise ValueError(f'repeated device ids: {", ".join(map(str, repeated))}')
+        os.makedirs(self.output_dir, exist_ok=True)
+        current_master_keys = [self.get_current_master_key(device_id, default_master_key) for device_id in device_ids]
+        named_payloads = []
+        manifests = {}
+        pending_keys: Dict[int, Dict[int, memoryview]] = {} # new keys of the devices whose bundle is not written yet
+        for device_id, new_keys, current_master_key in zip(device_ids, FleetProvisioner.get_key_material(len(device_ids)), current_master_keys):
+            payloads = FleetProvisioner.get_payloads(new_keys, current_master_key)
+            pending_keys[device_id] = new_keys
+            manifests[device_id] = {'device_id': device_id, 'codes': []}
+            for order, ((name, _, _, _), payload) in enumerate(zip(PROVISIONING_CODES, payloads), start=1):
+                file_name = f'{order}_{name}.{self.kind}'
+                manifests[device_id]['codes'].append({'order': order, 'operation': name, 'file': file_name, 'payload': payload.hex()})
+                named_payloads.append((f'{device_id}/{file_name}', payload))
+
+        images: Dict[int, Dict[str, bytes]] = {}
+        written = 0
+
+        def collect(name: str, image: bytes):
+            nonlocal written
+            device_id, file_name = name.split('/')
+            device_id = int(device_id)
+            device_images = images.setdefault(device_id, {})
+            device_images[file_name] = image
+            if len(device_images) == len(PROVISIONING_CODES):
+                self.write_bundle(manifests.pop(device_id), images.pop(device_id))
+                # the ring only gets the new keys once the device can receive them, so a failed
+                # rendering or verification leaves the device with keys the ring still has
+                self.key_ring.set_keys(device_id, pending_keys.pop(device_id))
+                written += 1
+
+        try:
+            BulkRenderer.render(
+                named_payloads,
+                callback=collect,
+                kind=self.kind,
+                scale=self.scale,
+                border=self.border,
+                processes=self.processes,
+                chunk_size=self.chunk_size,
+                verify=self.kind == 'png'
+            )
+        finally:
+            self.key_ring.flush()
+        return written
+
+
+    def write_bundle(self, manifest: Dict[str, Any], images: Dict[str, bytes]):
+        """Writes the bundle of a device, replacing the previous one only when it is complete.
+
+        Args:
+            manifest (Dict[str, Any]): the device manifest
+            images (Dict[str, bytes]): the images, by file name
+        """
+        path = os.path.join(self.output_dir, f'device_{manifest["device_id"]}.zip')
+        temporary_path = path + '.tmp'
+        with zipfile.ZipFile(temporary_path, 'w', compression=zipfile.ZIP_STORED) as bundle:
+            bundle.writestr('manifest.json', json.dumps(manifest, indent=2))
+            for file_name, image in sorted(images.items()):
+                bundle.writestr(file_name, image)
+        os.replace(temporary_path, path)
@@ -0,0 +1,190 @@
+import numpy as np
+from typing import *
+from datetime import datetime
+from auth.secret_key import SecretKey
+from auth.signer import KeyedSigner
+from qr_code.encoder import MessageTypes, OperationTypes, PayloadHeaderEncoder
+
+# ACCESS payload layout: header (1 byte) + user_id (4 bytes) + generated_at (4 bytes) + hash (20 bytes)
+ACCESS_PAYLOAD_DTYPE = np.dtype([
+    ('header', 'u1'),
+    ('user_id', '>u4'),
+    ('generated_at', '>u4'),
+    ('hash', 'V20'),
+])
+ACCESS_MESSAGE_LENGTH = 9
+ACCESS_PAYLOAD_LENGTH = ACCESS_PAYLOAD_DTYPE.itemsize # 29 bytes
+
+UINT32_MAX = 2**32 - 1
+
+
+class BatchPayloadEncoder:
+    def get_check_in_payloads(
+        user_ids: Union[np.ndarray, Sequence[int]],
+        generated_at: Union[np.ndarray, Sequence[Union[int, datetime]]],
+        access_key: Union[SecretKey, bytes, KeyedSigner]
+    ) -> bytearray:
+        """Generates the QR Code payloads for the check-in of many users at once.
+
+        Args:
+            user_ids (Union[np.ndarray, Sequence[int]]): the user ids
+            generated_at (Union[np.ndarray, Sequence[Union[int, datetime]]]): the generated_at timestamps
+            access_key (Union[SecretKey, bytes, KeyedSigner]): the secret access key
+
+        Returns:
+            bytearray: the payloads, as a contiguous buffer of 29 bytes records
+        """
+        return BatchPayloadEncoder.get_access_payloads(OperationTypes.CHECK_IN, user_ids, generated_at, access_key)
+
+
+    def get_check_out_payloads(
+        user_ids: Union[np.ndarray, Sequence[int]],
+        generated_at: Union[np.ndarray, Sequence[Union[int, datetime]]],
+        access_key: Union[SecretKey, bytes, KeyedSigner]
+    ) -> bytearray:
+        """Generates the QR Code payloads for the check-out of many users at once.
+
+        Args:
+            user_ids (Union[np.ndarray, Sequence[int]]): the user ids
+            generated_at (Union[np.ndarray, Sequence[Union[int, datetime]]]): the generated_at timestamps
+            access_key (Union[SecretKey, bytes, KeyedSigner]): the secret access key
+
+        Returns:
+            bytearray: the payloads, as a contiguous buffer of 29 bytes records
+        """
+        return BatchPayloadEncoder.get_access_payloads(OperationTypes.CHECK_OUT, user_ids, generated_at, access_key)
+
+
+    def get_bi_access_payloads(
+        user_ids: Union[np.ndarray, Sequence[int]],
+        generated_at: Union[np.ndarray, Sequence[Union[int, datetime]]],
+        access_key: Union[SecretKey, bytes, KeyedSigner]
+    ) -> bytearray:
+        """Generates the QR Code payloads for the bi access of many users at once.
+
+        Args:
+            user_ids (Union[np.ndarray, Sequence[int]]): the user ids
+            generated_at (Union[np.ndarray, Sequence[Union[int, datetime]]]): the generated_at timestamps
+            access_key (Union[SecretKey, bytes, KeyedSigner]): the secret access key
+
+        Returns:
+            bytearray: the payloads, as a contiguous buffer of 29 bytes records
+        """
+        return BatchPayloadEncoder.get_access_payloads(OperationTypes.BI_ACCESS, user_ids, generated_at, access_key)
+
+
+    def get_access_payloads(
+        operation: Union[OperationTypes, int],
+        user_ids: Union[np.ndarray, Sequence[int]],
+        generated_at: Union[np.ndarray, Sequence[Union[int, datetime]]],
+        access_key: Union[SecretKey, bytes, KeyedSigner]
+    ) -> bytearray:
+        """Generates ACCESS payloads for many users at once. The headers and bodies are packed
+        in a single structured array, so the only per-record work done in Python is the HMAC-SHA1,
+        which is written in place right after the body of each record.
+
+        Each record of the returned buffer is byte-identical to the payload generated by the
+        single payload methods of `PayloadEncoder`.
+
+        Args:
+            operation (Union[OperationTypes, int]): the ACCESS operation (CHECK_IN, CHECK_OUT or BI_ACCESS)
+            user_ids (Union[np.ndarray, Sequence[int]]): the user ids
+            generated_at (Union[np.ndarray, Sequence[Union[int, datetime]]]): the generated_at timestamps,
+            as POSIX seconds, numpy datetime64 values or datetimes
+            access_key (Union[SecretKey, bytes, KeyedSigner]): the secret access key
+
+        Returns:
+            bytearray: the payloads, as a contiguous buffer of 29 bytes records
+
+        Examples:
+            >>> buffer = BatchPayloadEncoder.get_access_payloads(
+            ...     OperationTypes.CHECK_IN,
+            ...     user_ids=[2305947582, 2305947583],
+            ...     generated_at=[1752776040, 1752776040],
+            ...     access_key=SecretKey('85 f1 e2 04 ba 63 fe 41 a0 f0 da 37 74 3e 8d 1c 6a f5 33 fc')
+            ... )
+            >>> len(buffer)
+            58
+        """
+        user_ids_array = BatchPayloadEncoder.cast_to_uint32(user_ids)
+        generated_at_array = BatchPayloadEncoder.cast_times_to_uint32(generated_at)
+        if user_ids_array.shape != generated_at_array.shape:
+            raise ValueError('user_ids and generated_at must have the same length')
+
+        signer = access_key if type(access_key) == KeyedSigner else KeyedSigner(access_key)
+        header = PayloadHeaderEncoder.get_header(message_type=MessageTypes.ACCESS, operation=operation)
+
+        # packing headers and bodies
+        buffer = bytearray(ACCESS_PAYLOAD_LENGTH * len(user_ids_array))
+        records = np.frombuffer(buffer, dtype=ACCESS_PAYLOAD_DTYPE)
+        records['header'] = header[0]
+        records['user_id'] = user_ids_array
+        records['generated_at'] = generated_at_array
+
+        # signing
+        buffer_view = memoryview(buffer)
+        for offset in range(0, len(buffer), ACCESS_PAYLOAD_LENGTH):
+            message_end = offset + ACCESS_MESSAGE_LENGTH
+            buffer_view[message_end:offset + ACCESS_PAYLOAD_LENGTH] = signer.sign(buffer_view[offset:message_end])
+
+        return buffer
+
+
+    def split_payloads(buffer: Union[bytes, bytearray, memoryview], length: int = ACCESS_PAYLOAD_LENGTH) -> List[bytes]:
+        """Splits a contiguous buffer of fixed-size payloads into a list of payloads.
+
+        Args:
+            buffer (Union[bytes, bytearray, memoryview]): the buffer of payloads
+            length (int, optional): the length of each payload. Defaults to 29.
+
+        Returns:
+            List[bytes]: the payloads
+        """
+        buffer_view = memoryview(buffer)
+        payloads = [bytes(buffer_view[offset:offset + length]) for offset in range(0, len(buffer_view), length)]
+        return payloads
+
+
+    def cast_to_uint32(values: Union[np.ndarray, Sequence[int]]) -> np.ndarray:
+        """Casts the given integers into an unsigned 32 bits array, raising OverflowError, as
+        `BinaryEncoder.encode_int` does, if any of them does not fit in 32 bits.
+
+        Args:
+            values (Union[np.ndarray, Sequence[int]]): the input integers
+
+        Returns:
+            np.ndarray: the uint32 array
+        """
+        values_array = np.asarray(values)
+        if values_array.ndim != 1:
+            values_array = values_array.reshape(-1)
+        if values_array.size == 0:
+            return values_array.astype(np.uint32)
+        if values_array.dtype == object or not np.issubdtype(values_array.dtype, np.integer):
+            raise TypeError(f'expected integers, got {values_array.dtype}')
+        if int(values_array.min()) < 0 or int(values_array.max()) > UINT32_MAX:
+            raise OverflowError('value does not fit in an unsigned 32 bits integer')
+        return values_array.astype(np.uint32)
+
+
+    def cast_times_to_uint32(times: Union[np.ndarray, Sequence[Union[int, datetime]]]) -> np.ndarray:
+        """Casts the given timestamps into POSIX seconds, as an unsigned 32 bits array. Integers are
+        taken as POSIX seconds, numpy datetime64 values as UTC and datetimes are converted with
+        `datetime.timestamp()`, the same way `BinaryEncoder.encode_time` does.
+
+        Args:
+            times (Union[np.ndarray, Sequence[Union[int, datetime]]]): the input timestamps
+
+        Returns:
+            np.ndarray: the uint32 array of POSIX seconds
+        """
+        times_array = np.asarray(times)
+        if np.issubdtype(times_array.dtype, np.datetime64):
+            times_array = times_array.astype('datetime64[s]').astype(np.int64)
+        elif times_array.dtype == object:
+            times_array = np.fromiter(
+                (int(time.timestamp()) if type(time) == datetime else time for time in times_array.reshape(-1)),
+                dtype=np.int64,
+                count=times_array.size
+            )
+        return BatchPayloadEncoder.cast_to_uint32(times_array)
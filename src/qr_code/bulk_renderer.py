@@ -0,0 +1,170 @@
+import io
+import os
+from typing import *
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from qr_code.generator import QRCode
+from qr_code.matrix_builder import MatrixBuilders
+from qr_code.png_writer import PngWriter, ARCHIVAL_COMPRESS_LEVEL
+from qr_code.image_verifier import ImageVerifier
+
+
+class BulkRenderer:
+    def render(
+        items: Iterable[Union[bytes, QRCode, Tuple[str, bytes]]],
+        output_dir: Optional[str] = None,
+        callback: Optional[Callable[[str, bytes], None]] = None,
+        kind: str = 'png',
+        scale: int = 25,
+        border: int = 5,
+        processes: Optional[int] = None,
+        chunk_size: int = 32,
+        max_pending_chunks: Optional[int] = None,
+        compress_level: int = ARCHIVAL_COMPRESS_LEVEL,
+        verify: bool = False
+    ) -> int:
+        """Renders many QR Codes across a process pool. Only the raw payload bytes are sent to the
+        workers, which either write the images in `output_dir` (as `<name>.<kind>`) or send the encoded
+        images back to `callback`, in completion order. The items are consumed lazily and at most
+        `max_pending_chunks` chunks are in flight, so memory stays bounded for any number of items.
+
+        Args:
+            items (Iterable[Union[bytes, QRCode, Tuple[str, bytes]]]): the payloads, QR Code objects or
+            (name, payload) pairs. Unnamed items are named after their position, zero padded.
+            output_dir (Optional[str], optional): the directory to save the images. Defaults to None.
+            callback (Optional[Callable[[str, bytes], None]], optional): the function that receives the
+            name and the encoded image of each QR Code. Defaults to None.
+            kind (str, optional): the image format, as accepted by segno. Defaults to 'png'.
+            scale (int, optional): the scale of the QR Codes. Defaults to 25.
+            border (int, optional): the border size of the QR Codes. Defaults to 5.
+            processes (Optional[int], optional): the number of worker processes. Defaults to the CPU count.
+            chunk_size (int, optional): the number of QR Codes sent to a worker at a time. Defaults to 32.
+            max_pending_chunks (Optional[int], optional): the maximum number of chunks in flight.
+            Defaults to twice the number of processes.
+            compress_level (int, optional): the zlib level of PNGs. Defaults to ARCHIVAL_COMPRESS_LEVEL.
+            verify (bool, optional): if the workers decode each PNG back, after it is written, and fail
+            the batch when it does not match its payload. Defaults to False.
+
+        Raises:
+            ValueError: if neither or both of `output_dir` and `callback` are given, if only PNGs can
+            be verified, or if a verified image does not decode to its payload
+
+        Returns:
+            int: the number of rendered QR Codes
+        """
+        if (output_dir is None) == (callback is None):
+            raise ValueError('exactly one of output_dir and callback must be given')
+        if verify and kind != 'png':
+            raise ValueError(f'only PNG images can be verified, not {kind}')
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+
+        processes = processes or os.cpu_count()
+        max_pending_chunks = max_pending_chunks or 2 * processes
+        chunks = BulkRenderer.get_chunks(items, chunk_size)
+
+        rendered = 0
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            pending = set()
+            for chunk in chunks:
+                if len(pending) >= max_pending_chunks:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    rendered += BulkRenderer.collect(done, callback)
+                pending.add(executor.submit(BulkRenderer.render_chunk, chunk, output_dir, kind, scale, border, compress_level, verify))
+            rendered += BulkRenderer.collect(wait(pending).done, callback)
+
+        return rendered
+
+
+    def get_chunks(items: Iterable[Union[bytes, QRCode, Tuple[str, bytes]]], chunk_size: int) -> Iterator[List[Tuple[str, bytes]]]:
+        """Lazily groups the items in chunks of (name, payload) pairs.
+
+        Args:
+            items (Iterable[Union[bytes, QRCode, Tuple[str, bytes]]]): the payloads, QR Code objects or
+            (name, payload) pairs
+            chunk_size (int): the number of items per chunk
+
+        Returns:
+            Iterator[List[Tuple[str, bytes]]]: the chunks
+        """
+        named_items = (BulkRenderer.get_named_payload(index, item) for index, item in enumerate(items))
+        while True:
+            chunk = list(islice(named_items, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+
+    def get_named_payload(index: int, item: Union[bytes, QRCode, Tuple[str, bytes]]) -> Tuple[str, bytes]:
+        if isinstance(item, QRCode):
+            return f'{index:06d}', bytes(item.payload)
+        if type(item) == tuple:
+            name, payload = item
+            return name, bytes(payload)
+        return f'{index:06d}', bytes(item)
+
+
+    def collect(futures: Iterable, callback: Optional[Callable[[str, bytes], None]]) -> int:
+        """Collects the results of finished chunks, passing the images to the callback.
+
+        Args:
+            futures (Iterable): the finished futures
+            callback (Optional[Callable[[str, bytes], None]]): the function that receives the images
+
+        Returns:
+            int: the number of rendered QR Codes
+        """
+        rendered = 0
+        for future in futures:
+            results = future.result()
+            for name, image in results:
+                if callback is not None:
+                    callback(name, image)
+            rendered += len(results)
+        return rendered
+
+
+    def render_chunk(
+        named_payloads: List[Tuple[str, bytes]],
+        output_dir: Optional[str],
+        kind: str,
+        scale: int,
+        border: int,
+        compress_level: int = ARCHIVAL_COMPRESS_LEVEL,
+        verify: bool = False
+    ) -> List[Tuple[str, Optional[bytes]]]:
+        """Renders a chunk of payloads in a worker process. The images are saved in `output_dir` or,
+        if it is not given, returned encoded.
+
+        Args:
+            named_payloads (List[Tuple[str, bytes]]): the (name, payload) pairs
+            output_dir (Optional[str]): the directory to save the images
+            kind (str): the image format
+            scale (int): the scale of the QR Codes
+            border (int): the border size of the QR Codes
+            compress_level (int, optional): the zlib level of PNGs. Defaults to ARCHIVAL_COMPRESS_LEVEL.
+            verify (bool, optional): if each PNG is decoded back, from the disk when saved, and checked
+            against its payload. Defaults to False.
+
+        Raises:
+            ValueError: if a verified image does not decode to its payload
+
+        Returns:
+            List[Tuple[str, Optional[bytes]]]: the names and encoded images, None when saved to disk
+        """
+        results = []
+        for name, payload in named_payloads:
+            qrcode = MatrixBuilders.make_qr(payload)
+            if output_dir is not None:
+                path = os.path.join(output_dir, f'{name}.{kind}')
+                PngWriter.write_image(qrcode, path, kind, scale, border, compress_level)
+                if verify:
+                    ImageVerifier.check(path, payload)
+                results.append((name, None))
+            else:
+                buffer = io.BytesIO()
+                PngWriter.write_image(qrcode, buffer, kind, scale, border, compress_level)
+                if verify:
+                    ImageVerifier.check(buffer.getvalue(), payload)
+                results.append((name, buffer.getvalue()))
+        return results
@@ -0,0 +1,311 @@
+import os
+import hmac
+from typing import *
+from auth.secret_key import SecretKey
+from auth.signer import KeyedSigner
+from qr_code.encoder import MessageTypes, OperationTypes, PrivateKeyTypes, ProtocolVersions
+from qr_code.encoder import HASH_LENGTH, MIN_MAC_LENGTH, COMPACT_MAC_LENGTH, COMPACT_EPOCH
+
+HEADER_LENGTH = 1
+
+# body length of each message type; DEBUG bodies have no fixed length and no hash
+BODY_LENGTHS = {
+    MessageTypes.ACCESS: 8,
+    MessageTypes.SYNC: 4,
+    MessageTypes.CONFIG: 20,
+}
+
+# body length of each message type in the compact protocol, with the ACCESS time in 3 bytes of minutes
+COMPACT_BODY_LENGTHS = {
+    MessageTypes.ACCESS: 7,
+    MessageTypes.SYNC: 4,
+    MessageTypes.CONFIG: 20,
+}
+
+OPERATION_NAMES = {
+    MessageTypes.ACCESS: {
+        OperationTypes.CHECK_IN: 'CHECK_IN',
+        OperationTypes.CHECK_OUT: 'CHECK_OUT',
+        OperationTypes.BI_ACCESS: 'BI_ACCESS',
+    },
+    MessageTypes.SYNC: {
+        OperationTypes.SET_TIME: 'SET_TIME',
+    },
+    MessageTypes.CONFIG: {
+        OperationTypes.SET_MASTER_KEY: 'SET_MASTER_KEY',
+        OperationTypes.SET_CONFIG_KEY: 'SET_CONFIG_KEY',
+        OperationTypes.SET_SYNC_KEY: 'SET_SYNC_KEY',
+        OperationTypes.SET_ACCESS_KEY: 'SET_ACCESS_KEY',
+    },
+    MessageTypes.DEBUG: {
+        OperationTypes.BLINK_N_TIMES: 'BLINK_N_TIMES',
+        OperationTypes.BLINK_IF_SYNC: 'BLINK_IF_SYNC',
+    },
+}
+
+# key that signs each (message type, operation)
+SIGNING_KEY_TYPES = {
+    (MessageTypes.ACCESS, OperationTypes.CHECK_IN): PrivateKeyTypes.ACCESS_KEY,
+    (MessageTypes.ACCESS, OperationTypes.CHECK_OUT): PrivateKeyTypes.ACCESS_KEY,
+    (MessageTypes.ACCESS, OperationTypes.BI_ACCESS): PrivateKeyTypes.ACCESS_KEY,
+    (MessageTypes.SYNC, OperationTypes.SET_TIME): PrivateKeyTypes.SYNC_KEY,
+    (MessageTypes.CONFIG, OperationTypes.SET_MASTER_KEY): PrivateKeyTypes.MASTER_KEY,
+    (MessageTypes.CONFIG, OperationTypes.SET_CONFIG_KEY): PrivateKeyTypes.MASTER_KEY,
+    (MessageTypes.CONFIG, OperationTypes.SET_SYNC_KEY): PrivateKeyTypes.CONFIG_KEY,
+    (MessageTypes.CONFIG, OperationTypes.SET_ACCESS_KEY): PrivateKeyTypes.CONFIG_KEY,
+}
+
+
+class DecodedPayload:
+    """Decoded QR Code payload. The body and hash are memoryview slices of the scanned payload,
+    so decoding copies no bytes.
+    """
+    __slots__ = ('message_type', 'operation', 'message', 'body', 'hash', 'version')
+
+
+    def __init__(
+        self,
+        message_type: int,
+        operation: int,
+        message: memoryview,
+        body: memoryview,
+        hash: Optional[memoryview],
+        version: int = ProtocolVersions.STANDARD
+    ):
+        self.message_type = message_type
+        self.operation = operation
+        self.message = message
+        self.body = body
+        self.hash = hash
+        self.version = version
+
+
+    def get_operation_name(self) -> str:
+        return OPERATION_NAMES[self.message_type][self.operation]
+
+
+    def get_user_id(self) -> int:
+        return int.from_bytes(self.body[0:4], byteorder='big')
+
+
+    def get_time(self) -> int:
+        """Gets the POSIX time of the payload: the generated_at of ACCESS payloads, the sync_time of
+        SYNC payloads or the current_time of BLINK_IF_SYNC payloads.
+        """
+        time_offset = 4 if self.message_type == MessageTypes.ACCESS else 0
+        if self.version == ProtocolVersions.COMPACT and self.message_type == MessageTypes.ACCESS:
+            return COMPACT_EPOCH + 60 * int.from_bytes(self.body[time_offset:time_offset + 3], byteorder='big')
+        return int.from_bytes(self.body[time_offset:time_offset + 4], byteorder='big')
+
+
+    def get_new_key(self) -> bytes:
+        return bytes(self.body)
+
+
+    def __str__(self):
+        print_str = f'Decoded Payload\n'
+        print_str += f'action: {self.get_operation_name()}\n'
+        print_str += f'body: {self.body.hex(" ")}\n'
+        print_str += f'hash: {self.hash.hex(" ") if self.hash is not None else None}'
+        return print_str
+
+
+class VerificationResult(NamedTuple):
+    valid: bool
+    message_type: Optional[int] = None
+    operation: Optional[int] = None
+    error: Optional[str] = None
+
+
+class PayloadDecoder:
+    def decode(payload: Union[bytes, bytearray, memoryview]) -> DecodedPayload:
+        """Splits the payload in header, body and hash and identifies its message type and operation.
+        The body and hash are memoryview slices of the payload, with no copies.
+
+        Args:
+            payload (Union[bytes, bytearray, memoryview]): the scanned payload
+
+        Raises:
+            ValueError: if the message type or operation are unknown or the payload length does not match them
+
+        Returns:
+            DecodedPayload: the decoded payload
+        """
+        payload_view = memoryview(payload)
+        if len(payload_view) < HEADER_LENGTH:
+            raise ValueError('empty payload')
+
+        header = payload_view[0]
+        version = header >> 6
+        message_type = (header >> 4) & 3
+        operation = header & 15
+        if version > ProtocolVersions.COMPACT or operation not in OPERATION_NAMES.get(message_type, ()):
+            raise ValueError(f'unknown header {header:02x}')
+
+        if message_type == MessageTypes.DEBUG:
+            body = payload_view[HEADER_LENGTH:]
+            return DecodedPayload(message_type, operation, payload_view, body, None, version)
+
+        if version == ProtocolVersions.STANDARD:
+            body_end = HEADER_LENGTH + BODY_LENGTHS[message_type]
+            if len(payload_view) != body_end + HASH_LENGTH:
+                raise ValueError(f'expected {body_end + HASH_LENGTH} bytes, got {len(payload_view)}')
+        else:
+            body_end = HEADER_LENGTH + COMPACT_BODY_LENGTHS[message_type]
+            if not body_end + MIN_MAC_LENGTH <= len(payload_view) <= body_end + HASH_LENGTH:
+                raise ValueError(f'expected {body_end + MIN_MAC_LENGTH} to {body_end + HASH_LENGTH} bytes, got {len(payload_view)}')
+
+        message = payload_view[:body_end]
+        body = payload_view[HEADER_LENGTH:body_end]
+        hash = payload_view[body_end:]
+        return DecodedPayload(message_type, operation, message, body, hash, version)
+
+
+    def get_signing_key_type(message_type: int, operation: int) -> Optional[int]:
+        """Gets the type of the private key that signs the given message type and operation.
+
+        Args:
+            message_type (int): the message type
+            operation (int): the operation
+
+        Returns:
+            Optional[int]: the `PrivateKeyTypes` of the key, or None for the unsigned DEBUG payloads
+        """
+        return SIGNING_KEY_TYPES.get((message_type, operation))
+
+
+    def verify(
+        payload: Union[bytes, bytearray, memoryview],
+        keys: Dict[int, Union[bytes, SecretKey, KeyedSigner]],
+        mac_length: int = COMPACT_MAC_LENGTH
+    ) -> VerificationResult:
+        """Decodes the payload and checks its HMAC-SHA1 against the key of its operation. Never raises:
+        malformed payloads and missing keys are reported as invalid, with the error message. Compact
+        payloads are only accepted with the configured MAC length, so a forger cannot pick a shorter one.
+
+        Args:
+            payload (Union[bytes, bytearray, memoryview]): the scanned payload
+            keys (Dict[int, Union[bytes, SecretKey, KeyedSigner]]): the private keys, by `PrivateKeyTypes`
+            mac_length (int, optional): the truncated HMAC length of compact payloads, in bytes.
+            Defaults to COMPACT_MAC_LENGTH.
+
+        Returns:
+            VerificationResult: the validity of the payload
+        """
+        try:
+            decoded = PayloadDecoder.decode(payload)
+        except (ValueError, TypeError) as error:
+            return VerificationResult(valid=False, error=str(error))
+        return PayloadDecoder.verify_decoded(decoded, keys, mac_length)
+
+
+    def verify_decoded(
+        decoded: DecodedPayload,
+        keys: Dict[int, Union[bytes, SecretKey, KeyedSigner]],
+        mac_length: int = COMPACT_MAC_LENGTH
+    ) -> VerificationResult:
+        """Checks the HMAC-SHA1 of an already decoded payload, as `verify` does.
+
+        Args:
+            decoded (DecodedPayload): the decoded payload
+            keys (Dict[int, Union[bytes, SecretKey, KeyedSigner]]): the private keys, by `PrivateKeyTypes`
+            mac_length (int, optional): the truncated HMAC length of compact payloads, in bytes.
+            Defaults to COMPACT_MAC_LENGTH.
+
+        Returns:
+            VerificationResult: the validity of the payload
+        """
+        message_type, operation = decoded.message_type, decoded.operation
+        key_type = PayloadDecoder.get_signing_key_type(message_type, operation)
+        if key_type is None:
+            return VerificationResult(True, message_type, operation)
+
+        key = keys.get(key_type)
+        if key is None:
+            return VerificationResult(False, message_type, operation, f'missing key {key_type}')
+        signer = key if type(key) == KeyedSigner else KeyedSigner(key)
+
+        if decoded.version == ProtocolVersions.STANDARD:
+            valid = signer.verify_signature(decoded.message, decoded.hash)
+        elif len(decoded.hash) != mac_length:
+            return VerificationResult(False, message_type, operation, f'expected a {mac_length} bytes MAC, got {len(decoded.hash)}')
+        else:
+            valid = hmac.compare_digest(signer.sign(decoded.message)[:mac_length], decoded.hash)
+        return VerificationResult(valid, message_type, operation, None if valid else 'invalid signature')
+
+
+    def verify_many(
+        payloads: Iterable[Union[bytes, bytearray]],
+        keys: Dict[int, Union[bytes, SecretKey]],
+        processes: Optional[int] = None,
+        chunk_size: int = 4096,
+        mac_length: int = COMPACT_MAC_LENGTH
+    ) -> List[VerificationResult]:
+        """Verifies many payloads, in chunks spread across a process pool. Batches smaller than a
+        single chunk, or `processes=1`, are verified in the current process.
+
+        Args:
+            payloads (Iterable[Union[bytes, bytearray]]): the scanned payloads
+            keys (Dict[int, Union[bytes, SecretKey]]): the private keys, by `PrivateKeyTypes`
+            processes (Optional[int], optional): the number of worker processes. Defaults to the CPU count.
+            chunk_size (int, optional): the number of payloads sent to a worker at a time. Defaults to 4096.
+            mac_length (int, optional): the truncated HMAC length of compact payloads, in bytes.
+            Defaults to COMPACT_MAC_LENGTH.
+
+        Returns:
+            List[VerificationResult]: the validity of each payload, in the input order
+        """
+        payloads = [bytes(payload) for payload in payloads]
+        key_values = {
+            key_type: key.value if type(key) == SecretKey else key
+            for key_type, key in keys.items()
+        }
+        if processes == 1 or len(payloads) <= chunk_size:
+            return PayloadDecoder.verify_chunk(payloads, key_values, mac_length)
+
+        chunks = [payloads[start:start + chunk_size] for start in range(0, len(payloads), chunk_size)]
+
+        from concurrent.futures import ProcessPoolExecutor # only the large batches pay for its import
+        results = []
+        with ProcessPoolExecutor(max_workers=processes or os.cpu_count()) as executor:
+            for chunk_results in executor.map(PayloadDecoder.verify_chunk, chunks, [key_values] * len(chunks), [mac_length] * len(chunks)):
+                results.extend(chunk_results)
+        return results
+
+
+    def verify_chunk(payloads: List[bytes], keys: Dict[int, bytes], mac_length: int = COMPACT_MAC_LENGTH) -> List[VerificationResult]:
+        """Verifies a chunk of payloads, sharing one `KeyedSigner` per key.
+
+        Args:
+            payloads (List[bytes]): the scanned payloads
+            keys (Dict[int, bytes]): the private keys, by `PrivateKeyTypes`
+            mac_length (int, optional): the truncated HMAC length of compact payloads. Defaults to COMPACT_MAC_LENGTH.
+
+        Returns:
+            List[VerificationResult]: the validity of each payload
+        """
+        signers = {key_type: KeyedSigner(key) for key_type, key in keys.items()}
+        return [PayloadDecoder.verify(payload, signers, mac_length) for payload in payloads]
+
+
+    def read_payloads(path: str) -> List[bytes]:
+        """Reads the payloads of a text dump, such as `test_qrcodes/payloads.txt`, where each payload
+        is on a line of hex digits in pairs, optionally prefixed by `payload:`.
+
+        Args:
+            path (str): the path of the dump
+
+        Returns:
+            List[bytes]: the payloads
+        """
+        payloads = []
+        with open(path) as file:
+            for line in file:
+                hex_str = line.rpartition('payload:')[2].strip()
+                try:
+                    payload = bytes.fromhex(hex_str)
+                except ValueError:
+                    continue
+                if payload:
+                    payloads.append(payload)
+        return payloads
@@ -1,8 +1,11 @@
+import os
+import struct
+import operator
 from enum import Enum
 from typing import *
-from datetime import datetime
+from datetime import datetime, timezone
 from auth.secret_key import SecretKey
-from auth.signer import Signer
+from auth.signer import Signer, KeyedSigner
 
 class MessageTypes:
     ACCESS = 0
@@ -31,309 +34,279 @@ class PrivateKeyTypes:
     CONFIG_KEY = 3
 
 
+class ProtocolVersions:
+    STANDARD = 0 # header + body + HMAC-SHA1 (20 bytes)
+    COMPACT = 1 # header + tighter body + truncated HMAC-SHA1
+
+
+HASH_LENGTH = 20
+MIN_MAC_LENGTH = 4
+COMPACT_MAC_LENGTH = 8 # 64 bits: a forgery is accepted with probability 2**-64 per scan
+COMPACT_EPOCH = 1704067200 # 2024-01-01 00:00 UTC, the origin of the compact times
+COMPACT_MINUTES = 1 << 24 # the compact times are 24 bits minutes since COMPACT_EPOCH, until 2055-11-24
+
+# environment variables of the secret keys, as hex strings, read by the server and the command line
+KEY_ENVIRONMENT_VARIABLES = {
+    PrivateKeyTypes.MASTER_KEY: 'CAUSP_MASTER_KEY',
+    PrivateKeyTypes.ACCESS_KEY: 'CAUSP_ACCESS_KEY',
+    PrivateKeyTypes.SYNC_KEY: 'CAUSP_SYNC_KEY',
+    PrivateKeyTypes.CONFIG_KEY: 'CAUSP_CONFIG_KEY',
+}
+
+
+def get_keys_from_environment() -> Dict[int, SecretKey]:
+    """Reads the secret keys, as hex strings, from the CAUSP_MASTER_KEY, CAUSP_ACCESS_KEY, CAUSP_SYNC_KEY
+    and CAUSP_CONFIG_KEY environment variables. Missing keys are left out.
+    """
+    return {
+        key_type: SecretKey(os.environ[variable])
+        for key_type, variable in KEY_ENVIRONMENT_VARIABLES.items()
+        if os.environ.get(variable)
+    }
+
+
 class PayloadEncoder:
-    def get_check_in_payload(user_id: int, generated_at: datetime, access_key: Union[SecretKey, str]) -> bytes:
+    def get_check_in_payload(
+        user_id: int,
+        generated_at: datetime,
+        access_key: Union[SecretKey, str],
+        compact: bool = False,
+        mac_length: int = COMPACT_MAC_LENGTH
+    ) -> bytes:
         """Generates the QR Code payload for the check-in.
 
         Args:
             user_id (int): the user id
             generated_at (datetime): the generated_at timestamp
             access_key (Union[SecretKey, str]): the secret access key
+            compact (bool, optional): if the payload is in the compact protocol. Defaults to False.
+            mac_length (int, optional): the truncated HMAC length of compact payloads, in bytes.
+            Defaults to COMPACT_MAC_LENGTH.
 
         Returns:
             bytes: the payload
         """
-        message_type = MessageTypes.ACCESS
-        operation = OperationTypes.CHECK_IN
-        
-        # encoding
-        header = PayloadHeaderEncoder.get_header(
-            message_type=message_type,
-            operation=operation
-        )
-        body = PayloadBodyEncoder.get_body(
-            message_type=message_type,
-            operation=operation,
-            user_id=user_id,
-            generated_at=generated_at
-        )
-        hash = PayloadHashEncoder.get_hash(header, body, access_key)
-        payload = header + body + hash
-        
-        return payload
+        schema = PayloadSchema.get_schema(MessageTypes.ACCESS, OperationTypes.CHECK_IN, compact, mac_length)
+        return schema.encode(user_id, generated_at, key=access_key)
     
     
-    def get_check_out_payload(user_id: int, generated_at: datetime, access_key: Union[SecretKey, str]) -> bytes:
+    def get_check_out_payload(
+        user_id: int,
+        generated_at: datetime,
+        access_key: Union[SecretKey, str],
+        compact: bool = False,
+        mac_length: int = COMPACT_MAC_LENGTH
+    ) -> bytes:
         """Generates the QR Code payload for the check-out.
 
         Args:
             user_id (int): the user id
             generated_at (datetime): the generated_at timestamp
             access_key (Union[SecretKey, str]): the secret access key
+            compact (bool, optional): if the payload is in the compact protocol. Defaults to False.
+            mac_length (int, optional): the truncated HMAC length of compact payloads, in bytes.
+            Defaults to COMPACT_MAC_LENGTH.
 
         Returns:
             bytes: the payload
         """
-        message_type = MessageTypes.ACCESS
-        operation = OperationTypes.CHECK_OUT
-        
-        # encoding
-        header = PayloadHeaderEncoder.get_header(
-            message_type=message_type,
-            operation=operation
-        )
-        body = PayloadBodyEncoder.get_body(
-            message_type=message_type,
-            operation=operation,
-            user_id=user_id,
-            generated_at=generated_at
-        )
-        hash = PayloadHashEncoder.get_hash(header, body, access_key)
-        payload = header + body + hash
-        
-        return payload
+        schema = PayloadSchema.get_schema(MessageTypes.ACCESS, OperationTypes.CHECK_OUT, compact, mac_length)
+        return schema.encode(user_id, generated_at, key=access_key)
     
     
-    def get_bi_access_payload(user_id: int, generated_at: datetime, access_key: Union[SecretKey, str]) -> bytes:
+    def get_bi_access_payload(
+        user_id: int,
+        generated_at: datetime,
+        access_key: Union[SecretKey, str],
+        compact: bool = False,
+        mac_length: int = COMPACT_MAC_LENGTH
+    ) -> bytes:
         """Generates the QR Code payload for the bi access.
 
         Args:
             user_id (int): the user id
             generated_at (datetime): the generated_at timestamp
             access_key (Union[SecretKey, str]): the secret access key
+            compact (bool, optional): if the payload is in the compact protocol. Defaults to False.
+            mac_length (int, optional): the truncated HMAC length of compact payloads, in bytes.
+            Defaults to COMPACT_MAC_LENGTH.
 
         Returns:
             bytes: the payload
         """
-        message_type = MessageTypes.ACCESS
-        operation = OperationTypes.BI_ACCESS
-        
-        # encoding
-        header = PayloadHeaderEncoder.get_header(
-            message_type=message_type,
-            operation=operation
-        )
-        body = PayloadBodyEncoder.get_body(
-            message_type=message_type,
-            operation=operation,
-            user_id=user_id,
-            generated_at=generated_at
-        )
-        hash = PayloadHashEncoder.get_hash(header, body, access_key)
-        payload = header + body + hash
-        
-        return payload
+        schema = PayloadSchema.get_schema(MessageTypes.ACCESS, OperationTypes.BI_ACCESS, compact, mac_length)
+        return schema.encode(user_id, generated_at, key=access_key)
     
     
-    def get_set_time_payload(sync_time: datetime, sync_key: Union[SecretKey, str]) -> bytes:
+    def get_set_time_payload(
+        sync_time: datetime,
+        sync_key: Union[SecretKey, str],
+        compact: bool = False,
+        mac_length: int = COMPACT_MAC_LENGTH
+    ) -> bytes:
         """Generates the QR Code payload for time sync.
 
         Args:
             sync_time (datetime): the sync time
             sync_key (Union[SecretKey, str]): the secret sync key
+            compact (bool, optional): if the payload is in the compact protocol. Defaults to False.
+            mac_length (int, optional): the truncated HMAC length of compact payloads, in bytes.
+            Defaults to COMPACT_MAC_LENGTH.
 
         Returns:
             bytes: the payload
         """
-        message_type = MessageTypes.SYNC
-        operation = OperationTypes.SET_TIME
-        
-        # encoding
-        header = PayloadHeaderEncoder.get_header(
-            message_type=message_type,
-            operation=operation
-        )
-        body = PayloadBodyEncoder.get_body(
-            message_type=message_type,
-            operation=operation,
-            sync_time=sync_time
-        )
-        hash = PayloadHashEncoder.get_hash(header, body, sync_key)
-        payload = header + body + hash
-        
-        return payload
+        schema = PayloadSchema.get_schema(MessageTypes.SYNC, OperationTypes.SET_TIME, compact, mac_length)
+        return schema.encode(sync_time, key=sync_key)
     
     
-    def get_set_master_key_payload(new_master_key: str, old_master_key: Union[SecretKey, str]) -> bytes:
+    def get_set_master_key_payload(
+        new_master_key: str,
+        old_master_key: Union[SecretKey, str],
+        compact: bool = False,
+        mac_length: int = COMPACT_MAC_LENGTH
+    ) -> bytes:
         """Generates the QR Code payload for setting a new master key.
 
         Args:
             new_master_key (str): the new secret master key
             old_master_key (Union[SecretKey, str]): the old secret master key
+            compact (bool, optional): if the payload is in the compact protocol. Defaults to False.
+            mac_length (int, optional): the truncated HMAC length of compact payloads, in bytes.
+            Defaults to COMPACT_MAC_LENGTH.
+
+        Raises:
+            ValueError: if the new key is longer than 20 bytes or not a hex string
 
         Returns:
             bytes: the payload
         """
-        message_type = MessageTypes.CONFIG
-        operation = OperationTypes.SET_MASTER_KEY
-        
-        # encoding
-        header = PayloadHeaderEncoder.get_header(
-            message_type=message_type,
-            operation=operation
-        )
-        body = PayloadBodyEncoder.get_body(
-            message_type=message_type,
-            operation=operation,
-            new_key=new_master_key
-        )
-        hash = PayloadHashEncoder.get_hash(header, body, old_master_key)
-        payload = header + body + hash
-        
-        return payload
+        schema = PayloadSchema.get_schema(MessageTypes.CONFIG, OperationTypes.SET_MASTER_KEY, compact, mac_length)
+        return schema.encode(new_master_key, key=old_master_key)
     
     
-    def get_set_access_key_payload(new_access_key: str, config_key: Union[SecretKey, str]) -> bytes:
+    def get_set_access_key_payload(
+        new_access_key: str,
+        config_key: Union[SecretKey, str],
+        compact: bool = False,
+        mac_length: int = COMPACT_MAC_LENGTH
+    ) -> bytes:
         """Generates the QR Code payload for setting a new access key.
 
         Args:
             new_access_key (str): the new secret access key
             config_key (Union[SecretKey, str]): the secret config key
+            compact (bool, optional): if the payload is in the compact protocol. Defaults to False.
+            mac_length (int, optional): the truncated HMAC length of compact payloads, in bytes.
+            Defaults to COMPACT_MAC_LENGTH.
+
+        Raises:
+            ValueError: if the new key is longer than 20 bytes or not a hex string
 
         Returns:
             bytes: the payload
         """
-        message_type = MessageTypes.CONFIG
-        operation = OperationTypes.SET_ACCESS_KEY
-        
-        # encoding
-        header = PayloadHeaderEncoder.get_header(
-            message_type=message_type,
-            operation=operation
-        )
-        body = PayloadBodyEncoder.get_body(
-            message_type=message_type,
-            operation=operation,
-            new_key=new_access_key
-        )
-        hash = PayloadHashEncoder.get_hash(header, body, config_key)
-        payload = header + body + hash
-        
-        return payload
+        schema = PayloadSchema.get_schema(MessageTypes.CONFIG, OperationTypes.SET_ACCESS_KEY, compact, mac_length)
+        return schema.encode(new_access_key, key=config_key)
     
     
-    def get_set_sync_key_payload(new_sync_key: str, config_key: Union[SecretKey, str]) -> bytes:
+    def get_set_sync_key_payload(
+        new_sync_key: str,
+        config_key: Union[SecretKey, str],
+        compact: bool = False,
+        mac_length: int = COMPACT_MAC_LENGTH
+    ) -> bytes:
         """Generates the QR Code payload for setting a new sync key.
 
         Args:
             new_sync_key (str): the new secret sync key
             config_key (Union[SecretKey, str]): the secret config key
+            compact (bool, optional): if the payload is in the compact protocol. Defaults to False.
+            mac_length (int, optional): the truncated HMAC length of compact payloads, in bytes.
+            Defaults to COMPACT_MAC_LENGTH.
+
+        Raises:
+            ValueError: if the new key is longer than 20 bytes or not a hex string
 
         Returns:
             bytes: the payload
         """
-        message_type = MessageTypes.CONFIG
-        operation = OperationTypes.SET_SYNC_KEY
-        
-        # encoding
-        header = PayloadHeaderEncoder.get_header(
-            message_type=message_type,
-            operation=operation
-        )
-        body = PayloadBodyEncoder.get_body(
-            message_type=message_type,
-            operation=operation,
-            new_key=new_sync_key
-        )
-        hash = PayloadHashEncoder.get_hash(header, body, config_key)
-        payload = header + body + hash
-        
-        return payload
+        schema = PayloadSchema.get_schema(MessageTypes.CONFIG, OperationTypes.SET_SYNC_KEY, compact, mac_length)
+        return schema.encode(new_sync_key, key=config_key)
     
     
-    def get_set_config_key_payload(new_config_key: str, master_key: Union[SecretKey, str]) -> bytes:
+    def get_set_config_key_payload(
+        new_config_key: str,
+        master_key: Union[SecretKey, str],
+        compact: bool = False,
+        mac_length: int = COMPACT_MAC_LENGTH
+    ) -> bytes:
         """Generates the QR Code payload for setting a new config key.
 
         Args:
             new_config_key (str): the new secret config key
             master_key (Union[SecretKey, str]): the secret master key
+            compact (bool, optional): if the payload is in the compact protocol. Defaults to False.
+            mac_length (int, optional): the truncated HMAC length of compact payloads, in bytes.
+            Defaults to COMPACT_MAC_LENGTH.
+
+        Raises:
+            ValueError: if the new key is longer than 20 bytes or not a hex string
 
         Returns:
             bytes: the payload
         """
-        message_type = MessageTypes.CONFIG
-        operation = OperationTypes.SET_CONFIG_KEY
-        
-        # encoding
-        header = PayloadHeaderEncoder.get_header(
-            message_type=message_type,
-            operation=operation
-        )
-        body = PayloadBodyEncoder.get_body(
-            message_type=message_type,
-            operation=operation,
-            new_key=new_config_key
-        )
-        hash = PayloadHashEncoder.get_hash(header, body, master_key)
-        payload = header + body + hash
-        
-        return payload
+        schema = PayloadSchema.get_schema(MessageTypes.CONFIG, OperationTypes.SET_CONFIG_KEY, compact, mac_length)
+        return schema.encode(new_config_key, key=master_key)
     
     
-    def get_blink_n_times_payload(blink_num: str) -> bytes:
+    def get_blink_n_times_payload(blink_num: str, compact: bool = False) -> bytes:
         """Generates the QR Code payload for the blink-n-times test.
 
         Args:
             blink_num (str): the number of blinks per read
+            compact (bool, optional): if the payload is in the compact protocol. Defaults to False.
+
+        Raises:
+            ValueError: if the number is a hex str longer than 32 bytes
 
         Returns:
             bytes: the payload
         """
-        message_type = MessageTypes.DEBUG
-        operation = OperationTypes.BLINK_N_TIMES
-        
-        # encoding
-        header = PayloadHeaderEncoder.get_header(
-            message_type=message_type,
-            operation=operation
-        )
-        body = PayloadBodyEncoder.get_body(
-            message_type=message_type,
-            operation=operation,
-            debug_data=blink_num
-        )
-        payload = header + body
-        
-        return payload
+        schema = PayloadSchema.get_schema(MessageTypes.DEBUG, OperationTypes.BLINK_N_TIMES, compact)
+        return schema.encode(blink_num)
     
     
-    def get_debug_sync_payload(current_time: datetime) -> bytes:
+    def get_debug_sync_payload(current_time: datetime, compact: bool = False) -> bytes:
         """Generates the QR Code payload for the sync test.
 
         Args:
             current_time (datetime): the current datetime
+            compact (bool, optional): if the payload is in the compact protocol. Defaults to False.
 
         Returns:
             bytes: the payload
         """
-        message_type = MessageTypes.DEBUG
-        operation = OperationTypes.BLINK_IF_SYNC
-        
-        # encoding
-        header = PayloadHeaderEncoder.get_header(
-            message_type=message_type,
-            operation=operation
-        )
-        body = PayloadBodyEncoder.get_body(
-            message_type=message_type,
-            operation=operation,
-            debug_data=current_time
-        )
-        payload = header + body
-        
-        return payload
+        schema = PayloadSchema.get_schema(MessageTypes.DEBUG, OperationTypes.BLINK_IF_SYNC, compact)
+        return schema.encode(current_time)
 
 
 class PayloadHeaderEncoder:
-    def get_header(message_type: Union[MessageTypes, int], operation: Union[OperationTypes, int]) -> bytes:
+    def get_header(
+        message_type: Union[MessageTypes, int],
+        operation: Union[OperationTypes, int],
+        version: int = ProtocolVersions.STANDARD
+    ) -> bytes:
         """Generates the payload header, with a message type and an operation, in a single byte. In the header
         encoding, the 4 most significant bits are the message type  and the 4 less significant are the operation
         bits. For example, with the payload being message_type = 0 (ACCESS) and operation = 1 (CHECK_OUT), the 
-        header will be header = 0x01 (hex) = 0000 0001 (bin).
+        header will be header = 0x01 (hex) = 0000 0001 (bin). The message types only take the 2 lower bits of
+        their half, and the 2 upper bits are the protocol version, 0 for the standard protocol.
 
         Args:
             message_type (Union[MessageTypes, int]): the message type
             operation (Union[OperationTypes, int]): the operation
+            version (int, optional): the protocol version. Defaults to ProtocolVersions.STANDARD.
 
         Returns:
             bytes: the encoded header
@@ -342,7 +315,7 @@ class PayloadHeaderEncoder:
         operation_int = operation.value if type(operation) == OperationTypes else operation
         high_byte = (message_type_int << 4) & 240 # high_byte = (msg_type << 4) & 0xF0
         low_byte = operation_int & 15 # low_byte = op & 0x0F
-        header = high_byte + low_byte
+        header = (version << 6) + high_byte + low_byte
         header = header.to_bytes()
         return header
 
@@ -516,21 +489,38 @@ class PayloadBodyEncoder:
     
 
 class PayloadHashEncoder:
-    def get_hash(header: bytes, body: bytes, private_key: Union[bytes, SecretKey]) -> bytes:
-        """Generates the signature of the message (header + body), with HMAC-SHA1.
+    def get_hash(
+        header: bytes,
+        body: bytes,
+        private_key: Union[bytes, SecretKey, KeyedSigner],
+        mac_length: int = HASH_LENGTH
+    ) -> bytes:
+        """Generates the signature of the message (header + body), with HMAC-SHA1. If the private key
+        is given as a `KeyedSigner`, its precomputed key states are reused.
 
         Args:
             header (bytes): the payload header
             body (bytes): the payload body
-            private_key (Union[bytes, SecretKey]): the private key
+            private_key (Union[bytes, SecretKey, KeyedSigner]): the private key
+            mac_length (int, optional): the signature length, truncated to its first bytes for the
+            compact protocol. Defaults to HASH_LENGTH, 20.
+
+        Raises:
+            ValueError: if the signature length is not between MIN_MAC_LENGTH and HASH_LENGTH
 
         Returns:
             bytes: the signature (HMAC-SHA1)
         """
+        if not MIN_MAC_LENGTH <= mac_length <= HASH_LENGTH:
+            raise ValueError(
+                f'the MAC length must be between {MIN_MAC_LENGTH} and {HASH_LENGTH} bytes, not {mac_length}'
+            )
         message = header + body
+        if type(private_key) == KeyedSigner:
+            return private_key.sign(message)[:mac_length]
         key = private_key.value if type(private_key) == SecretKey else private_key
         hash = Signer.sign(message, key)
-        return hash
+        return hash[:mac_length]
 
 
 class BinaryEncoder:
@@ -614,4 +604,329 @@ class BinaryEncoder:
             byteorder=byte_order,
             signed=False
         )
-        return encoded_int
\ No newline at end of file
+        return encoded_int
+
+class FieldTypes:
+    UINT32 = 0 # unsigned 32 bits integer
+    TIME = 1 # datetime, as unsigned 32 bits POSIX seconds
+    KEY = 2 # 20 bytes key, from a SecretKey, bytes or hex str
+    DEBUG = 3 # hex str (32 bytes), int (4 bytes) or datetime (4 bytes), laid out by the value type
+    MINUTES = 4 # datetime, as unsigned 24 bits minutes since COMPACT_EPOCH (until 2055)
+
+
+class PayloadField(NamedTuple):
+    name: str
+    field_type: int
+
+
+class PayloadSchema:
+    FIELD_FORMATS = {
+        FieldTypes.UINT32: 'I',
+        FieldTypes.TIME: 'I',
+        FieldTypes.KEY: '20s',
+        FieldTypes.MINUTES: '3s',
+    }
+    KEY_LENGTH = 20
+    DEBUG_STR_LENGTH = 32
+
+
+    def __init__(
+        self,
+        name: str,
+        message_type: int,
+        operation: int,
+        fields: Tuple[PayloadField, ...],
+        signed: bool,
+        version: int = ProtocolVersions.STANDARD,
+        mac_length: int = HASH_LENGTH
+    ):
+        """Layout of the payload of a (message type, operation). The fields are declared once and
+        compiled into a `struct.Struct` whose first byte is the constant header, so the header and body
+        of a payload are packed by a single call, followed by the HMAC of signed messages. DEBUG fields
+        are laid out by the type of their value, with one compiled struct per layout.
+
+        Args:
+            name (str): the operation name, such as 'CHECK_IN'
+            message_type (int): the message type
+            operation (int): the operation
+            fields (Tuple[PayloadField, ...]): the body fields, in order
+            signed (bool): if the payload ends with the HMAC-SHA1 of the header and body
+            version (int, optional): the protocol version. Defaults to ProtocolVersions.STANDARD.
+            mac_length (int, optional): the length of the HMAC, truncated in the compact protocol.
+            Defaults to HASH_LENGTH.
+        """
+        self.name = name
+        self.message_type = message_type
+        self.operation = operation
+        self.fields = fields
+        self.signed = signed
+        self.version = version
+        self.mac_length = mac_length
+        self.header = (version << 6) | ((message_type << 4) & 0x30) | (operation & 0x0f)
+        self.converters = tuple(PayloadSchema.get_converter(field.field_type) for field in fields)
+        self.variable = any(field.field_type == FieldTypes.DEBUG for field in fields)
+        self.layouts: Dict[str, struct.Struct] = {}
+        self.layout = None if self.variable else self.get_layout(
+            ''.join(PayloadSchema.FIELD_FORMATS[field.field_type] for field in fields)
+        )
+
+
+    def get_layout(self, body_format: str) -> struct.Struct:
+        layout = self.layouts.get(body_format)
+        if layout is None:
+            layout = self.layouts[body_format] = struct.Struct('>B' + body_format)
+        return layout
+
+
+    def get_converter(field_type: int) -> Callable[[Any], Any]:
+        return {
+            FieldTypes.UINT32: operator.index,
+            FieldTypes.TIME: PayloadSchema.convert_time,
+            FieldTypes.KEY: PayloadSchema.convert_key,
+            FieldTypes.DEBUG: PayloadSchema.convert_debug_data,
+            FieldTypes.MINUTES: PayloadSchema.convert_minutes,
+        }[field_type]
+
+
+    def convert_time(time: datetime) -> int:
+        return int(time.timestamp())
+
+
+    def convert_minutes(time: datetime) -> bytes:
+        minutes = (int(time.timestamp()) - COMPACT_EPOCH) // 60
+        if not 0 <= minutes < COMPACT_MINUTES:
+            first = datetime.fromtimestamp(COMPACT_EPOCH, timezone.utc)
+            last = datetime.fromtimestamp(COMPACT_EPOCH + 60 * (COMPACT_MINUTES - 1), timezone.utc)
+            raise ValueError(
+                f'compact times must be between {first:%Y-%m-%d %H:%M} and {last:%Y-%m-%d %H:%M} UTC, not {time}'
+            )
+        return minutes.to_bytes(3, byteorder='big')
+
+
+    def convert_key(key: Union[SecretKey, bytes, str]) -> bytes:
+        key_bytes = key.value if type(key) == SecretKey else bytes.fromhex(key) if type(key) == str else bytes(key)
+        if len(key_bytes) > PayloadSchema.KEY_LENGTH:
+            raise ValueError(f'the key has {len(key_bytes)} bytes, more than {PayloadSchema.KEY_LENGTH}')
+        return key_bytes.rjust(PayloadSchema.KEY_LENGTH, b'\x00')
+
+
+    def convert_debug_data(debug_data: Union[str, int, datetime]) -> Tuple[str, Union[bytes, int]]:
+        if type(debug_data) == str:
+            debug_bytes = bytes.fromhex(debug_data)
+            if len(debug_bytes) > PayloadSchema.DEBUG_STR_LENGTH:
+                raise ValueError(
+                    f'the debug data has {len(debug_bytes)} bytes, more than {PayloadSchema.DEBUG_STR_LENGTH}'
+                )
+            return f'{PayloadSchema.DEBUG_STR_LENGTH}s', debug_bytes.rjust(PayloadSchema.DEBUG_STR_LENGTH, b'\x00')
+        if type(debug_data) == int:
+            return 'I', debug_data
+        if type(debug_data) == datetime:
+            return 'I', PayloadSchema.convert_time(debug_data)
+        raise TypeError(f'unsupported debug data type {type(debug_data).__name__}')
+
+
+    def get_length(self, *values) -> int:
+        """Gets the payload length for the given field values, which only depends on them for DEBUG
+        payloads.
+        """
+        layout = self.get_layout_and_values(values)[0] if self.variable else self.layout
+        return layout.size + (self.mac_length if self.signed else 0)
+
+
+    def get_layout_and_values(self, values: tuple) -> Tuple[struct.Struct, Iterable]:
+        if len(values) != len(self.fields):
+            raise TypeError(f'{self.name} takes {len(self.fields)} field values, {len(values)} given')
+        converted = map(operator.call, self.converters, values)
+        if not self.variable:
+            return self.layout, converted
+
+        body_format = ''
+        body_values = []
+        for field, value in zip(self.fields, converted):
+            if field.field_type == FieldTypes.DEBUG:
+                field_format, value = value
+            else:
+                field_format = PayloadSchema.FIELD_FORMATS[field.field_type]
+            body_format += field_format
+            body_values.append(value)
+        return self.get_layout(body_format), body_values
+
+
+    def encode(self, *values, key: Optional[Union[bytes, SecretKey, KeyedSigner]] = None) -> bytes:
+        """Encodes a payload. The header and body are packed at once by the compiled struct and the
+        HMAC is appended to them.
+
+        Args:
+            *values: the field values, in the schema order
+            key (Optional[Union[bytes, SecretKey, KeyedSigner]], optional): the signing key of signed
+            payloads. Defaults to None.
+
+        Raises:
+            OverflowError: if an integer or time field does not fit in 32 unsigned bits
+            ValueError: if a key or hex str field is longer than its field, or a compact time is outside
+            the COMPACT_MINUTES after COMPACT_EPOCH
+            TypeError: if a value has an unsupported type or a signed payload has no key
+
+        Returns:
+            bytes: the payload
+
+        Example:
+            >>> schema = PAYLOAD_SCHEMAS[MessageTypes.ACCESS, OperationTypes.CHECK_IN]
+            >>> schema.encode(1902489364, datetime(2025, 5, 10, 21, 30), key=access_key)
+        """
+        layout, converted = self.get_layout_and_values(values)
+        try:
+            message = layout.pack(self.header, *converted)
+        except struct.error as error:
+            raise OverflowError(f'{self.name} field out of range: {error}') from None
+        if not self.signed:
+            return message
+        if key is None:
+            raise TypeError(f'{self.name} payloads are signed, but no key was given')
+        return message + self.sign(message, key)[:self.mac_length]
+
+
+    def sign(self, message: memoryview, key: Union[bytes, SecretKey, KeyedSigner]) -> bytes:
+        if type(key) == KeyedSigner:
+            return key.sign(message)
+        return Signer.sign(message, key.value if type(key) == SecretKey else key)
+
+
+    def get_compact_schema(self, mac_length: int) -> 'PayloadSchema':
+        """Derives the compact protocol schema of this payload: the fields listed in
+        `COMPACT_FIELD_TYPES` take their tighter types and the HMAC is truncated to `mac_length` bytes.
+        """
+        fields = tuple(
+            PayloadField(field.name, COMPACT_FIELD_TYPES.get(field.name, field.field_type))
+            for field in self.fields
+        )
+        return PayloadSchema(
+            self.name, self.message_type, self.operation, fields, self.signed, ProtocolVersions.COMPACT, mac_length
+        )
+
+
+    def get_schema(
+        message_type: int,
+        operation: int,
+        compact: bool = False,
+        mac_length: int = COMPACT_MAC_LENGTH
+    ) -> 'PayloadSchema':
+        """Gets the schema of a (message type, operation), in the standard or the compact protocol.
+        The compact schemas of each MAC length are derived on first use.
+
+        Args:
+            message_type (int): the message type
+            operation (int): the operation
+            compact (bool, optional): if the schema is of the compact protocol. Defaults to False.
+            mac_length (int, optional): the truncated HMAC length of the compact protocol, in bytes.
+            Defaults to COMPACT_MAC_LENGTH.
+
+        Raises:
+            KeyError: if the message type or operation are unknown
+            ValueError: if the MAC length is not between MIN_MAC_LENGTH and HASH_LENGTH
+
+        Returns:
+            PayloadSchema: the schema
+        """
+        if not compact:
+            return PAYLOAD_SCHEMAS[message_type, operation]
+        schemas = COMPACT_PAYLOAD_SCHEMAS.get(mac_length)
+        if schemas is None:
+            if not MIN_MAC_LENGTH <= mac_length <= HASH_LENGTH:
+                raise ValueError(
+                    f'the MAC length must be between {MIN_MAC_LENGTH} and {HASH_LENGTH} bytes, not {mac_length}'
+                )
+            schemas = COMPACT_PAYLOAD_SCHEMAS[mac_length] = {
+                key: schema.get_compact_schema(mac_length) for key, schema in PAYLOAD_SCHEMAS.items()
+            }
+        return schemas[message_type, operation]
+
+
+# schema of each (message type, operation)
+PAYLOAD_SCHEMAS: Dict[Tuple[int, int], PayloadSchema] = {
+    (schema.message_type, schema.operation): schema
+    for schema in (
+        PayloadSchema(
+            'CHECK_IN', MessageTypes.ACCESS, OperationTypes.CHECK_IN,
+            (
+                PayloadField('user_id', FieldTypes.UINT32),
+                PayloadField('generated_at', FieldTypes.TIME),
+            ),
+            signed=True
+        ),
+        PayloadSchema(
+            'CHECK_OUT', MessageTypes.ACCESS, OperationTypes.CHECK_OUT,
+            (
+                PayloadField('user_id', FieldTypes.UINT32),
+                PayloadField('generated_at', FieldTypes.TIME),
+            ),
+            signed=True
+        ),
+        PayloadSchema(
+            'BI_ACCESS', MessageTypes.ACCESS, OperationTypes.BI_ACCESS,
+            (
+                PayloadField('user_id', FieldTypes.UINT32),
+                PayloadField('generated_at', FieldTypes.TIME),
+            ),
+            signed=True
+        ),
+        PayloadSchema(
+            'SET_TIME', MessageTypes.SYNC, OperationTypes.SET_TIME,
+            (
+                PayloadField('sync_time', FieldTypes.TIME),
+            ),
+            signed=True
+        ),
+        PayloadSchema(
+            'SET_MASTER_KEY', MessageTypes.CONFIG, OperationTypes.SET_MASTER_KEY,
+            (
+                PayloadField('new_key', FieldTypes.KEY),
+            ),
+            signed=True
+        ),
+        PayloadSchema(
+            'SET_CONFIG_KEY', MessageTypes.CONFIG, OperationTypes.SET_CONFIG_KEY,
+            (
+                PayloadField('new_key', FieldTypes.KEY),
+            ),
+            signed=True
+        ),
+        PayloadSchema(
+            'SET_SYNC_KEY', MessageTypes.CONFIG, OperationTypes.SET_SYNC_KEY,
+            (
+                PayloadField('new_key', FieldTypes.KEY),
+            ),
+            signed=True
+        ),
+        PayloadSchema(
+            'SET_ACCESS_KEY', MessageTypes.CONFIG, OperationTypes.SET_ACCESS_KEY,
+            (
+                PayloadField('new_key', FieldTypes.KEY),
+            ),
+            signed=True
+        ),
+        PayloadSchema(
+            'BLINK_N_TIMES', MessageTypes.DEBUG, OperationTypes.BLINK_N_TIMES,
+            (
+                PayloadField('debug_data', FieldTypes.DEBUG),
+            ),
+            signed=False
+        ),
+        PayloadSchema(
+            'BLINK_IF_SYNC', MessageTypes.DEBUG, OperationTypes.BLINK_IF_SYNC,
+            (
+                PayloadField('debug_data', FieldTypes.DEBUG),
+            ),
+            signed=False
+        ),
+    )
+}
+
+# tighter field types of the compact protocol, by field name: the ACCESS codes are valid for minutes,
+# so their generation time only needs minute resolution, while the clock sync times keep the seconds
+COMPACT_FIELD_TYPES = {
+    'generated_at': FieldTypes.MINUTES,
+}
+
+# compact schemas of each (message type, operation), by MAC length
+COMPACT_PAYLOAD_SCHEMAS: Dict[int, Dict[Tuple[int, int], PayloadSchema]] = {}
@@ -2,30 +2,185 @@ from datetime import datetime
 from qr_code.encoder import *
 from auth.signer import Signer
 from auth.secret_key import SecretKey
-import segno    
+from qr_code.render_options import ARCHIVAL_COMPRESS_LEVEL
+import io
+import os
+import base64
+
+# segno and numpy take most of the import time, so the rendering modules are only imported when a
+# QR Code is built, and the payload-only callers, such as the `encode` command, never load them
+if TYPE_CHECKING:
+    import segno
+    from qr_code.render_cache import RenderCache
 
 class QRCode:
-    def __init__(self, payload: str):
+    __slots__ = ('payload', '_qrcode')
+    cache: Optional['RenderCache'] = None # shared by all the QR Codes, see `set_cache`
+    
+    
+    def set_cache(cache: Optional['RenderCache']):
+        """Sets the cache of the matrices and images of all the QR Codes, keyed by payload and render
+        options, so a code that was already built or rendered is not computed again. None, the default,
+        disables it.
+
+        Args:
+            cache (Optional[RenderCache]): the cache
+        """
+        QRCode.cache = cache
+    
+    
+    def __init__(self, payload: bytes):
         self.payload = payload
-        self.qrcode = None
-        self.make_qrcode()
+        self._qrcode = None
+    
+    
+    @property
+    def qrcode(self) -> 'segno.QRCode':
+        """The segno QR Code, generated from the payload on first access.
+        """
+        if self._qrcode is None:
+            self.make_qrcode()
+        return self._qrcode
     
     
     def make_qrcode(self):
-        """Generates the QR Code from the given payload
+        """Generates the QR Code from the given payload, through the precomputed template of its
+        length when there is one
         """
-        self.qrcode = segno.make_qr(self.payload)
+        from qr_code.matrix_builder import MatrixBuilders
+        if QRCode.cache is None:
+            self._qrcode = MatrixBuilders.make_qr(self.payload)
+        else:
+            self._qrcode = QRCode.cache.get_or_create(('matrix', bytes(self.payload)), MatrixBuilders.make_qr, self.payload)
         
     
-    def save_qrcode(self, path: str, scale: int = 25, border: int = 5):
-        """Saves the QR Code on the given path.
+    def save_qrcode(
+        self,
+        path: Union[str, os.PathLike],
+        scale: int = 25,
+        border: int = 5,
+        compress_level: int = ARCHIVAL_COMPRESS_LEVEL
+    ):
+        """Saves the QR Code on the given path. Other targets, such as streams, are passed to segno
+        as they are.
 
         Args:
-            path (str): the path to save the QR Code.
+            path (Union[str, os.PathLike]): the path to save the QR Code.
             scale (int, optional): the scale of the QR Code. Defaults to 5.
             border (int, optional): the border size of the QR Code. Defaults to 0
+            compress_level (int, optional): the zlib level of PNGs. Defaults to ARCHIVAL_COMPRESS_LEVEL.
+        """
+        file_name = os.fspath(path) if isinstance(path, (str, os.PathLike)) else None
+        extension = file_name.rsplit('.', 1)[-1].lower() if type(file_name) == str else None
+        if QRCode.cache is not None and extension in ('png', 'svg'):
+            with open(file_name, 'wb') as file:
+                file.write(self.get_qrcode_bytes(extension, scale, border, compress_level))
+        elif extension == 'png':
+            from qr_code.png_writer import PngWriter
+            PngWriter.write_png(self.qrcode, file_name, scale, border, compress_level)
+        else:
+            self.qrcode.save(path, scale=scale, border=border)
+    
+    
+    def write_qrcode(
+        self,
+        stream: BinaryIO,
+        kind: Literal['png', 'svg'] = 'png',
+        scale: int = 25,
+        border: int = 5,
+        compress_level: int = ARCHIVAL_COMPRESS_LEVEL
+    ):
+        """Writes the QR Code image on the given writable stream, such as a socket file or an HTTP
+        response, with no files on disk.
+
+        Args:
+            stream (BinaryIO): the writable stream
+            kind (Literal['png', 'svg'], optional): the image format. Defaults to 'png'.
+            scale (int, optional): the scale of the QR Code. Defaults to 25.
+            border (int, optional): the border size of the QR Code. Defaults to 5.
+            compress_level (int, optional): the zlib level of PNGs. Defaults to ARCHIVAL_COMPRESS_LEVEL.
+        """
+        if QRCode.cache is None:
+            from qr_code.png_writer import PngWriter
+            PngWriter.write_image(self.qrcode, stream, kind, scale, border, compress_level)
+        else:
+            stream.write(self.get_qrcode_bytes(kind, scale, border, compress_level))
+    
+    
+    def get_qrcode_bytes(
+        self,
+        kind: Literal['png', 'svg'] = 'png',
+        scale: int = 25,
+        border: int = 5,
+        compress_level: int = ARCHIVAL_COMPRESS_LEVEL
+    ) -> bytes:
+        """Renders the QR Code image in memory.
+
+        Args:
+            kind (Literal['png', 'svg'], optional): the image format. Defaults to 'png'.
+            scale (int, optional): the scale of the QR Code. Defaults to 25.
+            border (int, optional): the border size of the QR Code. Defaults to 5.
+            compress_level (int, optional): the zlib level of PNGs. Defaults to ARCHIVAL_COMPRESS_LEVEL.
+
+        Returns:
+            bytes: the encoded image
+        """
+        if QRCode.cache is None:
+            return self.render_qrcode_bytes(kind, scale, border, compress_level)
+        key = ('image', bytes(self.payload), kind, scale, border, compress_level)
+        return QRCode.cache.get_or_create(key, self.render_qrcode_bytes, kind, scale, border, compress_level)
+    
+    
+    def render_qrcode_bytes(self, kind: str, scale: int, border: int, compress_level: int) -> bytes:
+        from qr_code.png_writer import PngWriter
+        buffer = io.BytesIO()
+        PngWriter.write_image(self.qrcode, buffer, kind, scale, border, compress_level)
+        return buffer.getvalue()
+    
+    
+    def iter_qrcode_chunks(
+        self,
+        kind: Literal['png', 'svg'] = 'png',
+        scale: int = 25,
+        border: int = 5,
+        chunk_size: int = 16384,
+        compress_level: int = ARCHIVAL_COMPRESS_LEVEL
+    ) -> Iterator[memoryview]:
+        """Renders the QR Code image in memory and yields it in chunks, as views of the rendered
+        buffer, for chunked HTTP responses.
+
+        Args:
+            kind (Literal['png', 'svg'], optional): the image format. Defaults to 'png'.
+            scale (int, optional): the scale of the QR Code. Defaults to 25.
+            border (int, optional): the border size of the QR Code. Defaults to 5.
+            chunk_size (int, optional): the maximum size of each chunk, in bytes. Defaults to 16384.
+            compress_level (int, optional): the zlib level of PNGs, such as INTERACTIVE_COMPRESS_LEVEL for
+            images sent once. Defaults to ARCHIVAL_COMPRESS_LEVEL.
+
+        Yields:
+            memoryview: the chunks of the encoded image
+        """
+        buffer = io.BytesIO()
+        self.write_qrcode(buffer, kind=kind, scale=scale, border=border, compress_level=compress_level)
+        image = buffer.getbuffer()
+        for offset in range(0, len(image), chunk_size):
+            yield image[offset:offset + chunk_size]
+    
+    
+    def get_qrcode_data_uri(self, kind: Literal['png', 'svg'] = 'png', scale: int = 25, border: int = 5) -> str:
+        """Renders the QR Code image as a base64 data URI, ready for an <img> src attribute.
+
+        Args:
+            kind (Literal['png', 'svg'], optional): the image format. Defaults to 'png'.
+            scale (int, optional): the scale of the QR Code. Defaults to 25.
+            border (int, optional): the border size of the QR Code. Defaults to 5.
+
+        Returns:
+            str: the data URI
         """
-        self.qrcode.save(path, scale=scale, border=border)
+        mime_type = 'image/svg+xml' if kind == 'svg' else 'image/png'
+        image = self.get_qrcode_bytes(kind=kind, scale=scale, border=border)
+        return f'data:{mime_type};base64,{base64.b64encode(image).decode("ascii")}'
     
     
     def __str__(self):
@@ -40,18 +195,20 @@ class QRCode:
         
 
 class QRCODE_CHECK_IN(QRCode):
+    __slots__ = ('user_id', 'generated_at', 'access_key')
+    
+    
     def __init__(self, user_id: int, generated_at: datetime, access_key: Union[SecretKey, bytes]):
-        self.payload = PayloadEncoder.get_check_in_payload(
-            user_id=user_id,
-            generated_at=generated_at,
-            access_key=access_key
+        super().__init__(
+            payload=PayloadEncoder.get_check_in_payload(
+                user_id=user_id,
+                generated_at=generated_at,
+                access_key=access_key
+            )
         )
         self.user_id = user_id
         self.generated_at = generated_at
         self.access_key = access_key
-        self.qrcode = None
-        self.make_qrcode()
-        pass
     
     
     def __str__(self):
@@ -65,18 +222,20 @@ class QRCODE_CHECK_IN(QRCode):
 
 
 class QRCODE_CHECK_OUT(QRCode):
+    __slots__ = ('user_id', 'generated_at', 'access_key')
+    
+    
     def __init__(self, user_id: int, generated_at: datetime, access_key: Union[SecretKey, bytes]):
-        self.payload = PayloadEncoder.get_check_out_payload(
-            user_id=user_id,
-            generated_at=generated_at,
-            access_key=access_key
+        super().__init__(
+            payload=PayloadEncoder.get_check_out_payload(
+                user_id=user_id,
+                generated_at=generated_at,
+                access_key=access_key
+            )
         )
         self.user_id = user_id
         self.generated_at = generated_at
         self.access_key = access_key
-        self.qrcode = None
-        self.make_qrcode()
-        pass
     
     
     def __str__(self):
@@ -90,18 +249,20 @@ class QRCODE_CHECK_OUT(QRCode):
 
     
 class QRCODE_BI_ACCESS(QRCode):
+    __slots__ = ('user_id', 'generated_at', 'access_key')
+    
+    
     def __init__(self, user_id: int, generated_at: datetime, access_key: Union[SecretKey, bytes]):
-        self.payload = PayloadEncoder.get_bi_access_payload(
-            user_id=user_id,
-            generated_at=generated_at,
-            access_key=access_key
+        super().__init__(
+            payload=PayloadEncoder.get_bi_access_payload(
+                user_id=user_id,
+                generated_at=generated_at,
+                access_key=access_key
+            )
         )
         self.user_id = user_id
         self.generated_at = generated_at
         self.access_key = access_key
-        self.qrcode = None
-        self.make_qrcode()
-        pass
     
     def __str__(self):
         print_str = f'QR Code Info\n'
@@ -114,16 +275,18 @@ class QRCODE_BI_ACCESS(QRCode):
 
     
 class QRCODE_SET_TIME(QRCode):
+    __slots__ = ('sync_time', 'sync_key')
+    
+    
     def __init__(self, current_time: datetime, sync_key: Union[SecretKey, bytes]):
-        self.payload = PayloadEncoder.get_set_time_payload(
-            sync_time=current_time,
-            sync_key=sync_key
+        super().__init__(
+            payload=PayloadEncoder.get_set_time_payload(
+                sync_time=current_time,
+                sync_key=sync_key
+            )
         )
         self.sync_time = current_time
         self.sync_key = sync_key
-        self.qrcode = None
-        self.make_qrcode()
-        pass
     
     def __str__(self):
         print_str = f'QR Code Info\n'
@@ -135,16 +298,18 @@ class QRCODE_SET_TIME(QRCode):
 
     
 class QRCODE_SET_MASTER_KEY(QRCode):
+    __slots__ = ('new_master_key', 'old_master_key')
+    
+    
     def __init__(self, new_master_key: Union[SecretKey, bytes], master_key: Union[SecretKey, bytes]):
-        self.payload = PayloadEncoder.get_set_master_key_payload(
-            new_master_key=new_master_key,
-            old_master_key=master_key
+        super().__init__(
+            payload=PayloadEncoder.get_set_master_key_payload(
+                new_master_key=new_master_key,
+                old_master_key=master_key
+            )
         )
         self.new_master_key = new_master_key
         self.old_master_key = master_key
-        self.qrcode = None
-        self.make_qrcode()
-        pass
     
     def __str__(self):
         print_str = f'QR Code Info\n'
@@ -156,16 +321,18 @@ class QRCODE_SET_MASTER_KEY(QRCode):
 
     
 class QRCODE_SET_CONFIG_KEY(QRCode):
+    __slots__ = ('new_config_key', 'master_key')
+    
+    
     def __init__(self, new_config_key: Union[SecretKey, bytes], master_key: Union[SecretKey, bytes]):
-        self.payload = PayloadEncoder.get_set_config_key_payload(
-            new_config_key=new_config_key,
-            master_key=master_key
+        super().__init__(
+            payload=PayloadEncoder.get_set_config_key_payload(
+                new_config_key=new_config_key,
+                master_key=master_key
+            )
         )
         self.new_config_key = new_config_key
         self.master_key = master_key
-        self.qrcode = None
-        self.make_qrcode()
-        pass
     
     def __str__(self):
         print_str = f'QR Code Info\n'
@@ -177,16 +344,18 @@ class QRCODE_SET_CONFIG_KEY(QRCode):
 
     
 class QRCODE_SET_SYNC_KEY(QRCode):
+    __slots__ = ('new_sync_key', 'config_key')
+    
+    
     def __init__(self, new_sync_key: Union[SecretKey, bytes], config_key: Union[SecretKey, bytes]):
-        self.payload = PayloadEncoder.get_set_sync_key_payload(
-            new_sync_key=new_sync_key,
-            config_key=config_key
+        super().__init__(
+            payload=PayloadEncoder.get_set_sync_key_payload(
+                new_sync_key=new_sync_key,
+                config_key=config_key
+            )
         )
         self.new_sync_key = new_sync_key
         self.config_key = config_key
-        self.qrcode = None
-        self.make_qrcode()
-        pass
     
     def __str__(self):
         print_str = f'QR Code Info\n'
@@ -198,16 +367,18 @@ class QRCODE_SET_SYNC_KEY(QRCode):
 
     
 class QRCODE_SET_ACCESS_KEY(QRCode):
+    __slots__ = ('new_access_key', 'config_key')
+    
+    
     def __init__(self, new_access_key: Union[SecretKey, bytes], config_key: Union[SecretKey, bytes]):
-        self.payload = PayloadEncoder.get_set_access_key_payload(
-            new_access_key=new_access_key,
-            config_key=config_key
+        super().__init__(
+            payload=PayloadEncoder.get_set_access_key_payload(
+                new_access_key=new_access_key,
+                config_key=config_key
+            )
         )
         self.new_access_key = new_access_key
         self.config_key = config_key
-        self.qrcode = None
-        self.make_qrcode()
-        pass
     
     def __str__(self):
         print_str = f'QR Code Info\n'
@@ -219,14 +390,16 @@ class QRCODE_SET_ACCESS_KEY(QRCode):
 
     
 class QRCODE_BLINK_N_TIMES(QRCode):
+    __slots__ = ('blink_num',)
+    
+    
     def __init__(self, blink_num: int):
-        self.payload = PayloadEncoder.get_blink_n_times_payload(
-            blink_num=blink_num
+        super().__init__(
+            payload=PayloadEncoder.get_blink_n_times_payload(
+                blink_num=blink_num
+            )
         )
         self.blink_num = blink_num
-        self.qrcode = None
-        self.make_qrcode()
-        pass
     
     def __str__(self):
         print_str = f'QR Code Info\n'
@@ -237,14 +410,16 @@ class QRCODE_BLINK_N_TIMES(QRCode):
 
     
 class QRCODE_BLINK_IF_SYNC(QRCode):
+    __slots__ = ('current_time',)
+    
+    
     def __init__(self, current_time: datetime):
-        self.payload = PayloadEncoder.get_debug_sync_payload(
-            current_time=current_time
+        super().__init__(
+            payload=PayloadEncoder.get_debug_sync_payload(
+                current_time=current_time
+            )
         )
         self.current_time = current_time
-        self.qrcode = None
-        self.make_qrcode()
-        pass
     
     def __str__(self):
         print_str = f'QR Code Info\n'
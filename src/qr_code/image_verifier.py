@@ -0,0 +1,499 @@
+import os
+import zlib
+import struct
+import numpy as np
+from typing import *
+from segno import consts, encoder
+from qr_code.matrix_builder import TemplateMatrixBuilder
+from qr_code.png_writer import PNG_SIGNATURE, FILTER_NONE, FILTER_UP
+
+ERROR_LEVELS = (consts.ERROR_LEVEL_L, consts.ERROR_LEVEL_M, consts.ERROR_LEVEL_Q, consts.ERROR_LEVEL_H)
+MASK_PATTERNS = 8
+MAX_FORMAT_ERRORS = 3 # the format information BCH code corrects up to 3 wrong bits
+
+GALOIS_EXP = np.array(consts.GALIOS_EXP[:255], dtype=np.uint8)
+GALOIS_LOG = np.array(consts.GALIOS_LOG, dtype=np.intp)
+
+
+class ImageVerification(NamedTuple):
+    valid: bool
+    payload: Optional[bytes] = None
+    corrected_codewords: int = 0
+    error: Optional[str] = None
+
+
+class CodeLayout:
+    def __init__(self, version: int):
+        """Module layout of a QR Code version: the data module placement order, the data masks in
+        that order and the format information candidates, derived once so reading a symbol is a few
+        array lookups. The function patterns come from segno, but the placement order is walked here
+        independently of the matrix builders, so the verifier does not share their mistakes.
+
+        Args:
+            version (int): the QR Code version
+        """
+        self.version = version
+        self.width = encoder.calc_matrix_size(version)
+        matrix = encoder.make_matrix(self.width, self.width)
+        encoder.add_finder_patterns(matrix, self.width, self.width)
+        encoder.add_alignment_patterns(matrix, self.width, self.width)
+        encoding_region = np.array(matrix, dtype=np.uint8) == 0x2
+
+        positions = []
+        for right in range(self.width - 1, 0, -2):
+            if right <= 6: # the column pair left of the vertical timing pattern is shifted by one
+                right -= 1
+            upwards = ((self.width - 1 - right) // 2) % 2 == 0
+            rows = range(self.width - 1, -1, -1) if upwards else range(self.width)
+            for row in rows:
+                for column in (right, right - 1):
+                    if encoding_region[row, column]:
+                        positions.append(row * self.width + column)
+        self.positions = np.array(positions, dtype=np.intp)
+
+        rows, columns = np.indices((self.width, self.width))
+        self.mask_bits = np.array([
+            np.vectorize(mask_function)(rows, columns).ravel()[self.positions]
+            for mask_function in encoder.get_data_mask_functions(False)
+        ], dtype=np.uint8)
+
+        # format information modules of each (error level, mask), with the same positions for all
+        self.format_candidates = [(error, mask) for error in ERROR_LEVELS for mask in range(MASK_PATTERNS)]
+        format_infos = [
+            TemplateMatrixBuilder.get_written_modules(self.width, encoder.add_format_info, version, error, mask)
+            for error, mask in self.format_candidates
+        ]
+        self.format_positions = format_infos[0][0]
+        self.format_values = np.array([values for _, values in format_infos], dtype=np.uint8)
+        self.block_layouts: Dict[int, Tuple[np.ndarray, List[Tuple[int, int]]]] = {}
+
+
+    def get_block_layout(self, error: int) -> Tuple[np.ndarray, List[Tuple[int, int]]]:
+        """Gets how the codewords of an error level are split in Reed-Solomon blocks.
+
+        Args:
+            error (int): the error level
+
+        Returns:
+            Tuple[np.ndarray, List[Tuple[int, int]]]: the permutation that takes the interleaved
+            codewords to the blocks, one after the other, and the (data, error) lengths of each block
+        """
+        block_layout = self.block_layouts.get(error)
+        if block_layout is not None:
+            return block_layout
+
+        blocks = []
+        for ec_info in consts.ECC[self.version][error]:
+            blocks.extend([(ec_info.num_data, ec_info.num_total - ec_info.num_data)] * ec_info.num_blocks)
+        data_positions = [[] for _ in blocks]
+        error_positions = [[] for _ in blocks]
+        position = 0
+        for index in range(max(data_length for data_length, _ in blocks)):
+            for block, (data_length, _) in enumerate(blocks):
+                if index < data_length:
+                    data_positions[block].append(position)
+                    position += 1
+        for index in range(blocks[0][1]):
+            for block in range(len(blocks)):
+                error_positions[block].append(position)
+                position += 1
+        order = np.array([p for block in range(len(blocks)) for p in data_positions[block] + error_positions[block]], dtype=np.intp)
+        block_layout = self.block_layouts[error] = (order, blocks)
+        return block_layout
+
+
+class ReedSolomonDecoder:
+    def get_syndromes(block: np.ndarray, error_length: int) -> np.ndarray:
+        """Evaluates the received block at the roots of the generator polynomial, alpha**0 to
+        alpha**(error_length - 1). All of them are zero when the block has no errors.
+
+        Args:
+            block (np.ndarray): the data and error correction codewords
+            error_length (int): the number of error correction codewords
+
+        Returns:
+            np.ndarray: the syndromes
+        """
+        degrees = np.arange(len(block) - 1, -1, -1)
+        present = block != 0
+        exponents = (GALOIS_LOG[block[present]] + np.outer(np.arange(error_length), degrees[present])) % 255
+        return np.bitwise_xor.reduce(GALOIS_EXP[exponents], axis=1) if present.any() else np.zeros(error_length, dtype=np.uint8)
+
+
+    def multiply(a: int, b: int) -> int:
+        if a == 0 or b == 0:
+            return 0
+        return consts.GALIOS_EXP[consts.GALIOS_LOG[a] + consts.GALIOS_LOG[b]]
+
+
+    def divide(a: int, b: int) -> int:
+        if a == 0:
+            return 0
+        return consts.GALIOS_EXP[(consts.GALIOS_LOG[a] - consts.GALIOS_LOG[b]) % 255]
+
+
+    def evaluate(polynomial: List[int], x: int) -> int:
+        """Evaluates a polynomial, with the coefficients from the lowest degree, by Horner's rule.
+        """
+        value = 0
+        for coefficient in reversed(polynomial):
+            value = ReedSolomonDecoder.multiply(value, x) ^ coefficient
+        return value
+
+
+    def correct(block: np.ndarray, syndromes: np.ndarray) -> Tuple[bytes, int]:
+        """Corrects the errors of a block, up to half its error correction codewords: Berlekamp-Massey
+        finds the error locator polynomial, Chien search its roots and Forney the error values.
+
+        Args:
+            block (np.ndarray): the data and error correction codewords
+            syndromes (np.ndarray): the nonzero syndromes of the block
+
+        Raises:
+            ValueError: if the block has more errors than can be corrected
+
+        Returns:
+            Tuple[bytes, int]: the corrected block and the number of corrected codewords
+        """
+        multiply, divide = ReedSolomonDecoder.multiply, ReedSolomonDecoder.divide
+        syndromes = [int(syndrome) for syndrome in syndromes]
+        locator, previous = [1], [1]
+        errors, shift, previous_discrepancy = 0, 1, 1
+        for step, syndrome in enumerate(syndromes):
+            discrepancy = syndrome
+            for index in range(1, min(errors + 1, len(locator))):
+                discrepancy ^= multiply(locator[index], syndromes[step - index])
+            if discrepancy == 0:
+                shift += 1
+                continue
+            coefficient = divide(discrepancy, previous_discrepancy)
+            updated = locator + [0] * max(0, len(previous) + shift - len(locator))
+            for index, term in enumerate(previous):
+                updated[index + shift] ^= multiply(coefficient, term)
+            if 2 * errors <= step:
+                previous, errors, previous_discrepancy, shift = locator, step + 1 - errors, discrepancy, 1
+            else:
+                shift += 1
+            locator = updated
+        locator = (locator + [0] * errors)[:errors + 1]
+        if 2 * errors > len(syndromes):
+            raise ValueError(f'too many errors in a block of {len(block)} codewords')
+
+        # error positions, as the degrees whose inverse locator is a root
+        length = len(block)
+        degrees = [
+            degree for degree in range(length)
+            if ReedSolomonDecoder.evaluate(locator, consts.GALIOS_EXP[(255 - degree) % 255]) == 0
+        ]
+        if len(degrees) != errors:
+            raise ValueError(f'uncorrectable errors in a block of {len(block)} codewords')
+
+        evaluator = [0] * len(syndromes)
+        for i, syndrome in enumerate(syndromes):
+            for j, term in enumerate(locator[:len(syndromes) - i]):
+                evaluator[i + j] ^= multiply(syndrome, term)
+        derivative = [locator[index] if index % 2 == 1 else 0 for index in range(1, len(locator))]
+
+        corrected = bytearray(block.tobytes())
+        for degree in degrees:
+            location = consts.GALIOS_EXP[degree]
+            inverse = consts.GALIOS_EXP[(255 - degree) % 255]
+            value = multiply(location, divide(ReedSolomonDecoder.evaluate(evaluator, inverse), ReedSolomonDecoder.evaluate(derivative, inverse)))
+            corrected[length - 1 - degree] ^= value
+        if ReedSolomonDecoder.get_syndromes(np.frombuffer(corrected, dtype=np.uint8), len(syndromes)).any():
+            raise ValueError(f'uncorrectable errors in a block of {len(block)} codewords')
+        return bytes(corrected), errors
+
+
+class ImageVerifier:
+    layouts: Dict[int, CodeLayout] = {}
+
+
+    def get_layout(version: int) -> CodeLayout:
+        layout = ImageVerifier.layouts.get(version)
+        if layout is None:
+            layout = ImageVerifier.layouts[version] = CodeLayout(version)
+        return layout
+
+
+    def read_lines(image: Union[bytes, str, os.PathLike]) -> Tuple[np.ndarray, int]:
+        """Reads a grayscale PNG, such as the ones written by segno and `PngWriter`, into lines of
+        packed 1-bit pixels, set where light, which are only unpacked where the grid is sampled. The
+        'None' and 'Up' filters, the only ones they use, are undone for all the lines at once; the
+        other filters fall back to a line by line loop.
+
+        Args:
+            image (Union[bytes, str, os.PathLike]): the PNG image or its path
+
+        Raises:
+            ValueError: if the image is not a non-interlaced 1 or 8 bits grayscale PNG
+
+        Returns:
+            Tuple[np.ndarray, int]: the packed lines, with light padding bits, and the image width
+        """
+        if isinstance(image, (str, os.PathLike)):
+            with open(os.fspath(image), 'rb') as file:
+                image = file.read()
+        if not image.startswith(PNG_SIGNATURE):
+            raise ValueError('not a PNG image')
+
+        view = memoryview(image)
+        offset = len(PNG_SIGNATURE)
+        header, idat = None, []
+        while offset + 8 <= len(view):
+            length, name = struct.unpack_from('>I4s', view, offset)
+            if offset + 12 + length > len(view):
+                raise ValueError(f'truncated PNG {name!r} chunk')
+            data = view[offset + 8:offset + 8 + length]
+            if name == b'IHDR':
+                if length != 13:
+                    raise ValueError(f'the PNG IHDR chunk has {length} bytes, not 13')
+                header = struct.unpack('>2I5B', data)
+            elif name == b'IDAT':
+                idat.append(data)
+            elif name == b'IEND':
+                break
+            offset += 12 + length
+        if header is None or not idat:
+            raise ValueError('the PNG image has no IHDR or IDAT chunk')
+        width, height, bit_depth, color_type, _, _, interlace = header
+        if color_type != 0 or bit_depth not in (1, 8) or interlace != 0:
+            raise ValueError(f'unsupported PNG: color type {color_type}, bit depth {bit_depth}, interlace {interlace}')
+
+        line_length = (width * bit_depth + 7) // 8
+        lines = np.frombuffer(zlib.decompress(b''.join(idat)), dtype=np.uint8)
+        if len(lines) < height * (line_length + 1):
+            raise ValueError('truncated PNG image data')
+        lines = lines[:height * (line_length + 1)].reshape(height, line_length + 1)
+        filters, lines = lines[:, 0], lines[:, 1:]
+
+        copies = (filters == FILTER_UP) & ~lines.any(axis=1)
+        if (copies | (filters == FILTER_NONE)).all():
+            # the zero 'Up' lines repeat the line above, as in the scaled modules rows
+            rows = lines[np.maximum.accumulate(np.where(copies, 0, np.arange(height)))]
+        elif np.isin(filters, (FILTER_NONE, FILTER_UP)).all():
+            # each 'Up' line adds the line above: a running sum, restarted at every 'None' line
+            sums = np.cumsum(lines, axis=0, dtype=np.uint8)
+            starts = np.maximum.accumulate(np.where(filters == FILTER_NONE, np.arange(height), 0))
+            rows = np.where((starts > 0)[:, None], sums - sums[np.maximum(starts - 1, 0)], sums)
+        else:
+            rows = ImageVerifier.unfilter(filters, lines, max(1, bit_depth // 8))
+
+        if bit_depth == 8:
+            rows = np.packbits(rows >= 128, axis=1)
+            line_length = rows.shape[1]
+        padding_bits = 8 * line_length - width
+        if padding_bits:
+            rows = rows.copy() if not rows.flags.writeable else rows
+            rows[:, -1] |= (1 << padding_bits) - 1
+        return rows, width
+
+
+    def unfilter(filters: np.ndarray, lines: np.ndarray, pixel_bytes: int) -> np.ndarray:
+        rows = np.zeros_like(lines)
+        previous = np.zeros(lines.shape[1], dtype=np.int32)
+        for index, (filter_type, line) in enumerate(zip(filters, lines)):
+            row = line.astype(np.int32)
+            if filter_type == FILTER_UP:
+                row = (row + previous) & 0xff
+            elif filter_type != FILTER_NONE:
+                for position in range(len(row)):
+                    left = row[position - pixel_bytes] if position >= pixel_bytes else 0
+                    up = previous[position]
+                    up_left = previous[position - pixel_bytes] if position >= pixel_bytes else 0
+                    if filter_type == 1:
+                        predictor = left
+                    elif filter_type == 3:
+                        predictor = (left + up) // 2
+                    elif filter_type == 4:
+                        estimate = left + up - up_left
+                        distances = (abs(estimate - left), abs(estimate - up), abs(estimate - up_left))
+                        predictor = (left, up, up_left)[distances.index(min(distances))]
+                    else:
+                        raise ValueError(f'unknown PNG filter {filter_type}')
+                    row[position] = (row[position] + predictor) & 0xff
+            rows[index] = row
+            previous = row
+        return rows
+
+
+    def get_modules(lines: np.ndarray, width: int) -> np.ndarray:
+        """Samples the module grid of a clean, axis-aligned QR Code: the symbol is the bounding box of
+        the dark pixels, the module size is the width of the top-left finder pattern over 7, and each
+        module is read at its center.
+
+        Args:
+            lines (np.ndarray): the packed lines of pixels, set where light
+            width (int): the image width
+
+        Raises:
+            ValueError: if no QR Code grid is found
+
+        Returns:
+            np.ndarray: the module matrix, 1 where dark
+        """
+        dark_rows = np.flatnonzero((lines != 0xff).any(axis=1))
+        if len(dark_rows) == 0:
+            raise ValueError('the image has no dark pixels')
+        dark_columns = np.flatnonzero(np.unpackbits(np.bitwise_and.reduce(lines, axis=0), count=width) == 0)
+        top, bottom = dark_rows[0], dark_rows[-1] + 1
+        left, right = dark_columns[0], dark_columns[-1] + 1
+        size = bottom - top
+        if right - left != size:
+            raise ValueError(f'the symbol is not square: {right - left} x {size} pixels')
+
+        light = np.flatnonzero(np.unpackbits(lines[top], count=width)[left:right])
+        finder_width = light[0] if len(light) else size
+        scale, remainder = divmod(finder_width, 7)
+        modules = size // scale if scale else 0
+        if scale == 0 or remainder or size % scale or modules < 21 or (modules - 17) % 4:
+            raise ValueError(f'no QR Code module grid in a symbol of {size} pixels')
+
+        centers = scale * np.arange(modules) + scale // 2
+        return 1 - np.unpackbits(lines[top + centers], axis=1, count=width)[:, left + centers]
+
+
+    def decode_modules(modules: np.ndarray) -> Tuple[bytes, int]:
+        """Decodes a module matrix: reads the format information, unmasks the data modules, corrects
+        the codewords of each Reed-Solomon block and parses the data segments.
+
+        Args:
+            modules (np.ndarray): the module matrix, 1 where dark
+
+        Raises:
+            ValueError: if the symbol cannot be decoded
+
+        Returns:
+            Tuple[bytes, int]: the payload and the number of corrected codewords
+        """
+        version = (len(modules) - 17) // 4
+        layout = ImageVerifier.get_layout(version)
+        flat_modules = modules.ravel()
+
+        format_errors = (layout.format_values != flat_modules[layout.format_positions]).sum(axis=1)
+        candidate = int(np.argmin(format_errors))
+        if format_errors[candidate] > MAX_FORMAT_ERRORS:
+            raise ValueError('unreadable format information')
+        error, mask = layout.format_candidates[candidate]
+
+        order, blocks = layout.get_block_layout(error)
+        bits = flat_modules[layout.positions] ^ layout.mask_bits[mask]
+        codewords = np.packbits(bits[:8 * len(order)])[order]
+
+        data = bytearray()
+        corrected_codewords = 0
+        offset = 0
+        for data_length, error_length in blocks:
+            block = codewords[offset:offset + data_length + error_length]
+            offset += data_length + error_length
+            syndromes = ReedSolomonDecoder.get_syndromes(block, error_length)
+            if syndromes.any():
+                block, corrections = ReedSolomonDecoder.correct(block, syndromes)
+                corrected_codewords += corrections
+                data += block[:data_length]
+            else:
+                data += block[:data_length].tobytes()
+        return ImageVerifier.parse_segments(bytes(data), version), corrected_codewords
+
+
+    def parse_segments(data: bytes, version: int) -> bytes:
+        """Parses the numeric, alphanumeric and byte mode segments of the data codewords, the modes
+        segno picks for byte payloads.
+
+        Args:
+            data (bytes): the data codewords
+            version (int): the QR Code version
+
+        Raises:
+            ValueError: if a segment has another mode or overruns the data
+
+        Returns:
+            bytes: the payload
+        """
+        bits = int.from_bytes(data, byteorder='big')
+        remaining = 8 * len(data)
+
+        def read(length: int) -> int:
+            nonlocal remaining
+            if length > remaining:
+                raise ValueError('a segment overruns the data codewords')
+            remaining -= length
+            return (bits >> remaining) & ((1 << length) - 1)
+
+        version_range = encoder.version_range(version)
+        payload = bytearray()
+        while remaining >= 4:
+            mode = read(4)
+            if mode == 0: # terminator
+                break
+            if mode not in (consts.MODE_NUMERIC, consts.MODE_ALPHANUMERIC, consts.MODE_BYTE):
+                raise ValueError(f'unsupported segment mode {mode}')
+            count = read(consts.CHAR_COUNT_INDICATOR_LENGTH[mode][version_range])
+            if mode == consts.MODE_BYTE:
+                payload += bytes(read(8) for _ in range(count))
+            elif mode == consts.MODE_NUMERIC:
+                for group in range(0, count, 3):
+                    digits = min(3, count - group)
+                    payload += str(read((10, 4, 7)[digits % 3])).zfill(digits).encode('ascii')
+            else:
+                for pair in range(0, count, 2):
+                    if count - pair >= 2:
+                        value = read(11)
+                        payload += (consts.ALPHANUMERIC_CHARS[value // 45:value // 45 + 1] + consts.ALPHANUMERIC_CHARS[value % 45:value % 45 + 1])
+                    else:
+                        value = read(6)
+                        payload += consts.ALPHANUMERIC_CHARS[value:value + 1]
+        return bytes(payload)
+
+
+    def decode(image: Union[bytes, str, os.PathLike]) -> Tuple[bytes, int]:
+        """Decodes the payload of a QR Code PNG.
+
+        Args:
+            image (Union[bytes, str, os.PathLike]): the PNG image or its path
+
+        Raises:
+            ValueError: if the image cannot be read or decoded
+
+        Returns:
+            Tuple[bytes, int]: the payload and the number of codewords corrected by Reed-Solomon
+        """
+        return ImageVerifier.decode_modules(ImageVerifier.get_modules(*ImageVerifier.read_lines(image)))
+
+
+    def verify(image: Union[bytes, str, os.PathLike], payload: bytes) -> ImageVerification:
+        """Checks that a QR Code PNG decodes back to the expected payload. Never raises: unreadable
+        images are reported as invalid, with the error message. A clean render decodes with no
+        corrected codewords; corrections mean the image is damaged, even if the payload still matches.
+
+        Args:
+            image (Union[bytes, str, os.PathLike]): the PNG image or its path
+            payload (bytes): the expected payload
+
+        Returns:
+            ImageVerification: the validity of the image
+        """
+        try:
+            decoded, corrected_codewords = ImageVerifier.decode(image)
+        except (ValueError, OSError, zlib.error) as error:
+            return ImageVerification(valid=False, error=str(error))
+        if decoded != payload:
+            return ImageVerification(False, decoded, corrected_codewords, 'the image decodes to another payload')
+        return ImageVerification(True, decoded, corrected_codewords)
+
+
+    def check(image: Union[bytes, str, os.PathLike], payload: bytes):
+        """Checks that a QR Code PNG is a clean render of the expected payload.
+
+        Args:
+            image (Union[bytes, str, os.PathLike]): the PNG image or its path
+            payload (bytes): the expected payload
+
+        Raises:
+            ValueError: if the image does not decode to the payload or needs error correction
+        """
+        verification = ImageVerifier.verify(image, payload)
+        if not verification.valid:
+            raise ValueError(f'the QR Code image of {payload.hex()} is invalid: {verification.error}')
+        if verification.corrected_codewords:
+            raise ValueError(f'the QR Code image of {payload.hex()} only decodes after correcting {verification.corrected_codewords} codewords')
@@ -0,0 +1,258 @@
+import time
+import functools
+import threading
+from bisect import bisect_left
+from typing import *
+from qr_code.encoder import MessageTypes, OperationTypes, PayloadEncoder, PayloadSchema
+from qr_code.decoder import OPERATION_NAMES
+from qr_code.generator import QRCode
+
+MESSAGE_TYPE_NAMES = {
+    MessageTypes.ACCESS: 'ACCESS',
+    MessageTypes.SYNC: 'SYNC',
+    MessageTypes.CONFIG: 'CONFIG',
+    MessageTypes.DEBUG: 'DEBUG',
+}
+
+PAYLOAD_ENCODER_OPERATIONS = {
+    'get_check_in_payload': (MessageTypes.ACCESS, OperationTypes.CHECK_IN),
+    'get_check_out_payload': (MessageTypes.ACCESS, OperationTypes.CHECK_OUT),
+    'get_bi_access_payload': (MessageTypes.ACCESS, OperationTypes.BI_ACCESS),
+    'get_set_time_payload': (MessageTypes.SYNC, OperationTypes.SET_TIME),
+    'get_set_master_key_payload': (MessageTypes.CONFIG, OperationTypes.SET_MASTER_KEY),
+    'get_set_config_key_payload': (MessageTypes.CONFIG, OperationTypes.SET_CONFIG_KEY),
+    'get_set_sync_key_payload': (MessageTypes.CONFIG, OperationTypes.SET_SYNC_KEY),
+    'get_set_access_key_payload': (MessageTypes.CONFIG, OperationTypes.SET_ACCESS_KEY),
+    'get_blink_n_times_payload': (MessageTypes.DEBUG, OperationTypes.BLINK_N_TIMES),
+    'get_debug_sync_payload': (MessageTypes.DEBUG, OperationTypes.BLINK_IF_SYNC),
+}
+
+# upper bounds of the latency histogram buckets, in seconds: 1 us to 1 s
+LATENCY_BUCKETS = (
+    1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+    1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0,
+)
+
+
+class LatencyHistogram:
+    __slots__ = ('bucket_counts', 'count', 'errors', 'sum')
+
+
+    def __init__(self):
+        """Histogram of the latencies of a function, with the bounds of `LATENCY_BUCKETS` plus an
+        overflow bucket.
+        """
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.sum = 0.0
+
+
+    def observe(self, seconds: float, failed: bool):
+        self.bucket_counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if failed:
+            self.errors += 1
+
+
+    def get_quantile(self, quantile: float) -> float:
+        """Estimates a latency quantile as the upper bound of the bucket that holds it.
+
+        Args:
+            quantile (float): the quantile, between 0 and 1
+
+        Returns:
+            float: the estimated latency, in seconds, or infinity if it falls in the overflow bucket
+        """
+        rank = quantile * self.count
+        cumulative = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS, self.bucket_counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return bound
+        return float('inf')
+
+
+class Instrumentation:
+    """Latency and call counters of the generation hot path: the `PayloadEncoder` operations, the
+    signing of `PayloadSchema.sign`, and the `QRCode` matrix building and image writing, labeled by
+    message type and operation.
+
+    Disabled by default with no overhead at all: `enable` replaces the instrumented functions on their
+    classes by timed wrappers, and `disable` puts the originals back. Nested calls are recorded on each
+    level, so `PayloadEncoder.get_check_in_payload` includes its `PayloadSchema.sign`, and
+    `QRCode.save_qrcode` includes `QRCode.make_qrcode` when the matrix was not built yet. The wrappers
+    only see the calls of the current process: the work done in worker processes, such as the images
+    the server renders in its pool, is timed there and reported to the parent with `observe`.
+    """
+    histograms: Dict[Tuple[str, str, str], LatencyHistogram] = {}
+    originals: Dict[Tuple[type, str], Callable] = {}
+    lock = threading.Lock()
+
+
+    def get_instrumented_functions() -> List[Tuple[type, str, Callable[..., int]]]:
+        """Lists the instrumented functions, with the way to get the header byte of each call from its
+        arguments and result.
+
+        Returns:
+            List[Tuple[type, str, Callable[..., int]]]: the classes, function names and header getters
+        """
+        from_payload = lambda args, result: args[0].payload[0]
+        from_schema = lambda args, result: args[0].header
+
+        # the header of the PayloadEncoder operations is fixed, so their failed calls are labeled too
+        functions = [
+            (PayloadEncoder, name, lambda args, result, header=(message_type << 4) | operation: header)
+            for name, (message_type, operation) in PAYLOAD_ENCODER_OPERATIONS.items()
+        ]
+        functions.append((PayloadSchema, 'sign', from_schema))
+        functions.append((QRCode, 'make_qrcode', from_payload))
+        functions.append((QRCode, 'save_qrcode', from_payload))
+        functions.append((QRCode, 'write_qrcode', from_payload))
+        return functions
+
+
+    def is_enabled() -> bool:
+        return bool(Instrumentation.originals)
+
+
+    def enable():
+        """Starts recording the instrumented functions. Does nothing if already enabled.
+        """
+        with Instrumentation.lock:
+            if Instrumentation.originals:
+                return
+            for cls, name, get_header in Instrumentation.get_instrumented_functions():
+                function = vars(cls)[name]
+                Instrumentation.originals[(cls, name)] = function
+                setattr(cls, name, Instrumentation.wrap(f'{cls.__name__}.{name}', function, get_header))
+
+
+    def disable():
+        """Stops recording, restoring the original functions. The recorded stats are kept.
+        """
+        with Instrumentation.lock:
+            for (cls, name), function in Instrumentation.originals.items():
+                setattr(cls, name, function)
+            Instrumentation.originals.clear()
+
+
+    def reset():
+        """Clears the recorded stats.
+        """
+        with Instrumentation.lock:
+            Instrumentation.histograms.clear()
+
+
+    def wrap(function_name: str, function: Callable, get_header: Callable[..., int]) -> Callable:
+        perf_counter = time.perf_counter
+
+        @functools.wraps(function)
+        def instrumented(*args, **kwargs):
+            start = perf_counter()
+            result = None
+            failed = True
+            try:
+                result = function(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                Instrumentation.record(function_name, perf_counter() - start, failed, get_header, args, result)
+
+        return instrumented
+
+
+    def record(function_name: str, seconds: float, failed: bool, get_header: Callable[..., int], args: tuple, result: Any):
+        try:
+            header = get_header(args, result)
+        except (IndexError, TypeError, AttributeError):
+            header = None
+        Instrumentation.observe(function_name, header, seconds, failed)
+
+
+    def observe(function_name: str, header: Optional[int], seconds: float, failed: bool = False):
+        """Records a call timed elsewhere, such as in a worker process, under the labels of its
+        payload header.
+
+        Args:
+            function_name (str): the function label, such as 'PngWriter.write_image'
+            header (Optional[int]): the header byte of the payload, or None if unknown
+            seconds (float): the latency
+            failed (bool, optional): if the call raised. Defaults to False.
+        """
+        if header is None:
+            message_type_name, operation_name = 'UNKNOWN', 'UNKNOWN'
+        else:
+            message_type, operation = (header >> 4) & 3, header & 0x0f
+            message_type_name = MESSAGE_TYPE_NAMES.get(message_type, str(message_type))
+            operation_name = OPERATION_NAMES.get(message_type, {}).get(operation, str(operation))
+
+        key = (function_name, message_type_name, operation_name)
+        with Instrumentation.lock:
+            histogram = Instrumentation.histograms.get(key)
+            if histogram is None:
+                histogram = Instrumentation.histograms[key] = LatencyHistogram()
+            histogram.observe(seconds, failed)
+
+
+    def get_stats() -> Dict[Tuple[str, str, str], Dict[str, float]]:
+        """Gets the recorded stats.
+
+        Returns:
+            Dict[Tuple[str, str, str], Dict[str, float]]: by (function, message type, operation), the
+            number of calls and errors, the total and mean latency and the estimated p50, p90 and p99
+            latencies, all in seconds
+
+        Example:
+            >>> Instrumentation.enable()
+            >>> QRCODE_CHECK_IN(2305947582, datetime(2025, 7, 17, 15, 14), access_key).get_qrcode_bytes()
+            >>> Instrumentation.get_stats()[('QRCode.make_qrcode', 'ACCESS', 'CHECK_IN')]['count']
+            1
+        """
+        with Instrumentation.lock:
+            return {
+                key: {
+                    'count': histogram.count,
+                    'errors': histogram.errors,
+                    'sum': histogram.sum,
+                    'mean': histogram.sum / histogram.count,
+                    'p50': histogram.get_quantile(0.50),
+                    'p90': histogram.get_quantile(0.90),
+                    'p99': histogram.get_quantile(0.99),
+                }
+                for key, histogram in Instrumentation.histograms.items()
+            }
+
+
+    def get_prometheus_text() -> str:
+        """Dumps the recorded stats in the Prometheus text exposition format, as the
+        `causp_lock_call_duration_seconds` histogram and the `causp_lock_call_errors_total` counter.
+
+        Returns:
+            str: the metrics
+        """
+        with Instrumentation.lock:
+            items = sorted(Instrumentation.histograms.items())
+            snapshots = [(key, list(histogram.bucket_counts), histogram.count, histogram.errors, histogram.sum) for key, histogram in items]
+
+        lines = [
+            '# HELP causp_lock_call_duration_seconds Latency of the QR Code generation functions.',
+            '# TYPE causp_lock_call_duration_seconds histogram',
+        ]
+        for (function_name, message_type, operation), bucket_counts, count, _, total in snapshots:
+            labels = f'function="{function_name}",message_type="{message_type}",operation="{operation}"'
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f'causp_lock_call_duration_seconds_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+            lines.append(f'causp_lock_call_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'causp_lock_call_duration_seconds_sum{{{labels}}} {total!r}')
+            lines.append(f'causp_lock_call_duration_seconds_count{{{labels}}} {count}')
+
+        lines.append('# HELP causp_lock_call_errors_total Calls of the QR Code generation functions that raised.')
+        lines.append('# TYPE causp_lock_call_errors_total counter')
+        for (function_name, message_type, operation), _, _, errors, _ in snapshots:
+            labels = f'function="{function_name}",message_type="{message_type}",operation="{operation}"'
+            lines.append(f'causp_lock_call_errors_total{{{labels}}} {errors}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,330 @@
+import numpy as np
+import segno
+from typing import *
+from segno import consts, encoder
+
+# payload lengths of the protocol: SET_TIME/BLINK_N_TIMES/BLINK_IF_SYNC (5), SYNC (25), ACCESS (29),
+# DEBUG with hex str data (33) and CONFIG (41)
+KNOWN_PAYLOAD_LENGTHS = (5, 25, 29, 33, 41)
+
+# 1:1:3:1:1 (dark:light:dark:light:dark) pattern of the N3 penalty
+N3_PATTERN = bytes((0x1, 0x0, 0x1, 0x1, 0x1, 0x0, 0x1))
+
+
+class Segment(NamedTuple):
+    mode: int
+
+
+BYTE_SEGMENTS = (Segment(consts.MODE_BYTE),)
+
+
+class TemplateMatrixBuilder:
+    def __init__(self, payload_length: int):
+        """Matrix builder pinned to byte mode payloads of a single length. The version, error level,
+        function patterns, data module placement order, data masks and format information are derived
+        once from segno, so building a matrix only computes the Reed-Solomon error correction, places
+        the data bits and picks the mask, producing the same matrix segno would.
+
+        Args:
+            payload_length (int): the length of the payloads, in bytes
+        """
+        # version and (boosted) error level segno picks for any byte mode payload of this length
+        reference = encoder.encode(b'\xff' * payload_length, micro=False)
+        self.payload_length = payload_length
+        self.version = reference.version
+        self.error = reference.error
+        self.width = encoder.calc_matrix_size(self.version)
+
+        self.make_data_layout()
+        self.make_error_correction_table()
+        self.make_template()
+
+
+    def make_data_layout(self):
+        """Precomputes the constant bits around the payload in the data codewords: the mode indicator
+        and character count before it, and the terminator, padding bits and pad codewords after it.
+        """
+        capacity = consts.SYMBOL_CAPACITY[self.version][self.error]
+        count_length = consts.CHAR_COUNT_INDICATOR_LENGTH[consts.MODE_BYTE][encoder.version_range(self.version)]
+        prefix_length = 4 + count_length
+        length = prefix_length + 8 * self.payload_length
+
+        # the same steps of segno's encoder._encode
+        terminator_length = min(capacity - length, consts.TERMINATOR_LENGTH[None])
+        length += terminator_length
+        padding_length = 8 - (length % 8)
+        length += padding_length
+        pad_codewords = [0xEC if i % 2 == 0 else 0x11 for i in range(capacity // 8 - length // 8)]
+
+        suffix_length = terminator_length + padding_length + 8 * len(pad_codewords)
+        suffix = int.from_bytes(bytes(pad_codewords), byteorder='big') if pad_codewords else 0
+
+        self.prefix = (consts.MODE_BYTE << count_length) | self.payload_length
+        self.suffix = suffix
+        self.suffix_length = suffix_length
+        self.data_length = (prefix_length + 8 * self.payload_length + suffix_length) // 8
+
+
+    def make_error_correction_table(self):
+        """Precomputes the block layout and, for each leading coefficient, the generator polynomial
+        multiplied by it, as an integer, so the Reed-Solomon division takes one lookup per data codeword.
+        """
+        self.blocks = []
+        for ec_info in consts.ECC[self.version][self.error]:
+            for _ in range(ec_info.num_blocks):
+                self.blocks.append((ec_info.num_data, ec_info.num_total - ec_info.num_data))
+
+        self.generator_tables = {}
+        for error_length in set(error_length for _, error_length in self.blocks):
+            generator = consts.GEN_POLY[error_length]
+            table = [0] * 256
+            for coefficient in range(1, 256):
+                log_coefficient = consts.GALIOS_LOG[coefficient]
+                product = bytes(consts.GALIOS_EXP[log_coefficient + term] for term in generator)
+                table[coefficient] = int.from_bytes(product, byteorder='big')
+            self.generator_tables[error_length] = table
+
+
+    def make_template(self):
+        """Precomputes the function patterns, the placement order of the data modules, the data masks
+        and the format and version information modules.
+        """
+        width = self.width
+        matrix = encoder.make_matrix(width, width)
+        encoder.add_finder_patterns(matrix, width, width)
+        encoder.add_alignment_patterns(matrix, width, width)
+        template = np.array(matrix, dtype=np.uint8)
+
+        encoding_region = template == 0x2
+        template[encoding_region] = 0
+        self.template = template
+
+        # placement order, as in segno's encoder.add_codewords
+        positions = []
+        for right in range(width - 1, 0, -2):
+            if right <= 6:
+                right -= 1
+            for vertical in range(width):
+                for z in range(2):
+                    j = right - z
+                    upwards = ((right & 2) == 0) ^ (j < 6)
+                    i = (width - 1 - vertical) if upwards else vertical
+                    if encoding_region[i, j]:
+                        positions.append(i * width + j)
+        self.positions = np.array(positions, dtype=np.intp)
+
+        rows, columns = np.indices((width, width))
+        self.masks = np.array([
+            np.vectorize(mask_function)(rows, columns) & encoding_region
+            for mask_function in encoder.get_data_mask_functions(False)
+        ], dtype=np.uint8)
+
+        # format information of each mask, and the version information, as (positions, values)
+        self.format_infos = [
+            TemplateMatrixBuilder.get_written_modules(width, encoder.add_format_info, self.version, self.error, mask)
+            for mask in range(len(self.masks))
+        ]
+        self.version_info = TemplateMatrixBuilder.get_written_modules(width, encoder.add_version_info, self.version)
+
+
+    def get_written_modules(width: int, add_info: Callable, *args) -> Tuple[np.ndarray, np.ndarray]:
+        """Gets the modules written by one of segno's `add_*_info` functions.
+
+        Args:
+            width (int): the width of the matrix
+            add_info (Callable): the segno function
+            *args: the arguments of the function, after the matrix
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: the flat positions and values of the written modules
+        """
+        matrix = tuple(bytearray([0x2] * width) for _ in range(width))
+        add_info(matrix, *args)
+        modules = np.array(matrix, dtype=np.uint8).ravel()
+        positions = np.flatnonzero(modules != 0x2)
+        return positions, modules[positions]
+
+
+    def get_codewords(self, payload: bytes) -> bytes:
+        """Generates the final message codewords: the data codewords followed by the Reed-Solomon
+        error correction codewords, interleaved by block.
+
+        Args:
+            payload (bytes): the payload
+
+        Returns:
+            bytes: the final message codewords
+        """
+        data = (self.prefix << 8 * self.payload_length) | int.from_bytes(payload, byteorder='big')
+        data = (data << self.suffix_length) | self.suffix
+        data_codewords = data.to_bytes(self.data_length, byteorder='big')
+
+        data_blocks, error_blocks = [], []
+        offset = 0
+        for num_data, num_error in self.blocks:
+            block = data_codewords[offset:offset + num_data]
+            offset += num_data
+            table = self.generator_tables[num_error]
+            shift = 8 * (num_error - 1)
+            remainder_mask = (1 << 8 * num_error) - 1
+            remainder = 0
+            for codeword in block:
+                coefficient = codeword ^ (remainder >> shift)
+                remainder = ((remainder << 8) & remainder_mask) ^ table[coefficient]
+            data_blocks.append(block)
+            error_blocks.append(remainder.to_bytes(num_error, byteorder='big'))
+
+        if len(data_blocks) == 1:
+            return data_blocks[0] + error_blocks[0]
+        return TemplateMatrixBuilder.interleave(data_blocks) + TemplateMatrixBuilder.interleave(error_blocks)
+
+
+    def interleave(blocks: List[bytes]) -> bytes:
+        return bytes(
+            block[i]
+            for i in range(max(len(block) for block in blocks))
+            for block in blocks
+            if i < len(block)
+        )
+
+
+    def make_matrix(self, payload: bytes) -> Tuple[Tuple[bytearray, ...], int]:
+        """Builds the QR Code matrix of the payload, in segno's format (a tuple of bytearray rows).
+
+        Args:
+            payload (bytes): the payload, with `payload_length` bytes
+
+        Returns:
+            Tuple[Tuple[bytearray, ...], int]: the matrix and its data mask pattern
+        """
+        bits = np.unpackbits(np.frombuffer(self.get_codewords(payload), dtype=np.uint8))
+        unmasked = self.template.copy().ravel()
+        unmasked[self.positions[:len(bits)]] = bits
+        unmasked = unmasked.reshape(self.width, self.width)
+
+        candidates = unmasked[np.newaxis] ^ self.masks
+        scores = TemplateMatrixBuilder.get_penalty_scores(candidates)
+        best_mask = int(np.argmin(scores))
+
+        matrix = candidates[best_mask].ravel()
+        format_positions, format_values = self.format_infos[best_mask]
+        matrix[format_positions] = format_values
+        version_positions, version_values = self.version_info
+        matrix[version_positions] = version_values
+
+        matrix_bytes = matrix.tobytes()
+        width = self.width
+        rows = tuple(bytearray(matrix_bytes[offset:offset + width]) for offset in range(0, len(matrix_bytes), width))
+        return rows, best_mask
+
+
+    def make_qr(self, payload: bytes) -> segno.QRCode:
+        """Builds the segno QR Code of the payload.
+
+        Args:
+            payload (bytes): the payload, with `payload_length` bytes
+
+        Returns:
+            segno.QRCode: the QR Code, equal to `segno.make_qr(payload)`
+        """
+        matrix, mask = self.make_matrix(payload)
+        return segno.QRCode(encoder.Code(matrix, self.version, self.error, mask, BYTE_SEGMENTS))
+
+
+    def get_penalty_scores(candidates: np.ndarray) -> List[int]:
+        """Evaluates the masked candidate matrices the same way segno's `encoder.mask_scores` does.
+        The rows and columns of all candidates are laid out in a single buffer, each one followed by
+        a separator module, so the runs and patterns of every line are found in one pass.
+
+        Args:
+            candidates (np.ndarray): the candidate matrices, with shape (masks, width, width)
+
+        Returns:
+            List[int]: the penalty score of each candidate
+        """
+        count, width, _ = candidates.shape
+        line_length = width + 1
+        candidate_length = 2 * width * line_length
+
+        lines = np.full((count, 2 * width, line_length), 0x2, dtype=np.uint8)
+        lines[:, :width, :width] = candidates
+        lines[:, width:, :width] = candidates.transpose(0, 2, 1)
+        flat_lines = lines.ravel()
+
+        # N1: runs of 5 or more modules of the same color, in rows and columns
+        run_starts = np.flatnonzero(flat_lines[1:] != flat_lines[:-1]) + 1
+        run_starts = np.concatenate(([0], run_starts))
+        run_lengths = np.diff(run_starts, append=len(flat_lines))
+        long_runs = run_lengths >= 5
+        n1_scores = np.bincount(
+            run_starts[long_runs] // candidate_length,
+            weights=run_lengths[long_runs] - 2,
+            minlength=count
+        )
+
+        # N2: 2x2 blocks of the same color
+        top_left = candidates[:, :-1, :-1]
+        blocks = (top_left == candidates[:, 1:, :-1]) & (top_left == candidates[:, :-1, 1:]) & (top_left == candidates[:, 1:, 1:])
+        n2_scores = 3 * blocks.sum(axis=(1, 2))
+
+        # N3: 1:1:3:1:1 finder-like patterns
+        n3_scores = [0] * count
+        line_bytes = flat_lines.tobytes()
+        index = line_bytes.find(N3_PATTERN)
+        while index != -1:
+            line_start = index - index % line_length
+            line = line_bytes[line_start:line_start + width]
+            line_index = index - line_start
+            offset = line_index + 7
+            if line_index in (0, width - 7) \
+                    or not any(line[max(line_index - 4, 0):line_index]) \
+                    or not any(line[offset:offset + 4]):
+                n3_scores[index // candidate_length] += 40
+            else:
+                offset = line_index + 4
+            index = line_bytes.find(N3_PATTERN, line_start + offset)
+
+        # N4: proportion of dark modules
+        dark_counts = candidates.sum(axis=(1, 2), dtype=np.int64)
+
+        scores = []
+        for index in range(count):
+            percent = float(dark_counts[index]) / (width ** 2)
+            n4_score = 10 * int(abs(percent * 100 - 50) / 5)
+            scores.append(int(n1_scores[index]) + int(n2_scores[index]) + n3_scores[index] + n4_score)
+        return scores
+
+
+class MatrixBuilders:
+    builders: Dict[int, TemplateMatrixBuilder] = {}
+
+
+    def get_builder(payload_length: int) -> TemplateMatrixBuilder:
+        """Gets the template matrix builder of the payload length, building it on first use.
+
+        Args:
+            payload_length (int): the length of the payloads, in bytes
+
+        Returns:
+            TemplateMatrixBuilder: the matrix builder
+        """
+        builder = MatrixBuilders.builders.get(payload_length)
+        if builder is None:
+            builder = MatrixBuilders.builders[payload_length] = TemplateMatrixBuilder(payload_length)
+        return builder
+
+
+    def make_qr(payload: bytes) -> segno.QRCode:
+        """Builds the QR Code of the payload, through the template fast path when the payload has one
+        of the protocol's lengths and would be encoded in byte mode, or through segno otherwise.
+
+        Args:
+            payload (bytes): the payload
+
+        Returns:
+            segno.QRCode: the QR Code, equal to `segno.make_qr(payload)`
+        """
+        if type(payload) == bytes and len(payload) in KNOWN_PAYLOAD_LENGTHS \
+                and encoder.find_mode(payload) == consts.MODE_BYTE:
+            return MatrixBuilders.get_builder(len(payload)).make_qr(payload)
+        return segno.make_qr(payload)
@@ -0,0 +1,137 @@
+import zlib
+import struct
+import numpy as np
+from typing import *
+import segno
+from qr_code.render_options import INTERACTIVE_COMPRESS_LEVEL, ARCHIVAL_COMPRESS_LEVEL
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+FILTER_NONE = 0
+FILTER_UP = 2 # the scanline repeats the one above
+
+
+class PngWriter:
+    def get_modules(qrcode: Union[segno.QRCode, Sequence[bytes]]) -> np.ndarray:
+        """Gets the module matrix of a QR Code as an array of 0 (light) and 1 (dark).
+
+        Args:
+            qrcode (Union[segno.QRCode, Sequence[bytes]]): the QR Code or its matrix rows
+
+        Returns:
+            np.ndarray: the square matrix of modules
+        """
+        matrix = qrcode.matrix if isinstance(qrcode, segno.QRCode) else qrcode
+        return np.frombuffer(b''.join(matrix), dtype=np.uint8).reshape(len(matrix), -1)
+
+
+    def get_scanlines(qrcode: Union[segno.QRCode, Sequence[bytes]], scale: int = 25, border: int = 5) -> np.ndarray:
+        """Rasterizes a QR Code into the filtered scanlines of a 1-bit grayscale PNG, with the same
+        layout as segno: dark pixels are 0, each module row is packed once and its `scale - 1` copies
+        are 'Up' filtered lines of zeros, and the border lines are unfiltered light lines.
+
+        Args:
+            qrcode (Union[segno.QRCode, Sequence[bytes]]): the QR Code or its matrix rows
+            scale (int, optional): the pixels per module. Defaults to 25.
+            border (int, optional): the border size, in modules. Defaults to 5.
+
+        Returns:
+            np.ndarray: the scanlines, one per row, each led by its filter type byte
+        """
+        modules = PngWriter.get_modules(qrcode)
+        size = len(modules)
+        light = np.ones((size, size + 2 * border), dtype=np.uint8)
+        light[:, border:border + size] ^= modules
+        packed_rows = np.packbits(np.repeat(light, scale, axis=1), axis=1)
+        light_row = np.packbits(np.ones((size + 2 * border) * scale, dtype=np.uint8))
+
+        border_lines = border * scale
+        scanlines = np.zeros(((size + 2 * border) * scale, 1 + packed_rows.shape[1]), dtype=np.uint8)
+        scanlines[:border_lines, 1:] = light_row
+        scanlines[len(scanlines) - border_lines:, 1:] = light_row
+        module_lines = scanlines[border_lines:border_lines + size * scale].reshape(size, scale, -1)
+        module_lines[:, 0, 1:] = packed_rows
+        module_lines[:, 1:, 0] = FILTER_UP
+        return scanlines
+
+
+    def get_chunk(name: bytes, data: bytes) -> bytes:
+        chunk_head = name + data
+        return struct.pack('>I', len(data)) + chunk_head + struct.pack('>I', zlib.crc32(chunk_head))
+
+
+    def get_png_bytes(
+        qrcode: Union[segno.QRCode, Sequence[bytes]],
+        scale: int = 25,
+        border: int = 5,
+        compress_level: int = ARCHIVAL_COMPRESS_LEVEL
+    ) -> bytes:
+        """Encodes a QR Code as a 1-bit grayscale PNG. The pixels are identical to segno's and, with
+        the default compression level, so are the bytes.
+
+        Args:
+            qrcode (Union[segno.QRCode, Sequence[bytes]]): the QR Code or its matrix rows
+            scale (int, optional): the pixels per module. Defaults to 25.
+            border (int, optional): the border size, in modules. Defaults to 5.
+            compress_level (int, optional): the zlib level, from 0 (none) to 9 (smallest). Defaults to
+            ARCHIVAL_COMPRESS_LEVEL, 9; INTERACTIVE_COMPRESS_LEVEL, 1, is several times faster.
+
+        Returns:
+            bytes: the PNG image
+        """
+        scanlines = PngWriter.get_scanlines(qrcode, scale, border)
+        width = scanlines.shape[0] # the image is square
+        header = struct.pack('>2I5B', width, width, 1, 0, 0, 0, 0) # bit depth 1, grayscale
+        return b''.join((
+            PNG_SIGNATURE,
+            PngWriter.get_chunk(b'IHDR', header),
+            PngWriter.get_chunk(b'IDAT', zlib.compress(scanlines, compress_level)),
+            PngWriter.get_chunk(b'IEND', b''),
+        ))
+
+
+    def write_png(
+        qrcode: Union[segno.QRCode, Sequence[bytes]],
+        out: Union[str, BinaryIO],
+        scale: int = 25,
+        border: int = 5,
+        compress_level: int = ARCHIVAL_COMPRESS_LEVEL
+    ):
+        """Writes a QR Code as a 1-bit grayscale PNG on a path or a writable stream.
+
+        Args:
+            qrcode (Union[segno.QRCode, Sequence[bytes]]): the QR Code or its matrix rows
+            out (Union[str, BinaryIO]): the path or stream
+            scale (int, optional): the pixels per module. Defaults to 25.
+            border (int, optional): the border size, in modules. Defaults to 5.
+            compress_level (int, optional): the zlib level. Defaults to ARCHIVAL_COMPRESS_LEVEL.
+        """
+        image = PngWriter.get_png_bytes(qrcode, scale, border, compress_level)
+        if isinstance(out, str):
+            with open(out, 'wb') as file:
+                file.write(image)
+        else:
+            out.write(image)
+
+
+    def write_image(
+        qrcode: segno.QRCode,
+        out: Union[str, BinaryIO],
+        kind: str = 'png',
+        scale: int = 25,
+        border: int = 5,
+        compress_level: int = ARCHIVAL_COMPRESS_LEVEL
+    ):
+        """Writes a QR Code image in any segno format, the PNGs through this writer.
+
+        Args:
+            qrcode (segno.QRCode): the QR Code
+            out (Union[str, BinaryIO]): the path or stream
+            kind (str, optional): the image format. Defaults to 'png'.
+            scale (int, optional): the pixels per module. Defaults to 25.
+            border (int, optional): the border size, in modules. Defaults to 5.
+            compress_level (int, optional): the zlib level of PNGs. Defaults to ARCHIVAL_COMPRESS_LEVEL.
+        """
+        if kind == 'png':
+            PngWriter.write_png(qrcode, out, scale, border, compress_level)
+        else:
+            qrcode.save(out, kind=kind, scale=scale, border=border)
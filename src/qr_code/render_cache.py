@@ -0,0 +1,169 @@
+import sys
+import time
+import threading
+from collections import OrderedDict
+from typing import *
+import segno
+
+DEFAULT_MAX_BYTES = 64 << 20 # 64 MiB, about 15000 PNGs of ACCESS codes at scale 25
+ENTRY_OVERHEAD = 200 # bytes of the dictionary node, the entry tuple and the key tuple
+
+
+class CacheEntry(NamedTuple):
+    value: Any
+    size: int
+    expires_at: Optional[float] # clock time, or None if it never expires
+
+
+class RenderCache:
+    def __init__(
+        self,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        ttl: Optional[float] = None,
+        align_ttl: bool = False,
+        clock: Callable[[], float] = time.time
+    ):
+        """Memory-bounded LRU cache of QR Code matrices and rendered images. Identical payload bytes
+        always give the same matrix, and the same image at the same render options, so the entries are
+        keyed by (payload, options) and never go stale; the optional TTL only frees the codes that will
+        not be requested again, such as the ones of a past `generated_at` bucket.
+
+        The size of an entry is its estimated memory, key included, and the least recently used entries
+        are evicted until the total fits in `max_bytes`. Thread-safe; a missing value may be computed by
+        two threads at once, which `SingleFlight` prevents when it matters.
+
+        Args:
+            max_bytes (int, optional): the memory budget, in bytes. Defaults to DEFAULT_MAX_BYTES.
+            ttl (Optional[float], optional): the seconds an entry is kept. Defaults to None, no expiration.
+            align_ttl (bool, optional): if the entries expire at the end of the `ttl` long clock bucket
+            they were stored in, as the minute of the payloads generated in it. Defaults to False.
+            clock (Callable[[], float], optional): the clock of the expirations. Defaults to time.time.
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.align_ttl = align_ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[Hashable, CacheEntry] = OrderedDict() # least recently used first
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+
+    def get_size(key: Hashable, value: Any) -> int:
+        """Estimates the memory of an entry: bytes values and keys by their length, matrices by their
+        rows.
+        """
+        if isinstance(value, segno.QRCode):
+            value_size = sys.getsizeof(value) + sys.getsizeof(value.matrix) + sum(map(sys.getsizeof, value.matrix))
+        else:
+            value_size = sys.getsizeof(value)
+        key_size = sum(map(sys.getsizeof, key)) if type(key) == tuple else sys.getsizeof(key)
+        return ENTRY_OVERHEAD + key_size + value_size
+
+
+    def get_expiration(self, now: float) -> Optional[float]:
+        if self.ttl is None:
+            return None
+        if self.align_ttl:
+            return (now // self.ttl + 1) * self.ttl
+        return now + self.ttl
+
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Gets a value, marking it as the most recently used.
+
+        Args:
+            key (Hashable): the key
+
+        Returns:
+            Optional[Any]: the value, or None if it is missing or expired
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires_at is not None and entry.expires_at <= self.clock():
+                self.remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+
+    def put(self, key: Hashable, value: Any):
+        """Stores a value, evicting the least recently used entries over the memory budget. Values
+        larger than the whole budget are not stored.
+
+        Args:
+            key (Hashable): the key
+            value (Any): the value
+        """
+        size = RenderCache.get_size(key, value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = CacheEntry(value, size, self.get_expiration(self.clock()))
+            self.size += size
+            while self.size > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+
+    def get_or_create(self, key: Hashable, create: Callable[..., Any], *args) -> Any:
+        """Gets a value, computing and storing it with `create(*args)` when it is missing.
+        """
+        value = self.get(key)
+        if value is None:
+            value = create(*args)
+            self.put(key, value)
+        return value
+
+
+    def remove(self, key: Hashable):
+        self.size -= self.entries.pop(key).size
+
+
+    def evict_expired(self) -> int:
+        """Removes all the expired entries, which are otherwise only removed when looked up or evicted.
+
+        Returns:
+            int: the number of removed entries
+        """
+        with self.lock:
+            now = self.clock()
+            expired = [key for key, entry in self.entries.items() if entry.expires_at is not None and entry.expires_at <= now]
+            for key in expired:
+                self.remove(key)
+            self.expirations += len(expired)
+            return len(expired)
+
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+    def get_stats(self) -> Dict[str, int]:
+        """Gets the hit, miss, eviction and expiration counters and the current entries and bytes.
+        """
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'entries': len(self.entries),
+                'bytes': self.size,
+            }
+
+
+    def __len__(self) -> int:
+        return len(self.entries)
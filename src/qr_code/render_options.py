@@ -0,0 +1,6 @@
+# render defaults that are needed without the rendering dependencies, such as in the default arguments
+# of the payload classes, so importing them does not import segno or numpy
+
+# zlib levels: the interactive one favours latency and the archival one, segno's default, size
+INTERACTIVE_COMPRESS_LEVEL = 1
+ARCHIVAL_COMPRESS_LEVEL = 9
@@ -0,0 +1,385 @@
+import zlib
+import struct
+import itertools
+import numpy as np
+from typing import *
+from qr_code.generator import QRCode
+from qr_code.png_writer import PngWriter, PNG_SIGNATURE, FILTER_NONE, ARCHIVAL_COMPRESS_LEVEL
+
+A4_SIZE = (595.28, 841.89) # points
+CAPTION_LINES = 3 # action, user id and time of the ACCESS codes
+HIDDEN_CAPTION_FIELDS = ('payload',) # along with the *_key fields: CONFIG payloads carry the new key in the clear
+
+# 5x7 bitmap font of the PNG captions, one 5 bits mask per row, the leftmost pixel in the high bit
+FONT_WIDTH, FONT_HEIGHT = 5, 7
+FONT = {
+    ' ': (0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00),
+    '0': (0x0E, 0x11, 0x13, 0x15, 0x19, 0x11, 0x0E),
+    '1': (0x04, 0x0C, 0x04, 0x04, 0x04, 0x04, 0x0E),
+    '2': (0x0E, 0x11, 0x01, 0x02, 0x04, 0x08, 0x1F),
+    '3': (0x1F, 0x02, 0x04, 0x02, 0x01, 0x11, 0x0E),
+    '4': (0x02, 0x06, 0x0A, 0x12, 0x1F, 0x02, 0x02),
+    '5': (0x1F, 0x10, 0x1E, 0x01, 0x01, 0x11, 0x0E),
+    '6': (0x06, 0x08, 0x10, 0x1E, 0x11, 0x11, 0x0E),
+    '7': (0x1F, 0x01, 0x02, 0x04, 0x08, 0x08, 0x08),
+    '8': (0x0E, 0x11, 0x11, 0x0E, 0x11, 0x11, 0x0E),
+    '9': (0x0E, 0x11, 0x11, 0x0F, 0x01, 0x02, 0x0C),
+    'A': (0x0E, 0x11, 0x11, 0x1F, 0x11, 0x11, 0x11),
+    'B': (0x1E, 0x11, 0x11, 0x1E, 0x11, 0x11, 0x1E),
+    'C': (0x0E, 0x11, 0x10, 0x10, 0x10, 0x11, 0x0E),
+    'D': (0x1C, 0x12, 0x11, 0x11, 0x11, 0x12, 0x1C),
+    'E': (0x1F, 0x10, 0x10, 0x1E, 0x10, 0x10, 0x1F),
+    'F': (0x1F, 0x10, 0x10, 0x1E, 0x10, 0x10, 0x10),
+    'G': (0x0E, 0x11, 0x10, 0x17, 0x11, 0x11, 0x0F),
+    'H': (0x11, 0x11, 0x11, 0x1F, 0x11, 0x11, 0x11),
+    'I': (0x0E, 0x04, 0x04, 0x04, 0x04, 0x04, 0x0E),
+    'J': (0x07, 0x02, 0x02, 0x02, 0x02, 0x12, 0x0C),
+    'K': (0x11, 0x12, 0x14, 0x18, 0x14, 0x12, 0x11),
+    'L': (0x10, 0x10, 0x10, 0x10, 0x10, 0x10, 0x1F),
+    'M': (0x11, 0x1B, 0x15, 0x15, 0x11, 0x11, 0x11),
+    'N': (0x11, 0x11, 0x19, 0x15, 0x13, 0x11, 0x11),
+    'O': (0x0E, 0x11, 0x11, 0x11, 0x11, 0x11, 0x0E),
+    'P': (0x1E, 0x11, 0x11, 0x1E, 0x10, 0x10, 0x10),
+    'Q': (0x0E, 0x11, 0x11, 0x11, 0x15, 0x12, 0x0D),
+    'R': (0x1E, 0x11, 0x11, 0x1E, 0x14, 0x12, 0x11),
+    'S': (0x0F, 0x10, 0x10, 0x0E, 0x01, 0x01, 0x1E),
+    'T': (0x1F, 0x04, 0x04, 0x04, 0x04, 0x04, 0x04),
+    'U': (0x11, 0x11, 0x11, 0x11, 0x11, 0x11, 0x0E),
+    'V': (0x11, 0x11, 0x11, 0x11, 0x11, 0x0A, 0x04),
+    'W': (0x11, 0x11, 0x11, 0x15, 0x15, 0x15, 0x0A),
+    'X': (0x11, 0x11, 0x0A, 0x04, 0x0A, 0x11, 0x11),
+    'Y': (0x11, 0x11, 0x11, 0x0A, 0x04, 0x04, 0x04),
+    'Z': (0x1F, 0x01, 0x02, 0x04, 0x08, 0x10, 0x1F),
+    ':': (0x00, 0x0C, 0x0C, 0x00, 0x0C, 0x0C, 0x00),
+    '-': (0x00, 0x00, 0x00, 0x1F, 0x00, 0x00, 0x00),
+    '_': (0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x1F),
+    '.': (0x00, 0x00, 0x00, 0x00, 0x00, 0x0C, 0x0C),
+    ',': (0x00, 0x00, 0x00, 0x00, 0x0C, 0x04, 0x08),
+    '/': (0x00, 0x01, 0x02, 0x04, 0x08, 0x10, 0x00),
+    '+': (0x00, 0x04, 0x04, 0x1F, 0x04, 0x04, 0x00),
+    '?': (0x0E, 0x11, 0x01, 0x02, 0x04, 0x00, 0x04),
+}
+# the glyphs as light (1) and dark (0) pixels, as in the 1-bit PNG scanlines
+GLYPHS = {
+    char: np.array([[1 ^ ((row >> (FONT_WIDTH - 1 - column)) & 1) for column in range(FONT_WIDTH)] for row in rows], dtype=np.uint8)
+    for char, rows in FONT.items()
+}
+
+Tile = Tuple[np.ndarray, List[str]] # the module matrix and the caption lines of a QR Code
+
+
+class PdfSheetWriter:
+    def __init__(
+        self,
+        out: BinaryIO,
+        columns: int = 3,
+        rows: int = 4,
+        page_size: Tuple[float, float] = A4_SIZE,
+        margin: float = 36.0,
+        border: int = 2,
+        font_size: float = 8.0
+    ):
+        """Writer of a multi-page PDF of QR Code tiles. The modules are drawn as vector rectangles and the
+        captions in the standard Helvetica font, so nothing is embedded. Each page is written as soon as
+        it is composed; only the object offsets are kept until the cross-reference table is written by
+        `close`, so `out` needs no seeking.
+
+        Args:
+            out (BinaryIO): the writable stream
+            columns (int, optional): the tiles per row. Defaults to 3.
+            rows (int, optional): the tile rows per page. Defaults to 4.
+            page_size (Tuple[float, float], optional): the page width and height, in points. Defaults to A4_SIZE.
+            margin (float, optional): the page margin, in points. Defaults to 36, half an inch.
+            border (int, optional): the quiet zone around each code, in modules. Defaults to 2.
+            font_size (float, optional): the caption font size, in points. Defaults to 8.
+        """
+        self.out = out
+        self.columns = columns
+        self.rows = rows
+        self.page_size = page_size
+        self.margin = margin
+        self.border = border
+        self.font_size = font_size
+        self.position = 0
+        self.offsets: Dict[int, int] = {} # object number -> offset
+        self.page_ids: List[int] = []
+        self.next_id = 4 # 1: catalog, 2: page tree, 3: font
+
+        self.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        self.write_object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        self.write_object(3, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>')
+
+
+    def write(self, data: bytes):
+        self.out.write(data)
+        self.position += len(data)
+
+
+    def write_object(self, object_id: int, content: bytes):
+        self.offsets[object_id] = self.position
+        self.write(b'%d 0 obj\n' % object_id + content + b'\nendobj\n')
+
+
+    def get_text(text: str) -> bytes:
+        escaped = text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+        return b'(' + escaped.encode('cp1252', errors='replace') + b')'
+
+
+    def get_tile_operators(self, tile: Tile, left: float, top: float, width: float, height: float) -> List[bytes]:
+        """Draws a tile in its cell: the code centered above its caption.
+        """
+        modules, caption = tile
+        leading = 1.25 * self.font_size
+        caption_height = CAPTION_LINES * leading
+        side = min(width, height - caption_height)
+        module_size = side / (len(modules) + 2 * self.border)
+        x = left + (width - side) / 2 + self.border * module_size
+        y = top - self.border * module_size
+
+        # one rectangle per horizontal run of dark modules, all formatted at once
+        padded = np.pad(modules.astype(np.int8), ((0, 0), (1, 1)))
+        run_rows, run_starts = np.nonzero(np.diff(padded, axis=1) == 1)
+        _, run_ends = np.nonzero(np.diff(padded, axis=1) == -1)
+        rectangles = np.empty((len(run_rows), 4))
+        rectangles[:, 0] = x + run_starts * module_size
+        rectangles[:, 1] = y - (run_rows + 1) * module_size
+        rectangles[:, 2] = (run_ends - run_starts) * module_size
+        rectangles[:, 3] = module_size
+        operators = [b'%.3f %.3f %.3f %.3f re\n' * len(rectangles) % tuple(rectangles.ravel()) + b'f']
+
+        operators.append(b'BT /F3 %.1f Tf %.1f TL %.3f %.3f Td' % (self.font_size, leading, left + (width - side) / 2, top - side - self.font_size))
+        for line_index, line in enumerate(caption[:CAPTION_LINES]):
+            operators.append((b'T* ' if line_index else b'') + PdfSheetWriter.get_text(line) + b' Tj')
+        operators.append(b'ET')
+        return operators
+
+
+    def write_page(self, tiles: Sequence[Tile]):
+        """Composes and writes a page, its tiles filled row by row from the top left.
+
+        Args:
+            tiles (Sequence[Tile]): up to `columns * rows` tiles
+        """
+        page_width, page_height = self.page_size
+        cell_width = (page_width - 2 * self.margin) / self.columns
+        cell_height = (page_height - 2 * self.margin) / self.rows
+        operators = [b'0 g']
+        for index, tile in enumerate(tiles):
+            row, column = divmod(index, self.columns)
+            left = self.margin + column * cell_width
+            top = page_height - self.margin - row * cell_height
+            padding = 0.05 * min(cell_width, cell_height)
+            operators += self.get_tile_operators(tile, left + padding, top - padding, cell_width - 2 * padding, cell_height - 2 * padding)
+
+        content = zlib.compress(b'\n'.join(operators))
+        content_id, page_id = self.next_id, self.next_id + 1
+        self.next_id += 2
+        self.write_object(content_id, b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(content) + content + b'\nendstream')
+        self.write_object(page_id, (
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.2f %.2f] ' % self.page_size +
+            b'/Resources << /Font << /F3 3 0 R >> >> /Contents %d 0 R >>' % content_id
+        ))
+        self.page_ids.append(page_id)
+
+
+    def close(self):
+        """Writes the page tree and the cross-reference table, ending the document. The stream is not closed.
+        """
+        kids = b' '.join(b'%d 0 R' % page_id for page_id in self.page_ids)
+        self.write_object(2, b'<< /Type /Pages /Kids [' + kids + b'] /Count %d >>' % len(self.page_ids))
+        xref_offset = self.position
+        self.write(b'xref\n0 %d\n0000000000 65535 f \n' % self.next_id)
+        self.write(b''.join(b'%010d 00000 n \n' % self.offsets[object_id] for object_id in range(1, self.next_id)))
+        self.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (self.next_id, xref_offset))
+
+
+class PngSheetWriter:
+    def __init__(
+        self,
+        columns: int = 3,
+        rows: int = 4,
+        cell_size: int = 400,
+        margin: int = 40,
+        gutter: int = 24,
+        border: int = 2,
+        text_scale: int = 2,
+        compress_level: int = ARCHIVAL_COMPRESS_LEVEL
+    ):
+        """Writer of QR Code tiles on large 1-bit grayscale PNG sheets, one image per page. A page is
+        composed one row of tiles at a time, whose scanlines go through a zlib stream into IDAT chunks,
+        so the memory is a band of tiles whatever the page size. Each code is drawn with the largest
+        integer module size that fits in the cell and captioned in capitals with a 5x7 bitmap font.
+
+        Args:
+            columns (int, optional): the tiles per row. Defaults to 3.
+            rows (int, optional): the tile rows per page. Defaults to 4.
+            cell_size (int, optional): the width of a tile and the height of its code, in pixels. Defaults to 400.
+            margin (int, optional): the page margin, in pixels. Defaults to 40.
+            gutter (int, optional): the space between tiles, in pixels. Defaults to 24.
+            border (int, optional): the quiet zone around each code, in modules. Defaults to 2.
+            text_scale (int, optional): the pixels per font pixel. Defaults to 2.
+            compress_level (int, optional): the zlib level. Defaults to ARCHIVAL_COMPRESS_LEVEL.
+        """
+        self.columns = columns
+        self.rows = rows
+        self.cell_size = cell_size
+        self.margin = margin
+        self.gutter = gutter
+        self.border = border
+        self.text_scale = text_scale
+        self.compress_level = compress_level
+        self.line_height = (FONT_HEIGHT + 3) * text_scale
+        self.cell_height = cell_size + CAPTION_LINES * self.line_height
+        self.width = columns * cell_size + (columns - 1) * gutter + 2 * margin
+        self.height = rows * self.cell_height + (rows - 1) * gutter + 2 * margin
+
+
+    def draw_text(self, band: np.ndarray, text: str, left: int, top: int, width: int):
+        """Draws a line of text centered in a width, cut to the characters that fit.
+        """
+        advance = (FONT_WIDTH + 1) * self.text_scale
+        text = text.upper()[:width // advance]
+        left += (width - len(text) * advance + self.text_scale) // 2
+        for index, char in enumerate(text):
+            glyph = GLYPHS.get(char, GLYPHS['?'])
+            pixels = np.repeat(np.repeat(glyph, self.text_scale, axis=0), self.text_scale, axis=1)
+            x = left + index * advance
+            band[top:top + pixels.shape[0], x:x + pixels.shape[1]] = pixels
+
+
+    def get_module_size(self, modules: np.ndarray) -> int:
+        """Gets the largest integer module size at which a code and its quiet zone fit in a cell.
+
+        Raises:
+            ValueError: if the code and its quiet zone are wider than the cell, even at one pixel per
+            module
+        """
+        module_size = self.cell_size // (len(modules) + 2 * self.border)
+        if module_size < 1:
+            raise ValueError(
+                f'a {len(modules)} modules code with a {self.border} modules border does not fit in a '
+                f'{self.cell_size} pixels cell'
+            )
+        return module_size
+
+
+    def get_band(self, tiles: Sequence[Tile]) -> np.ndarray:
+        """Rasterizes a row of tiles, as 0 (dark) and 1 (light) pixels.
+        """
+        band = np.ones((self.cell_height, self.width), dtype=np.uint8)
+        for column, (modules, caption) in enumerate(tiles):
+            left = self.margin + column * (self.cell_size + self.gutter)
+            module_size = self.get_module_size(modules)
+            pixels = 1 ^ np.repeat(np.repeat(modules, module_size, axis=0), module_size, axis=1)
+            side = len(pixels)
+            offset = (self.cell_size - side) // 2
+            band[offset:offset + side, left + offset:left + offset + side] = pixels
+            for line_index, line in enumerate(caption[:CAPTION_LINES]):
+                self.draw_text(band, line, left, self.cell_size + line_index * self.line_height, self.cell_size)
+        return band
+
+
+    def write_page(self, out: BinaryIO, tiles: Sequence[Tile]):
+        """Composes and writes a page as a PNG, its tiles filled row by row from the top left.
+
+        Args:
+            out (BinaryIO): the writable stream
+            tiles (Sequence[Tile]): up to `columns * rows` tiles
+
+        Raises:
+            ValueError: if a code and its quiet zone are wider than `cell_size`
+        """
+        # checked before any byte is written, so an unscannable page leaves no truncated image
+        for modules, _ in tiles:
+            self.get_module_size(modules)
+        out.write(PNG_SIGNATURE)
+        out.write(PngWriter.get_chunk(b'IHDR', struct.pack('>2I5B', self.width, self.height, 1, 0, 0, 0, 0)))
+        compressor = zlib.compressobj(self.compress_level)
+
+        def write_lines(lines: np.ndarray):
+            scanlines = np.empty((len(lines), 1 + (self.width + 7) // 8), dtype=np.uint8)
+            scanlines[:, 0] = FILTER_NONE
+            scanlines[:, 1:] = np.packbits(lines, axis=1)
+            data = compressor.compress(scanlines)
+            if data:
+                out.write(PngWriter.get_chunk(b'IDAT', data))
+
+        write_lines(np.ones((self.margin, self.width), dtype=np.uint8))
+        for row in range(self.rows):
+            if row:
+                write_lines(np.ones((self.gutter, self.width), dtype=np.uint8))
+            write_lines(self.get_band(tiles[row * self.columns:(row + 1) * self.columns]))
+        write_lines(np.ones((self.margin, self.width), dtype=np.uint8))
+        out.write(PngWriter.get_chunk(b'IDAT', compressor.flush()))
+        out.write(PngWriter.get_chunk(b'IEND', b''))
+
+
+class SheetExporter:
+    def get_caption(qrcode: QRCode) -> List[str]:
+        """Gets the caption of a QR Code from its `__str__` fields, without its title, keys and payload.
+
+        Args:
+            qrcode (QRCode): the QR Code
+
+        Returns:
+            List[str]: the caption lines, such as 'action: CHECK_IN'
+        """
+        caption = []
+        for line in str(qrcode).split('\n')[1:]:
+            name = line.split(':', 1)[0]
+            if name.endswith('_key') or name in HIDDEN_CAPTION_FIELDS:
+                continue
+            caption.append(line)
+        return caption
+
+
+    def get_tile(qrcode: QRCode) -> Tile:
+        return PngWriter.get_modules(qrcode.qrcode), SheetExporter.get_caption(qrcode)
+
+
+    def export(
+        qrcodes: Iterable[QRCode],
+        path: str,
+        columns: int = 3,
+        rows: int = 4,
+        **options
+    ) -> List[str]:
+        """Lays out many QR Codes, such as the badges of an onboarding event, on printable sheets: a
+        multi-page PDF for a `.pdf` path, or one PNG per page for a `.png` path, named `<name>_<page>.png`.
+        The codes are taken from the iterable one page at a time, so a generator keeps the memory flat
+        whatever the batch size.
+
+        Args:
+            qrcodes (Iterable[QRCode]): the QR Codes, in order
+            path (str): the `.pdf` or `.png` output path
+            columns (int, optional): the codes per row. Defaults to 3.
+            rows (int, optional): the code rows per page. Defaults to 4.
+            **options: the other `PdfSheetWriter` or `PngSheetWriter` options
+
+        Raises:
+            ValueError: if the path is not a PDF or PNG one, or a code does not fit in a PNG cell
+
+        Returns:
+            List[str]: the written files
+        """
+        extension = path.rsplit('.', 1)[-1].lower()
+        if extension not in ('pdf', 'png'):
+            raise ValueError(f'unknown sheet format {extension!r}, expected pdf or png')
+
+        iterator = iter(qrcodes)
+        pages = iter(lambda: [SheetExporter.get_tile(qrcode) for qrcode in itertools.islice(iterator, columns * rows)], [])
+        if extension == 'pdf':
+            with open(path, 'wb') as file:
+                writer = PdfSheetWriter(file, columns, rows, **options)
+                for tiles in pages:
+                    writer.write_page(tiles)
+                writer.close()
+            return [path]
+
+        writer = PngSheetWriter(columns, rows, **options)
+        paths = []
+        for page_number, tiles in enumerate(pages, start=1):
+            paths.append(f'{path[:-len(".png")]}_{page_number:03d}.png')
+            with open(paths[-1], 'wb') as file:
+                writer.write_page(file, tiles)
+        return paths
@@ -0,0 +1,228 @@
+import asyncio
+import threading
+from typing import *
+from datetime import datetime
+from concurrent.futures import Executor, Future
+from auth.secret_key import SecretKey
+from auth.signer import KeyedSigner
+from qr_code.encoder import OperationTypes
+from qr_code.generator import QRCODE_CHECK_IN, QRCODE_CHECK_OUT, QRCODE_BI_ACCESS
+from qr_code.png_writer import INTERACTIVE_COMPRESS_LEVEL
+
+DEFAULT_TIME_BUCKET = 60 # seconds; generated_at is minute-resolution in practice
+
+QRCODE_CLASSES = {
+    OperationTypes.CHECK_IN: QRCODE_CHECK_IN,
+    OperationTypes.CHECK_OUT: QRCODE_CHECK_OUT,
+    OperationTypes.BI_ACCESS: QRCODE_BI_ACCESS,
+}
+
+
+class SingleFlight:
+    def __init__(self):
+        """Coalescing of concurrent calls for threaded callers: while a call for a key is in flight,
+        the calls for the same key wait for it and share its result, or its exception, instead of
+        running again. Nothing is kept once the call completes, so it is not a cache.
+        """
+        self.lock = threading.Lock()
+        self.calls: Dict[Hashable, Future] = {}
+        self.executions = 0
+        self.coalesced = 0
+
+
+    def do(self, key: Hashable, function: Callable[..., Any], *args) -> Any:
+        """Runs `function(*args)`, or waits for the call in flight for the same key.
+
+        Args:
+            key (Hashable): the key of the call
+            function (Callable[..., Any]): the function
+            *args: the function arguments
+
+        Returns:
+            Any: the result of the function
+        """
+        with self.lock:
+            future = self.calls.get(key)
+            if future is None:
+                future = self.calls[key] = Future()
+                self.executions += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+        if not leader:
+            return future.result()
+
+        try:
+            result = function(*args)
+        except BaseException as error:
+            with self.lock:
+                del self.calls[key]
+            future.set_exception(error)
+            raise
+        with self.lock:
+            del self.calls[key]
+        future.set_result(result)
+        return result
+
+
+class AsyncSingleFlight:
+    def __init__(self):
+        """Coalescing of concurrent calls for asyncio callers, as `SingleFlight`. The shared call runs
+        as a task, so a caller that is cancelled stops waiting without cancelling it for the others.
+        """
+        self.calls: Dict[Hashable, asyncio.Future] = {}
+        self.executions = 0
+        self.coalesced = 0
+
+
+    async def do(self, key: Hashable, function: Callable[..., Awaitable[Any]], *args) -> Any:
+        """Awaits `function(*args)`, or the call in flight for the same key.
+
+        Args:
+            key (Hashable): the key of the call
+            function (Callable[..., Awaitable[Any]]): the coroutine function
+            *args: the function arguments
+
+        Returns:
+            Any: the result of the function
+        """
+        task = self.calls.get(key)
+        if task is None:
+            task = self.calls[key] = asyncio.ensure_future(function(*args))
+            task.add_done_callback(lambda _: self.calls.pop(key, None))
+            self.executions += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+
+def get_bucket_time(generated_at: datetime, time_bucket: int) -> datetime:
+    """Rounds a time down to the start of its bucket.
+    """
+    bucket_start = int(generated_at.timestamp()) // time_bucket * time_bucket
+    return datetime.fromtimestamp(bucket_start, tz=generated_at.tzinfo)
+
+
+def render_access_code(
+    operation: int,
+    user_id: int,
+    generated_at: datetime,
+    access_key: Union[bytes, SecretKey, KeyedSigner],
+    kind: str,
+    scale: int,
+    border: int,
+    compress_level: int
+) -> bytes:
+    qrcode = QRCODE_CLASSES[operation](user_id, generated_at, access_key)
+    return qrcode.get_qrcode_bytes(kind=kind, scale=scale, border=border, compress_level=compress_level)
+
+
+class CoalescedGenerator:
+    def __init__(
+        self,
+        time_bucket: int = DEFAULT_TIME_BUCKET,
+        kind: str = 'png',
+        scale: int = 25,
+        border: int = 5,
+        compress_level: int = INTERACTIVE_COMPRESS_LEVEL
+    ):
+        """Generation of ACCESS code images in which the concurrent requests for the same (operation,
+        user_id, time bucket, key id), such as a double click or a refresh, share a single encoding,
+        signature and rendering. The codes carry the start of the `generated_at` bucket, so a request
+        gets the same code whether it was coalesced or not.
+
+        Args:
+            time_bucket (int, optional): the seconds generated_at is rounded down to. Defaults to
+            DEFAULT_TIME_BUCKET; 1 keeps the times unchanged.
+            kind (str, optional): the image format. Defaults to 'png'.
+            scale (int, optional): the scale of the QR Codes. Defaults to 25.
+            border (int, optional): the border size of the QR Codes. Defaults to 5.
+            compress_level (int, optional): the zlib level of PNGs. Defaults to INTERACTIVE_COMPRESS_LEVEL.
+        """
+        self.time_bucket = time_bucket
+        self.kind = kind
+        self.scale = scale
+        self.border = border
+        self.compress_level = compress_level
+        self.single_flight = SingleFlight()
+        self.async_single_flight = AsyncSingleFlight()
+
+
+    def get_key(
+        self,
+        operation: int,
+        user_id: int,
+        generated_at: datetime,
+        access_key: Union[bytes, SecretKey, KeyedSigner],
+        key_id: Optional[Hashable]
+    ) -> Tuple[int, int, int, Hashable]:
+        """Gets the coalescing key of a request. Without a key id, requests only coalesce when they pass
+        the same key object, whose identity is unique while its call is in flight.
+        """
+        bucket = int(generated_at.timestamp()) // self.time_bucket
+        return operation, user_id, bucket, id(access_key) if key_id is None else key_id
+
+
+    def get_image(
+        self,
+        operation: int,
+        user_id: int,
+        generated_at: datetime,
+        access_key: Union[bytes, SecretKey, KeyedSigner],
+        key_id: Optional[Hashable] = None
+    ) -> bytes:
+        """Generates the image of an ACCESS code, from any thread.
+
+        Args:
+            operation (int): CHECK_IN, CHECK_OUT or BI_ACCESS
+            user_id (int): the user id
+            generated_at (datetime): the generation time
+            access_key (Union[bytes, SecretKey, KeyedSigner]): the secret access key
+            key_id (Optional[Hashable], optional): an identifier of the key, such as the device id. Defaults to None.
+
+        Raises:
+            KeyError: if the operation is not an ACCESS one
+
+        Returns:
+            bytes: the image
+        """
+        return self.single_flight.do(
+            self.get_key(operation, user_id, generated_at, access_key, key_id),
+            render_access_code,
+            operation, user_id, get_bucket_time(generated_at, self.time_bucket), access_key,
+            self.kind, self.scale, self.border, self.compress_level
+        )
+
+
+    async def get_image_async(
+        self,
+        operation: int,
+        user_id: int,
+        generated_at: datetime,
+        access_key: Union[bytes, SecretKey],
+        key_id: Optional[Hashable] = None,
+        executor: Optional[Executor] = None
+    ) -> bytes:
+        """Generates the image of an ACCESS code in an executor, from the event loop.
+
+        Args:
+            operation (int): CHECK_IN, CHECK_OUT or BI_ACCESS
+            user_id (int): the user id
+            generated_at (datetime): the generation time
+            access_key (Union[bytes, SecretKey]): the secret access key, which must be picklable for a
+            process pool
+            key_id (Optional[Hashable], optional): an identifier of the key, such as the device id. Defaults to None.
+            executor (Optional[Executor], optional): the executor. Defaults to the loop default one.
+
+        Returns:
+            bytes: the image
+        """
+        loop = asyncio.get_running_loop()
+        return await self.async_single_flight.do(
+            self.get_key(operation, user_id, generated_at, access_key, key_id),
+            loop.run_in_executor,
+            executor, render_access_code,
+            operation, user_id, get_bucket_time(generated_at, self.time_bucket), access_key,
+            self.kind, self.scale, self.border, self.compress_level
+        )
@@ -0,0 +1,495 @@
+"""Asyncio HTTP service for the QR Code generation.
+
+Each `PayloadEncoder` operation is exposed as `GET /<operation>`, with its arguments in the query string
+and the response format in `format` (`hex`, the default, `png` or `svg`), with the image `scale` (1 to
+100) and `border` (0 to 20). Times are POSIX seconds or ISO 8601 datetimes and new keys are hex strings.
+The secret keys never travel in the requests: they are given to the server on startup, either as a
+single set of keys or as a `KeyRing` with the keys of each device, selected by the `device_id`
+parameter. For example:
+
+    GET /check_in?user_id=2305947582&generated_at=2025-07-17T15:14&format=png
+
+Payloads are encoded on the event loop, which takes microseconds, while the images are rendered in a
+process pool. Identical image requests that arrive while one is being rendered share its result.
+Connections are kept alive (HTTP/1.1 semantics) until the client closes them or stays idle for
+`keep_alive_timeout` seconds. When `Instrumentation` is enabled (`--metrics`), `GET /metrics` serves
+the latencies of the encoding and signing, and of the matrix building and PNG writing timed in the
+workers, in the Prometheus text format.
+
+Latency target for CHECK_IN generation, with 64 concurrent keep-alive connections: p99 under 10 ms for
+`format=hex` on a single core, and under 200 ms for `format=png` on 4 cores. A PNG takes about 8 ms of
+a worker, so with 64 requests in flight the PNG p99 is mostly queueing: about 64 * 8 ms / workers.
+"""
+import io
+import os
+import json
+import asyncio
+import logging
+import time
+from typing import *
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qsl
+from concurrent.futures import Executor, ProcessPoolExecutor
+from auth.secret_key import SecretKey
+from auth.signer import KeyedSigner
+from auth.key_ring import KeyRing
+from qr_code.encoder import PayloadEncoder, PrivateKeyTypes, get_keys_from_environment
+from qr_code.matrix_builder import MatrixBuilders
+from qr_code.png_writer import PngWriter, INTERACTIVE_COMPRESS_LEVEL
+from qr_code.instrumentation import Instrumentation
+from qr_code.single_flight import AsyncSingleFlight
+from qr_code.render_cache import RenderCache
+from server.pregenerator import CodePregenerator
+
+
+MAX_HEADER_SIZE = 16384
+SCALE_RANGE = (1, 100) # pixels per module; the memory of an image grows with its square
+BORDER_RANGE = (0, 20) # modules
+
+logger = logging.getLogger(__name__)
+
+STATUS_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    431: 'Request Header Fields Too Large',
+    500: 'Internal Server Error',
+}
+
+CONTENT_TYPES = {
+    'hex': 'application/json',
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+
+class RequestError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def render_payload(payload: bytes, kind: str, scale: int, border: int, compress_level: int = INTERACTIVE_COMPRESS_LEVEL) -> bytes:
+    """Renders the QR Code image of the payload. Runs in the worker processes. PNGs are compressed
+    for latency by default, as they are sent once and not stored.
+
+    Args:
+        payload (bytes): the payload
+        kind (str): the image format
+        scale (int): the scale of the QR Code
+        border (int): the border size of the QR Code
+        compress_level (int, optional): the zlib level of PNGs. Defaults to INTERACTIVE_COMPRESS_LEVEL.
+
+    Returns:
+        bytes: the encoded image
+    """
+    buffer = io.BytesIO()
+    PngWriter.write_image(MatrixBuilders.make_qr(payload), buffer, kind, scale, border, compress_level)
+    return buffer.getvalue()
+
+
+def render_timed_payload(payload: bytes, kind: str, scale: int, border: int) -> Tuple[bytes, float, float]:
+    """Renders as `render_payload`, also timing the matrix building and the image writing, which the
+    wrappers of `Instrumentation` do not see in the worker processes.
+
+    Returns:
+        Tuple[bytes, float, float]: the encoded image, and the seconds of `MatrixBuilders.make_qr` and
+            of `PngWriter.write_image`
+    """
+    buffer = io.BytesIO()
+    start = time.perf_counter()
+    modules = MatrixBuilders.make_qr(payload)
+    built = time.perf_counter()
+    PngWriter.write_image(modules, buffer, kind, scale, border, INTERACTIVE_COMPRESS_LEVEL)
+    return buffer.getvalue(), built - start, time.perf_counter() - built
+
+
+class GenerationServer:
+    def __init__(
+        self,
+        keys: Dict[int, Union[bytes, SecretKey]],
+        executor: Optional[Executor] = None,
+        keep_alive_timeout: float = 15.0,
+        pregenerator: Optional[CodePregenerator] = None,
+        key_ring: Optional[KeyRing] = None,
+        image_cache: Optional[RenderCache] = None
+    ):
+        """HTTP server for the QR Code generation.
+
+        Args:
+            keys (Dict[int, Union[bytes, SecretKey]]): the secret keys, by `PrivateKeyTypes`
+            executor (Optional[Executor], optional): the pool that renders the images. Defaults to a
+            process pool with one worker per CPU, shut down when `serve` exits.
+            keep_alive_timeout (float, optional): the seconds an idle connection is kept open. Defaults to 15.
+            pregenerator (Optional[CodePregenerator], optional): the pre-generation of booked slots codes,
+            whose images are served without rendering and which runs along with the server. Defaults to None.
+            key_ring (Optional[KeyRing], optional): the keys of each device, used by the requests with a
+            `device_id` parameter. Defaults to None.
+            image_cache (Optional[RenderCache], optional): the cache of the rendered images, by payload and
+            render options, so a repeated request costs a lookup. Defaults to None.
+        """
+        self.signers = {key_type: KeyedSigner(key) for key_type, key in keys.items()}
+        self.owns_executor = executor is None
+        self.executor = executor or ProcessPoolExecutor(max_workers=os.cpu_count())
+        self.keep_alive_timeout = keep_alive_timeout
+        self.pregenerator = pregenerator
+        self.key_ring = key_ring
+        self.image_cache = image_cache
+        self.single_flight = AsyncSingleFlight()
+        self.operations = {
+            'check_in': self.get_check_in_payload,
+            'check_out': self.get_check_out_payload,
+            'bi_access': self.get_bi_access_payload,
+            'set_time': self.get_set_time_payload,
+            'set_master_key': self.get_set_master_key_payload,
+            'set_config_key': self.get_set_config_key_payload,
+            'set_sync_key': self.get_set_sync_key_payload,
+            'set_access_key': self.get_set_access_key_payload,
+            'blink_n_times': self.get_blink_n_times_payload,
+            'blink_if_sync': self.get_blink_if_sync_payload,
+        }
+
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8080):
+        """Serves the requests until cancelled.
+
+        Args:
+            host (str, optional): the address to bind. Defaults to '127.0.0.1'.
+            port (int, optional): the port to bind. Defaults to 8080.
+        """
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEADER_SIZE)
+        pregeneration = asyncio.create_task(self.pregenerator.run()) if self.pregenerator else None
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if pregeneration is not None:
+                pregeneration.cancel()
+            if self.owns_executor:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Handles the requests of a connection, one after the other, while it is kept alive.
+
+        Args:
+            reader (asyncio.StreamReader): the connection reader
+            writer (asyncio.StreamWriter): the connection writer
+        """
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.keep_alive_timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    break
+                except asyncio.LimitOverrunError:
+                    # the rest of the oversized head is not read, so the connection is closed after the reply
+                    body = json.dumps({'error': f'request head over {MAX_HEADER_SIZE} bytes'}).encode()
+                    GenerationServer.write_response(writer, 431, 'application/json', body, keep_alive=False)
+                    await writer.drain()
+                    break
+
+                try:
+                    method, target, version, headers = GenerationServer.parse_head(head)
+                    content_length = int(headers.get('content-length', 0))
+                    if content_length < 0:
+                        raise ValueError(f'negative Content-Length {content_length}')
+                except ValueError as error:
+                    # the end of a malformed request is unknown, so the connection is closed after the reply
+                    body = json.dumps({'error': f'malformed request: {error}'}).encode()
+                    GenerationServer.write_response(writer, 400, 'application/json', body, keep_alive=False)
+                    await writer.drain()
+                    break
+                keep_alive = GenerationServer.is_keep_alive(version, headers)
+                if content_length:
+                    await reader.readexactly(content_length)
+
+                status, content_type, body = await self.handle_request(method, target)
+                GenerationServer.write_response(writer, status, content_type, body, keep_alive, method == 'HEAD')
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+    def parse_head(head: bytes) -> Tuple[str, str, str, Dict[str, str]]:
+        """Parses the request line and the headers.
+
+        Args:
+            head (bytes): the request head, up to the blank line
+
+        Raises:
+            ValueError: if the request line is malformed
+
+        Returns:
+            Tuple[str, str, str, Dict[str, str]]: the method, target, HTTP version and headers (lowercase names)
+        """
+        lines = head.decode('latin-1').split('\r\n')
+        method, target, version = lines[0].split(' ')
+        headers = {}
+        for line in lines[1:]:
+            name, separator, value = line.partition(':')
+            if separator:
+                headers[name.strip().lower()] = value.strip()
+        return method, target, version, headers
+
+
+    def is_keep_alive(version: str, headers: Dict[str, str]) -> bool:
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+
+    def write_response(
+        writer: asyncio.StreamWriter,
+        status: int,
+        content_type: str,
+        body: bytes,
+        keep_alive: bool,
+        head_only: bool = False
+    ):
+        head = (
+            f'HTTP/1.1 {status} {STATUS_REASONS[status]}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Cache-Control: no-store\r\n'
+            f'Connection: {"keep-alive" if keep_alive else "close"}\r\n'
+            f'\r\n'
+        )
+        writer.write(head.encode('latin-1'))
+        if not head_only:
+            writer.write(body)
+
+
+    async def handle_request(self, method: str, target: str) -> Tuple[int, str, bytes]:
+        """Generates the response of a request.
+
+        Args:
+            method (str): the HTTP method
+            target (str): the request target, with the query string
+
+        Returns:
+            Tuple[int, str, bytes]: the status, content type and body
+        """
+        try:
+            if method not in ('GET', 'HEAD'):
+                raise RequestError(405, f'method {method} not allowed')
+
+            url = urlsplit(target)
+            operation = url.path.strip('/')
+            if operation == 'metrics' and Instrumentation.is_enabled():
+                return 200, 'text/plain; version=0.0.4', Instrumentation.get_prometheus_text().encode()
+            get_payload = self.operations.get(operation)
+            if get_payload is None:
+                raise RequestError(404, f'unknown operation {operation!r}')
+
+            params = dict(parse_qsl(url.query))
+            kind = params.pop('format', 'hex')
+            if kind not in CONTENT_TYPES:
+                raise RequestError(400, f'unknown format {kind!r}')
+            scale = GenerationServer.get_int(params.pop('scale', '25'), 'scale', *SCALE_RANGE)
+            border = GenerationServer.get_int(params.pop('border', '5'), 'border', *BORDER_RANGE)
+
+            if kind == 'hex':
+                payload = get_payload(params)
+                body = json.dumps({'operation': operation, 'payload': payload.hex()}).encode()
+            else:
+                # identical image requests in flight, such as a double click, share one encoding and rendering
+                key = (operation, kind, scale, border, tuple(sorted(params.items())))
+                body = await self.single_flight.do(key, self.get_payload_image, get_payload, params, kind, scale, border)
+            return 200, CONTENT_TYPES[kind], body
+        except RequestError as error:
+            return error.status, 'application/json', json.dumps({'error': str(error)}).encode()
+        except (ValueError, OverflowError, TypeError) as error:
+            return 400, 'application/json', json.dumps({'error': str(error)}).encode()
+        except Exception:
+            # a renderer failure, such as a broken process pool, still gets a reply
+            logger.exception('failed to handle %s %s', method, target)
+            return 500, 'application/json', json.dumps({'error': 'internal server error'}).encode()
+
+
+    async def get_payload_image(
+        self,
+        get_payload: Callable[[Dict[str, str]], bytes],
+        params: Dict[str, str],
+        kind: str,
+        scale: int,
+        border: int
+    ) -> bytes:
+        return await self.get_image(get_payload(params), kind, scale, border)
+
+
+    async def get_image(self, payload: bytes, kind: str, scale: int, border: int) -> bytes:
+        """Gets the pre-generated or cached image of the payload or renders it in the executor.
+        """
+        if self.pregenerator is not None:
+            image = self.pregenerator.get_image(payload, kind, scale, border)
+            if image is not None:
+                return image
+        key = (payload, kind, scale, border)
+        if self.image_cache is not None:
+            image = self.image_cache.get(key)
+            if image is not None:
+                return image
+        loop = asyncio.get_running_loop()
+        if Instrumentation.is_enabled():
+            image, make_qr_seconds, write_image_seconds = await loop.run_in_executor(
+                self.executor, render_timed_payload, payload, kind, scale, border)
+            Instrumentation.observe('MatrixBuilders.make_qr', payload[0], make_qr_seconds)
+            Instrumentation.observe('PngWriter.write_image', payload[0], write_image_seconds)
+        else:
+            image = await loop.run_in_executor(self.executor, render_payload, payload, kind, scale, border)
+        if self.image_cache is not None:
+            self.image_cache.put(key, image)
+        return image
+
+
+    def get_signer(self, key_type: int, params: Dict[str, str]) -> KeyedSigner:
+        """Gets the signer of a key type: from the key ring, for the device of the `device_id` parameter,
+        or else from the server keys.
+        """
+        device_id = params.get('device_id')
+        if device_id is not None:
+            if self.key_ring is None:
+                raise RequestError(400, 'the server has no key ring, device_id is not supported')
+            try:
+                return self.key_ring.get_signer(GenerationServer.get_int(device_id, 'device_id'), key_type)
+            except (KeyError, ValueError):
+                raise RequestError(404, f'device {device_id} has no key of type {key_type}')
+
+        signer = self.signers.get(key_type)
+        if signer is None:
+            raise RequestError(500, f'the server has no key of type {key_type}')
+        return signer
+
+
+    def get_int(value: Optional[str], name: str, minimum: Optional[int] = None, maximum: Optional[int] = None) -> int:
+        if value is None:
+            raise RequestError(400, f'missing {name}')
+        try:
+            number = int(value)
+        except ValueError:
+            raise RequestError(400, f'{name} must be an integer')
+        if (minimum is not None and number < minimum) or (maximum is not None and number > maximum):
+            raise RequestError(400, f'{name} must be between {minimum} and {maximum}')
+        return number
+
+
+    def get_time(value: Optional[str], name: str) -> datetime:
+        """Parses a time parameter, as POSIX seconds or an ISO 8601 datetime. A missing value means now.
+        """
+        if value is None:
+            return datetime.now().replace(microsecond=0)
+        if value.isdigit():
+            return datetime.fromtimestamp(int(value))
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            raise RequestError(400, f'{name} must be POSIX seconds or an ISO 8601 datetime')
+
+
+    def get_key(value: Optional[str], name: str) -> SecretKey:
+        if not value:
+            raise RequestError(400, f'missing {name}')
+        try:
+            return SecretKey(value)
+        except ValueError:
+            raise RequestError(400, f'{name} must be a hex string')
+
+
+    def get_check_in_payload(self, params: Dict[str, str]) -> bytes:
+        return PayloadEncoder.get_check_in_payload(
+            user_id=GenerationServer.get_int(params.get('user_id'), 'user_id'),
+            generated_at=GenerationServer.get_time(params.get('generated_at'), 'generated_at'),
+            access_key=self.get_signer(PrivateKeyTypes.ACCESS_KEY, params)
+        )
+
+
+    def get_check_out_payload(self, params: Dict[str, str]) -> bytes:
+        return PayloadEncoder.get_check_out_payload(
+            user_id=GenerationServer.get_int(params.get('user_id'), 'user_id'),
+            generated_at=GenerationServer.get_time(params.get('generated_at'), 'generated_at'),
+            access_key=self.get_signer(PrivateKeyTypes.ACCESS_KEY, params)
+        )
+
+
+    def get_bi_access_payload(self, params: Dict[str, str]) -> bytes:
+        return PayloadEncoder.get_bi_access_payload(
+            user_id=GenerationServer.get_int(params.get('user_id'), 'user_id'),
+            generated_at=GenerationServer.get_time(params.get('generated_at'), 'generated_at'),
+            access_key=self.get_signer(PrivateKeyTypes.ACCESS_KEY, params)
+        )
+
+
+    def get_set_time_payload(self, params: Dict[str, str]) -> bytes:
+        return PayloadEncoder.get_set_time_payload(
+            sync_time=GenerationServer.get_time(params.get('sync_time'), 'sync_time'),
+            sync_key=self.get_signer(PrivateKeyTypes.SYNC_KEY, params)
+        )
+
+
+    def get_set_master_key_payload(self, params: Dict[str, str]) -> bytes:
+        return PayloadEncoder.get_set_master_key_payload(
+            new_master_key=GenerationServer.get_key(params.get('new_master_key'), 'new_master_key'),
+            old_master_key=self.get_signer(PrivateKeyTypes.MASTER_KEY, params)
+        )
+
+
+    def get_set_config_key_payload(self, params: Dict[str, str]) -> bytes:
+        return PayloadEncoder.get_set_config_key_payload(
+            new_config_key=GenerationServer.get_key(params.get('new_config_key'), 'new_config_key'),
+            master_key=self.get_signer(PrivateKeyTypes.MASTER_KEY, params)
+        )
+
+
+    def get_set_sync_key_payload(self, params: Dict[str, str]) -> bytes:
+        return PayloadEncoder.get_set_sync_key_payload(
+            new_sync_key=GenerationServer.get_key(params.get('new_sync_key'), 'new_sync_key'),
+            config_key=self.get_signer(PrivateKeyTypes.CONFIG_KEY, params)
+        )
+
+
+    def get_set_access_key_payload(self, params: Dict[str, str]) -> bytes:
+        return PayloadEncoder.get_set_access_key_payload(
+            new_access_key=GenerationServer.get_key(params.get('new_access_key'), 'new_access_key'),
+            config_key=self.get_signer(PrivateKeyTypes.CONFIG_KEY, params)
+        )
+
+
+    def get_blink_n_times_payload(self, params: Dict[str, str]) -> bytes:
+        return PayloadEncoder.get_blink_n_times_payload(
+            blink_num=GenerationServer.get_int(params.get('blink_num'), 'blink_num')
+        )
+
+
+    def get_blink_if_sync_payload(self, params: Dict[str, str]) -> bytes:
+        return PayloadEncoder.get_debug_sync_payload(
+            current_time=GenerationServer.get_time(params.get('current_time'), 'current_time')
+        )
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='CAUSP-LOCK QR Code generation server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--key-ring', help='key ring file with the keys of each device')
+    parser.add_argument('--metrics', action='store_true', help='record the encoding latencies and serve them on /metrics')
+    parser.add_argument('--cache-mb', type=int, default=64, help='memory of the rendered images cache, 0 to disable it')
+    args = parser.parse_args()
+
+    if args.metrics:
+        Instrumentation.enable()
+
+    key_ring = KeyRing(args.key_ring) if args.key_ring else None
+    image_cache = RenderCache(args.cache_mb << 20) if args.cache_mb else None
+    server = GenerationServer(get_keys_from_environment(), key_ring=key_ring, image_cache=image_cache)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,226 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+from typing import *
+from datetime import datetime, timedelta
+from concurrent.futures import Executor, ProcessPoolExecutor
+from auth.secret_key import SecretKey
+from auth.signer import KeyedSigner
+from qr_code.encoder import PayloadEncoder, OperationTypes
+from qr_code.bulk_renderer import BulkRenderer
+
+logger = logging.getLogger(__name__)
+
+
+class Reservation(NamedTuple):
+    user_id: int
+    slot_start: datetime
+    operation: int = OperationTypes.CHECK_IN
+
+
+class DueCode(NamedTuple):
+    slot_end: float
+    entry: Tuple[int, int, int] # the (slot start, user id, operation) popped from the reservations heap
+
+
+class CodePregenerator:
+    def __init__(
+        self,
+        access_key: Union[bytes, SecretKey, KeyedSigner],
+        executor: Optional[Executor] = None,
+        capacity: int = 10000,
+        horizon: timedelta = timedelta(hours=2),
+        slot_duration: timedelta = timedelta(hours=1),
+        interval: float = 30.0,
+        kind: str = 'png',
+        scale: int = 25,
+        border: int = 5,
+        chunk_size: int = 32
+    ):
+        """Background pre-generation of the ACCESS codes of booked slots. The codes of a slot embed its
+        start as generated_at, so they are fully determined by the reservation and can be encoded and
+        rendered ahead of the demand peak right before the slot. Reservations are kept in a heap by slot
+        start; the ones starting within `horizon` are rendered into a store bounded to `capacity` codes,
+        earliest slots first, and each code is evicted once its slot is over.
+
+        Args:
+            access_key (Union[bytes, SecretKey, KeyedSigner]): the secret access key
+            executor (Optional[Executor], optional): the pool that renders the images. Defaults to a
+            process pool with one worker per CPU.
+            capacity (int, optional): the maximum number of stored codes. Defaults to 10000.
+            horizon (timedelta, optional): how far ahead of the slot start the codes are generated. Defaults to 2 hours.
+            slot_duration (timedelta, optional): the duration of a slot. Defaults to 1 hour.
+            interval (float, optional): the seconds between pre-generation rounds. Defaults to 30.
+            kind (str, optional): the image format. Defaults to 'png'.
+            scale (int, optional): the scale of the QR Codes. Defaults to 25.
+            border (int, optional): the border size of the QR Codes. Defaults to 5.
+            chunk_size (int, optional): the number of codes sent to a worker at a time. Defaults to 32.
+        """
+        self.signer = access_key if type(access_key) == KeyedSigner else KeyedSigner(access_key)
+        self.executor = executor or ProcessPoolExecutor(max_workers=os.cpu_count())
+        self.capacity = capacity
+        self.horizon = horizon
+        self.slot_duration = slot_duration
+        self.interval = interval
+        self.kind = kind
+        self.scale = scale
+        self.border = border
+        self.chunk_size = chunk_size
+
+        self.reservations: List[Tuple[float, int, int]] = [] # heap of (slot start, user id, operation)
+        self.images: Dict[bytes, bytes] = {} # payload -> image
+        self.expirations: List[Tuple[float, bytes]] = [] # heap of (slot end, payload)
+        self.hits = 0
+        self.misses = 0
+
+
+    def add_reservations(self, reservations: Iterable[Reservation]):
+        """Schedules the codes of the given reservations for pre-generation.
+
+        Args:
+            reservations (Iterable[Reservation]): the reservations
+        """
+        for reservation in reservations:
+            slot_start = int(reservation.slot_start.timestamp())
+            heapq.heappush(self.reservations, (slot_start, reservation.user_id, reservation.operation))
+
+
+    def get_image(self, payload: bytes, kind: str = 'png', scale: int = 25, border: int = 5) -> Optional[bytes]:
+        """Gets the pre-generated image of the payload, if there is one with the given render options.
+
+        Args:
+            payload (bytes): the payload
+            kind (str, optional): the image format. Defaults to 'png'.
+            scale (int, optional): the scale of the QR Code. Defaults to 25.
+            border (int, optional): the border size of the QR Code. Defaults to 5.
+
+        Returns:
+            Optional[bytes]: the encoded image, or None
+        """
+        if (kind, scale, border) != (self.kind, self.scale, self.border):
+            return None
+        image = self.images.get(payload)
+        if image is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return image
+
+
+    def get_payload(self, user_id: int, slot_start: int, operation: int) -> bytes:
+        get_payload = {
+            OperationTypes.CHECK_IN: PayloadEncoder.get_check_in_payload,
+            OperationTypes.CHECK_OUT: PayloadEncoder.get_check_out_payload,
+            OperationTypes.BI_ACCESS: PayloadEncoder.get_bi_access_payload,
+        }[operation]
+        return get_payload(user_id=user_id, generated_at=datetime.fromtimestamp(slot_start), access_key=self.signer)
+
+
+    def evict_expired(self, now: float) -> int:
+        """Evicts the codes whose slot is over.
+
+        Args:
+            now (float): the current POSIX time
+
+        Returns:
+            int: the number of evicted codes
+        """
+        evicted = 0
+        while self.expirations and self.expirations[0][0] <= now:
+            _, payload = heapq.heappop(self.expirations)
+            if self.images.pop(payload, None) is not None:
+                evicted += 1
+        return evicted
+
+
+    def get_due_payloads(self, now: float) -> Dict[bytes, DueCode]:
+        """Pops the reservations whose slot starts within the horizon, as long as the store has room,
+        and encodes their payloads. Reservations whose slot is already over, or that cannot be encoded,
+        are dropped.
+
+        Args:
+            now (float): the current POSIX time
+
+        Returns:
+            Dict[bytes, DueCode]: the payloads, with their slot end and reservation
+        """
+        horizon_end = now + self.horizon.total_seconds()
+        slot_seconds = self.slot_duration.total_seconds()
+        room = self.capacity - len(self.images)
+
+        due = {}
+        while self.reservations and len(due) < room and self.reservations[0][0] <= horizon_end:
+            entry = heapq.heappop(self.reservations)
+            slot_start, user_id, operation = entry
+            slot_end = slot_start + slot_seconds
+            if slot_end <= now:
+                continue
+            try:
+                payload = self.get_payload(user_id, slot_start, operation)
+            except (KeyError, ValueError, OverflowError, TypeError) as error:
+                logger.warning('dropping the reservation of user %s at %s: %s', user_id, slot_start, error)
+                continue
+            if payload not in self.images:
+                due[payload] = DueCode(slot_end, entry)
+        return due
+
+
+    async def pregenerate(self, now: Optional[float] = None) -> int:
+        """Runs a pre-generation round: evicts the expired codes and renders the due ones, in chunks
+        across the executor. The reservations of the chunks that fail to render are put back in the
+        heap, for the next round, before the first error is raised.
+
+        Args:
+            now (Optional[float], optional): the current POSIX time. Defaults to time.time().
+
+        Raises:
+            Exception: the first rendering error of the round
+
+        Returns:
+            int: the number of rendered codes
+        """
+        now = time.time() if now is None else now
+        self.evict_expired(now)
+        due = self.get_due_payloads(now)
+        if not due:
+            return 0
+
+        loop = asyncio.get_running_loop()
+        named_payloads = [(payload.hex(), payload) for payload in due]
+        chunks = [named_payloads[start:start + self.chunk_size] for start in range(0, len(named_payloads), self.chunk_size)]
+        futures = [
+            loop.run_in_executor(self.executor, BulkRenderer.render_chunk, chunk, None, self.kind, self.scale, self.border)
+            for chunk in chunks
+        ]
+
+        rendered = 0
+        first_error = None
+        for chunk, chunk_results in zip(chunks, await asyncio.gather(*futures, return_exceptions=True)):
+            if isinstance(chunk_results, BaseException):
+                for _, payload in chunk:
+                    heapq.heappush(self.reservations, due[payload].entry)
+                first_error = first_error or chunk_results
+                continue
+            for name, image in chunk_results:
+                payload = bytes.fromhex(name)
+                self.images[payload] = image
+                heapq.heappush(self.expirations, (due[payload].slot_end, payload))
+                rendered += 1
+        if first_error is not None:
+            raise first_error
+        return rendered
+
+
+    async def run(self):
+        """Runs pre-generation rounds every `interval` seconds, until cancelled. A failed round is
+        logged and the next one retries its codes, so a transient renderer failure does not stop the
+        pre-generation for the life of the server.
+        """
+        while True:
+            try:
+                await self.pregenerate()
+            except Exception:
+                logger.exception('pre-generation round failed')
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from auth.key_ring import KeyRing, KEY_LENGTH, KEY_TYPES_COUNT
+from provisioning.fleet_provisioner import FleetProvisioner, PROVISIONING_CODES
+
+
+def render_until(failing_item: int):
+    """Gets a fake `BulkRenderer.render` that sends placeholder images to the callback and fails on
+    the given item.
+    """
+    def render(named_payloads, callback, **options):
+        for index, (name, _) in enumerate(named_payloads):
+            if index == failing_item:
+                raise RuntimeError('renderer failed')
+            callback(name, b'image')
+        return len(named_payloads)
+    return render
+
+
+class FleetProvisionerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.key_ring = KeyRing.create(os.path.join(self.directory.name, 'keys.ring'), capacity=8)
+        self.old_keys = {}
+        for device_id in (1, 2):
+            self.old_keys[device_id] = {key_type: os.urandom(KEY_LENGTH) for key_type in range(KEY_TYPES_COUNT)}
+            self.key_ring.set_keys(device_id, self.old_keys[device_id])
+        self.provisioner = FleetProvisioner(self.key_ring, os.path.join(self.directory.name, 'bundles'))
+
+
+    def tearDown(self):
+        self.key_ring.close()
+        self.directory.cleanup()
+
+
+    def get_keys(self, device_id: int):
+        return {key_type: self.key_ring.get_key_bytes(device_id, key_type) for key_type in range(KEY_TYPES_COUNT)}
+
+
+    def test_failed_rendering_keeps_the_old_keys(self):
+        with mock.patch('provisioning.fleet_provisioner.BulkRenderer.render', render_until(0)):
+            with self.assertRaises(RuntimeError):
+                self.provisioner.provision([1, 2])
+        self.assertEqual(self.get_keys(1), self.old_keys[1])
+        self.assertEqual(self.get_keys(2), self.old_keys[2])
+        self.assertEqual(os.listdir(self.provisioner.output_dir), [])
+
+
+    def test_only_written_bundles_replace_the_keys(self):
+        with mock.patch('provisioning.fleet_provisioner.BulkRenderer.render', render_until(len(PROVISIONING_CODES))):
+            with self.assertRaises(RuntimeError):
+                self.provisioner.provision([1, 2])
+        self.assertNotEqual(self.get_keys(1), self.old_keys[1])
+        self.assertEqual(self.get_keys(2), self.old_keys[2])
+        self.assertEqual(os.listdir(self.provisioner.output_dir), ['device_1.zip'])
+
+
+    def test_repeated_devices_are_rejected(self):
+        with mock.patch('provisioning.fleet_provisioner.BulkRenderer.render', render_until(-1)):
+            with self.assertRaises(ValueError):
+                self.provisioner.provision([1, 2, 1])
+        self.assertEqual(self.get_keys(1), self.old_keys[1])
+        self.assertEqual(self.get_keys(2), self.old_keys[2])
+        self.assertFalse(os.path.exists(self.provisioner.output_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()